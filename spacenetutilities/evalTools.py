@@ -1,8 +1,17 @@
 import numpy as np
-import geoTools as gT
+from spacenetutilities import geoTools as gT
+import shapely
 from shapely.geometry import mapping
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.optimize import linear_sum_assignment
 import fiona
 from tqdm import tqdm
+import heapq
+import hashlib
+import json
+import shutil
+import tempfile
 import os
 
 def iou(test_poly, truth_polys, truth_index=[]):
@@ -30,6 +39,191 @@ def iou(test_poly, truth_polys, truth_index=[]):
 
     return iou_list, fidlistArray
 
+
+def to_geometry_array(polys):
+    """Return polys as a 1D numpy object array of shapely geometries"""
+
+    geomArray = np.empty(len(polys), dtype=object)
+    geomArray[:] = list(polys)
+
+    return geomArray
+
+
+def iou_batch(test_polys, truth_polys):
+    """Calculate the IoU of every overlapping proposal/truth pair of an image in one pass.
+
+       Candidate pairs are found with a single bulk STRtree query on the polygon bounds (the same
+       candidates the per polygon rtree search returns), intersection and union areas are then
+       computed for all pairs at once with shapely vectorized functions.
+
+       Keyword arguments:
+       test_polys -- list or array of shapely proposal polygons
+       truth_polys -- list or array of shapely ground truth polygons
+
+       returns (test_idx, truth_idx, iou_values) numpy arrays with one entry per candidate pair,
+       sorted by test_idx then truth_idx
+    """
+
+    test_polys = to_geometry_array(test_polys)
+    truth_polys = to_geometry_array(truth_polys)
+
+    if len(test_polys) == 0 or len(truth_polys) == 0:
+        return np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([], dtype=np.float64)
+
+    # only Polygon (3) and MultiPolygon (6) proposals are searched
+    test_type = shapely.get_type_id(test_polys)
+    test_search = np.isin(test_type, [3, 6])
+
+    # invalid proposals are repaired the same way iou does
+    invalid = test_search & ~shapely.is_valid(test_polys)
+    if invalid.any():
+        test_polys = test_polys.copy()
+        test_polys[invalid] = shapely.buffer(test_polys[invalid], 0.0)
+
+    tree = shapely.STRtree(truth_polys)
+    test_idx, truth_idx = tree.query(test_polys[test_search])
+    test_idx = np.flatnonzero(test_search)[test_idx]
+
+    order = np.lexsort((truth_idx, test_idx))
+    test_idx = test_idx[order]
+    truth_idx = truth_idx[order]
+
+    test_pair = test_polys[test_idx]
+    truth_pair = truth_polys[truth_idx]
+
+    intersection_result = shapely.intersection(test_pair, truth_pair)
+    intersection_area = shapely.area(intersection_result)
+    union_area = shapely.area(shapely.union(test_pair, truth_pair))
+
+    # non areal intersections (points, lines, collections) score 0 as in iou
+    areal = np.isin(shapely.get_type_id(intersection_result), [3, 6]) & (union_area > 0)
+    iou_values = np.zeros(len(test_idx), dtype=np.float64)
+    iou_values[areal] = intersection_area[areal] / union_area[areal]
+
+    return test_idx, truth_idx, iou_values
+
+
+def greedy_match(test_idx, truth_idx, iou_values, test_count, threshold=0.5):
+    """Greedily match proposals to truth polygons in proposal order.
+
+       Each proposal takes the highest IoU truth polygon that has not already been matched, exactly
+       like score does when it deletes matched polygons from the rtree index.
+
+       Keyword arguments:
+       test_idx, truth_idx, iou_values -- candidate pairs as returned by iou_batch
+       test_count -- number of proposals
+       threshold -- IoU needed for a True Positive (default =0.5)
+
+       returns (maxiou, match) numpy arrays of length test_count.  match is the matched truth index
+       or -1 for a False Positive
+    """
+
+    maxiou = np.zeros(test_count, dtype=np.float64)
+    match = np.full(test_count, -1, dtype=np.intp)
+
+    if len(test_idx) == 0:
+        return maxiou, match
+
+    starts = np.searchsorted(test_idx, np.arange(test_count + 1))
+    truth_list = truth_idx.tolist()
+    iou_list = iou_values.tolist()
+    matched = set()
+
+    for test_id in np.flatnonzero(np.diff(starts)).tolist():
+        best_iou = 0
+        best_fid = -1
+        for pair_id in range(starts[test_id], starts[test_id + 1]):
+            fid = truth_list[pair_id]
+            if fid in matched:
+                continue
+            if best_fid == -1 or iou_list[pair_id] > best_iou:
+                best_iou = iou_list[pair_id]
+                best_fid = fid
+
+        maxiou[test_id] = best_iou
+        if best_fid != -1 and best_iou >= threshold:
+            matched.add(best_fid)
+            match[test_id] = best_fid
+
+    return maxiou, match
+
+
+def optimal_match(test_idx, truth_idx, iou_values, test_count, truth_count, threshold=0.5):
+    """Match proposals to truth polygons with an optimal one to one assignment.
+
+       Only pairs with IoU >= threshold can become True Positives, so the sparse proposal by truth
+       IoU matrix is reduced to those pairs and split into connected components of the overlap
+       graph.  Components with a single pair are matched directly, every other component is solved
+       with linear_sum_assignment on its own small matrix.  The assignment maximizes the number of
+       True Positives and then the total IoU of the matched pairs, so the result does not depend on
+       proposal order.
+
+       Keyword arguments:
+       test_idx, truth_idx, iou_values -- candidate pairs as returned by iou_batch
+       test_count -- number of proposals
+       truth_count -- number of truth polygons
+       threshold -- IoU needed for a True Positive (default =0.5)
+
+       returns (maxiou, match) numpy arrays of length test_count.  maxiou is the IoU of the matched
+       pair or the best IoU of an unmatched proposal, match is the matched truth index or -1
+    """
+
+    maxiou = np.zeros(test_count, dtype=np.float64)
+    match = np.full(test_count, -1, dtype=np.intp)
+
+    if len(test_idx) == 0:
+        return maxiou, match
+
+    np.maximum.at(maxiou, test_idx, iou_values)
+
+    keep = iou_values >= threshold
+    test_idx = test_idx[keep]
+    truth_idx = truth_idx[keep]
+    iou_values = iou_values[keep]
+
+    if len(test_idx) == 0:
+        return maxiou, match
+
+    # bipartite overlap graph, proposals are nodes 0..test_count-1 and truths follow
+    node_count = test_count + truth_count
+    graph = sparse.coo_matrix((np.ones(len(test_idx), dtype=np.int8), (test_idx, truth_idx + test_count)),
+                              shape=(node_count, node_count))
+    component_count, labels = connected_components(graph, directed=False)
+
+    edge_component = labels[test_idx]
+    edge_count = np.bincount(edge_component, minlength=component_count)
+
+    # components made of one pair need no assignment
+    single = edge_count[edge_component] == 1
+    match[test_idx[single]] = truth_idx[single]
+    maxiou[test_idx[single]] = iou_values[single]
+
+    multi = np.flatnonzero(~single)
+    multi = multi[np.argsort(edge_component[multi], kind='stable')]
+    bounds = np.flatnonzero(np.diff(edge_component[multi])) + 1
+
+    for edges in np.split(multi, bounds):
+        if len(edges) == 0:
+            continue
+        rows, row_idx = np.unique(test_idx[edges], return_inverse=True)
+        cols, col_idx = np.unique(truth_idx[edges], return_inverse=True)
+
+        # a bonus larger than any match count makes one more True Positive outweigh any IoU gain
+        bonus = min(len(rows), len(cols)) + 1
+        weight = np.zeros((len(rows), len(cols)), dtype=np.float64)
+        weight[row_idx, col_idx] = bonus + iou_values[edges]
+
+        assigned_rows, assigned_cols = linear_sum_assignment(weight, maximize=True)
+        paired = weight[assigned_rows, assigned_cols] > 0
+        assigned_rows = assigned_rows[paired]
+        assigned_cols = assigned_cols[paired]
+
+        match[rows[assigned_rows]] = cols[assigned_cols]
+        maxiou[rows[assigned_rows]] = weight[assigned_rows, assigned_cols] - bonus
+
+    return maxiou, match
+
+
 def write_geojson(geojson_name,
                   feature_list,
                   output_crs={'init': 'epsg:4326'},
@@ -123,15 +317,77 @@ def score(test_polys, truth_polys, threshold=0.5, truth_index=[],
     return true_pos_count, false_pos_count, false_neg_count
 
 
-def evalfunction(image_id, test_polys, truth_polys, truth_index,
+def score_batch(test_polys, truth_polys, threshold=0.5,
+                resultGeoJsonName=[],
+                imageId=[],
+                matching='greedy'):
+    """Score an image using iou_batch and greedy_match or optimal_match.
+
+       With matching='greedy' returns the same (true_pos_count, false_pos_count, false_neg_count)
+       as score, without building or mutating an rtree index.  matching='optimal' uses
+       optimal_match and is independent of proposal order.
+    """
+
+    truth_poly_count = len(truth_polys)
+
+    if resultGeoJsonName:
+        if not imageId:
+            imageId = os.path.basename(os.path.splitext(resultGeoJsonName)[0])
+
+    test_idx, truth_idx, iou_values = iou_batch(test_polys, truth_polys)
+    if matching == 'optimal':
+        maxiou, match = optimal_match(test_idx, truth_idx, iou_values, len(test_polys), truth_poly_count,
+                                      threshold=threshold)
+    elif matching == 'greedy':
+        maxiou, match = greedy_match(test_idx, truth_idx, iou_values, len(test_polys), threshold=threshold)
+    else:
+        raise ValueError("matching must be 'greedy' or 'optimal', not {}".format(matching))
+
+    true_pos_count = int(np.count_nonzero(match >= 0))
+    false_pos_count = len(test_polys) - true_pos_count
+    false_neg_count = truth_poly_count - true_pos_count
+
+    if resultGeoJsonName:
+        feature_list = []
+        for test_poly, test_iou, fid in zip(test_polys, maxiou.tolist(), match.tolist()):
+            feature = {'geometry': mapping(test_poly),
+                       'properties': {'ImageId': imageId,
+                                      'IOUScore': test_iou,
+                                      'BuildingId': fid
+                                      }
+                       }
+            feature_list.append(feature)
+
+        write_geojson(resultGeoJsonName, feature_list)
+
+    return true_pos_count, false_pos_count, false_neg_count
+
+
+def evalfunction(image_id, test_polys, truth_polys, truth_index=[],
                  resultGeoJsonName=[],
-                 threshold = 0.5):
+                 threshold = 0.5,
+                 batchIoU=True,
+                 matching='greedy'):
+    """Score one image and return ((F1score, true_pos_count, false_pos_count, false_neg_count), image_id)
+
+       Keyword arguments:
+       batchIoU -- use score_batch instead of the per proposal rtree search in score (default =True)
+       matching -- 'greedy' matches in proposal order, 'optimal' solves the assignment with
+                   optimal_match (always uses score_batch) (default ='greedy')
+    """
 
 
     if len(truth_polys)==0:
         true_pos_count = 0
         false_pos_count = len(test_polys)
         false_neg_count = 0
+    elif batchIoU or matching != 'greedy':
+        true_pos_count, false_pos_count, false_neg_count = score_batch(test_polys, truth_polys,
+                                                                       resultGeoJsonName=resultGeoJsonName,
+                                                                       imageId=image_id,
+                                                                       threshold=threshold,
+                                                                       matching=matching
+                                                                       )
     else:
         true_pos_count, false_pos_count, false_neg_count = score(test_polys, truth_polys.tolist(),
                                                                  truth_index=truth_index,
@@ -141,6 +397,64 @@ def evalfunction(image_id, test_polys, truth_polys, truth_index,
                                                                  )
 
 
+    return (calculate_f1(true_pos_count, false_pos_count, false_neg_count), image_id)
+
+
+def evalfunction_sweep(image_id, test_polys, truth_polys, thresholds=[0.5],
+                       test_confidences=[],
+                       apThreshold=0.5,
+                       matching='greedy'):
+    """Score one image at several IoU thresholds from a single IoU table.
+
+       The candidate pairs and their IoU are computed once with iou_batch and reused for every
+       threshold and for the confidence ranked matching used by average precision.
+
+       Keyword arguments:
+       thresholds -- list of IoU thresholds (default =[0.5])
+       test_confidences -- confidence of each proposal.  If empty, proposals are ranked in file order
+       apThreshold -- IoU threshold of the confidence ranked matching (default =0.5)
+       matching -- 'greedy' or 'optimal' matching for the threshold counts (default ='greedy')
+
+       returns (count_list, image_id, (confidences, is_true_pos, truth_count)) where count_list holds
+       one (F1score, true_pos_count, false_pos_count, false_neg_count) tuple per threshold
+    """
+
+    test_count = len(test_polys)
+    truth_count = len(truth_polys)
+    test_idx, truth_idx, iou_values = iou_batch(test_polys, truth_polys)
+
+    count_list = []
+    for threshold in thresholds:
+        if matching == 'optimal':
+            maxiou, match = optimal_match(test_idx, truth_idx, iou_values, test_count, truth_count,
+                                          threshold=threshold)
+        else:
+            maxiou, match = greedy_match(test_idx, truth_idx, iou_values, test_count, threshold=threshold)
+
+        true_pos_count = int(np.count_nonzero(match >= 0))
+        count_list.append(calculate_f1(true_pos_count, test_count - true_pos_count, truth_count - true_pos_count))
+
+    # rank proposals by descending confidence and match greedily in that order
+    if len(test_confidences) == test_count and test_count > 0:
+        confidences = np.asarray(test_confidences, dtype=np.float64)
+    else:
+        confidences = np.linspace(1.0, 0.0, test_count)
+    rank_order = np.argsort(-confidences, kind='stable')
+    rank = np.empty(test_count, dtype=np.intp)
+    rank[rank_order] = np.arange(test_count)
+
+    ranked_test_idx = rank[test_idx]
+    order = np.lexsort((truth_idx, ranked_test_idx))
+    maxiou, match = greedy_match(ranked_test_idx[order], truth_idx[order], iou_values[order], test_count,
+                                 threshold=apThreshold)
+    is_true_pos = match[rank] >= 0
+
+    return count_list, image_id, (confidences, is_true_pos, truth_count)
+
+
+def calculate_f1(true_pos_count, false_pos_count, false_neg_count):
+    """returns (F1score, true_pos_count, false_pos_count, false_neg_count)"""
+
     if (true_pos_count > 0):
 
         precision = float(true_pos_count) / (float(true_pos_count) + float(false_pos_count))
@@ -148,20 +462,455 @@ def evalfunction(image_id, test_polys, truth_polys, truth_index,
         F1score = 2.0 * precision * recall / (precision + recall)
     else:
         F1score = 0
-    return ((F1score, true_pos_count, false_pos_count, false_neg_count), image_id)
 
+    return (F1score, true_pos_count, false_pos_count, false_neg_count)
+
+
+def precision_recall_curve(confidence_list, is_true_pos_list, truth_count):
+    """Confidence ranked precision recall curve over many images.
+
+       Keyword arguments:
+       confidence_list -- list of per image proposal confidence arrays
+       is_true_pos_list -- list of per image True Positive flag arrays (see evalfunction_sweep)
+       truth_count -- total number of truth polygons
+
+       returns (precision, recall, confidence) numpy arrays, one entry per proposal in descending
+       confidence order
+    """
+
+    if confidence_list:
+        confidences = np.concatenate([np.asarray(x, dtype=np.float64) for x in confidence_list])
+        is_true_pos = np.concatenate([np.asarray(x, dtype=bool) for x in is_true_pos_list])
+    else:
+        confidences = np.array([], dtype=np.float64)
+        is_true_pos = np.array([], dtype=bool)
+
+    order = np.argsort(-confidences, kind='stable')
+    true_pos_cum = np.cumsum(is_true_pos[order])
+    false_pos_cum = np.cumsum(~is_true_pos[order])
+
+    precision = true_pos_cum / np.maximum(true_pos_cum + false_pos_cum, 1)
+    recall = true_pos_cum / float(max(truth_count, 1))
 
-def  create_eval_function_input(image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly):
+    return precision, recall, confidences[order]
+
+
+def average_precision(precision, recall):
+    """Area under the precision recall curve with all point interpolation (PASCAL VOC 2010+)"""
+
+    recall_envelope = np.concatenate([[0.0], recall, [1.0]])
+    precision_envelope = np.concatenate([[0.0], precision, [0.0]])
+    precision_envelope = np.maximum.accumulate(precision_envelope[::-1])[::-1]
+
+    step = np.flatnonzero(recall_envelope[1:] != recall_envelope[:-1])
+
+    return float(np.sum((recall_envelope[step + 1] - recall_envelope[step]) * precision_envelope[step + 1]))
+
+
+def  create_eval_function_input(image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly,
+                                createIndex=True):
 
     evalFunctionInput = []
 
 
-    for image_id in image_ids:
-        test_polys = prop_polysPoly[np.argwhere(prop_polysIdList == image_id).flatten()]
-        truth_polys = sol_polysPoly[np.argwhere(sol_polysIdsList == image_id).flatten()]
-        truth_index = gT.create_rtree_from_poly(truth_polys)
+    image_ids = list(image_ids)
+    prop_rows = group_rows_by_image(image_ids, prop_polysIdList)
+    sol_rows = group_rows_by_image(image_ids, sol_polysIdsList)
+
+    for image_id, prop_index, sol_index in zip(image_ids, prop_rows, sol_rows):
+        test_polys = prop_polysPoly[prop_index]
+        truth_polys = sol_polysPoly[sol_index]
+        # the rtree index is only used by score, score_batch builds its own STRtree
+        if createIndex:
+            truth_index = gT.create_rtree_from_poly(truth_polys)
+        else:
+            truth_index = []
         evalFunctionInput.append([image_id, test_polys, truth_polys, truth_index])
 
     return evalFunctionInput
 
 
+def create_eval_shards(image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly,
+                       shard_count=1,
+                       threshold=0.5,
+                       matching='greedy',
+                       resultGeoJsonBase=''):
+    """Pack the evaluation input of all images into shards for evalfunction_shard.
+
+       Each shard holds the proposals and truth polygons of its images as one compact WKB buffer
+       (see geoTools.geomListToWKBBuffer) so nothing but bytes and integer arrays is pickled to the
+       worker, which builds its own spatial index.  Images are assigned largest first to the least
+       loaded shard so shards have a similar amount of work.
+
+       Keyword arguments:
+       image_ids -- list of ImageIds to evaluate, results keep this order
+       prop_polysIdList, prop_polysPoly -- ImageId and polygon arrays of the proposals
+       sol_polysIdsList, sol_polysPoly -- ImageId and polygon arrays of the ground truth
+       shard_count -- number of shards to create (default =1)
+       threshold, matching -- passed to evalfunction
+       resultGeoJsonBase -- if set, each image writes resultGeoJsonBase+"_"+ImageId+".geojson"
+
+       returns list of shard dicts
+    """
+
+    image_ids = list(image_ids)
+    prop_rows = group_rows_by_image(image_ids, prop_polysIdList)
+    sol_rows = group_rows_by_image(image_ids, sol_polysIdsList)
+
+    # pairwise work grows with both the proposal and the truth count of an image
+    cost = [(len(prop_rows[i]) + 1) * (len(sol_rows[i]) + 1) for i in range(len(image_ids))]
+    shard_count = max(1, min(shard_count, len(image_ids)))
+    shard_load = [(0, shard_id) for shard_id in range(shard_count)]
+    shard_images = [[] for _ in range(shard_count)]
+    for image_pos in np.argsort(cost, kind='stable')[::-1].tolist():
+        load, shard_id = heapq.heappop(shard_load)
+        shard_images[shard_id].append(image_pos)
+        heapq.heappush(shard_load, (load + cost[image_pos], shard_id))
+
+    shard_list = []
+    for image_pos_list in shard_images:
+        if not image_pos_list:
+            continue
+        image_pos_list.sort()
+        prop_index = [prop_rows[image_pos] for image_pos in image_pos_list]
+        sol_index = [sol_rows[image_pos] for image_pos in image_pos_list]
+        test_wkb, test_wkb_offsets = gT.geomListToWKBBuffer(prop_polysPoly[np.concatenate(prop_index)])
+        truth_wkb, truth_wkb_offsets = gT.geomListToWKBBuffer(sol_polysPoly[np.concatenate(sol_index)])
+
+        shard = {'imagePositions': image_pos_list,
+                 'imageIds': [image_ids[image_pos] for image_pos in image_pos_list],
+                 'testCounts': np.array([len(x) for x in prop_index], dtype=np.int64),
+                 'truthCounts': np.array([len(x) for x in sol_index], dtype=np.int64),
+                 'testWKB': test_wkb,
+                 'testWKBOffsets': test_wkb_offsets,
+                 'truthWKB': truth_wkb,
+                 'truthWKBOffsets': truth_wkb_offsets,
+                 'threshold': threshold,
+                 'matching': matching,
+                 'resultGeoJsonBase': resultGeoJsonBase
+                 }
+        shard_list.append(shard)
+
+    return shard_list
+
+
+def evalfunction_shard(shard):
+    """Evaluate every image of a shard created by create_eval_shards.
+
+       returns list of (image position, evalfunction result) tuples
+    """
+
+    test_polys = gT.wkbBufferToGeomArray(shard['testWKB'], shard['testWKBOffsets'])
+    truth_polys = gT.wkbBufferToGeomArray(shard['truthWKB'], shard['truthWKBOffsets'])
+    test_bounds = np.concatenate([[0], np.cumsum(shard['testCounts'])])
+    truth_bounds = np.concatenate([[0], np.cumsum(shard['truthCounts'])])
+
+    result_list = []
+    for idx, (image_pos, image_id) in enumerate(zip(shard['imagePositions'], shard['imageIds'])):
+        if shard['resultGeoJsonBase'] != '':
+            resultGeoJsonName = shard['resultGeoJsonBase'] + "_" + image_id + ".geojson"
+        else:
+            resultGeoJsonName = []
+
+        result = evalfunction(image_id,
+                              test_polys[test_bounds[idx]:test_bounds[idx + 1]],
+                              truth_polys[truth_bounds[idx]:truth_bounds[idx + 1]],
+                              resultGeoJsonName=resultGeoJsonName,
+                              threshold=shard['threshold'],
+                              matching=shard['matching'])
+        result_list.append((image_pos, result))
+
+    return result_list
+
+
+def group_rows_by_image(image_ids, polysIdList):
+    """Return a list with the row indices of polysIdList for each entry of image_ids.
+
+       Rows are grouped with one stable sort, O(rows log rows), instead of a scan per image.
+    """
+
+    polysIdList = np.asarray(polysIdList)
+    order = np.argsort(polysIdList, kind='stable')
+    sorted_ids = polysIdList[order]
+
+    row_list = []
+    for image_id in image_ids:
+        start = np.searchsorted(sorted_ids, image_id, side='left')
+        end = np.searchsorted(sorted_ids, image_id, side='right')
+        row_list.append(order[start:end])
+
+    return row_list
+
+
+def stream_eval_function_input(summaryTruthFile, summaryProposalFile, minPolygonSize=0,
+                               truthWktColumn='PolygonWKT_Pix',
+                               proposalWktColumn='',
+                               chunksize=100000,
+                               tmpDirectory=None):
+    """Yield [image_id, test_polys, truth_polys, []] for every ImageId of a truth and a proposal csv.
+
+       Both csv files are sorted by ImageId once with geoTools.readwktcsv_sorted_blocks and walked
+       together, so only about chunksize rows of each file are parsed and held in memory at a time.
+       Images are yielded in sorted ImageId order, including images found in only one of the files.
+       Rows with BuildingId == -1 and truth polygons with area <= minPolygonSize are dropped as in
+       evaluateSpaceNetSolution.
+    """
+
+    truth_iter = iter_image_polys(gT.readwktcsv_sorted_blocks(summaryTruthFile, wktColumn=truthWktColumn,
+                                                              chunksize=chunksize, tmpDirectory=tmpDirectory),
+                                  minPolygonSize=minPolygonSize)
+    prop_iter = iter_image_polys(gT.readwktcsv_sorted_blocks(summaryProposalFile, wktColumn=proposalWktColumn,
+                                                             chunksize=chunksize, tmpDirectory=tmpDirectory))
+
+    truth_item = next(truth_iter, None)
+    prop_item = next(prop_iter, None)
+    while truth_item is not None or prop_item is not None:
+        if prop_item is None or (truth_item is not None and truth_item[0] < prop_item[0]):
+            image_id = truth_item[0]
+        else:
+            image_id = prop_item[0]
+
+        if truth_item is not None and truth_item[0] == image_id:
+            truth_polys = truth_item[1]
+            truth_item = next(truth_iter, None)
+        else:
+            truth_polys = to_geometry_array([])
+
+        if prop_item is not None and prop_item[0] == image_id:
+            test_polys = prop_item[1]
+            prop_item = next(prop_iter, None)
+        else:
+            test_polys = to_geometry_array([])
+
+        yield [image_id, test_polys, truth_polys, []]
+
+
+def iter_image_polys(block_iter, minPolygonSize=-1):
+    """Yield (image_id, polygon array) from GeoDataFrame blocks sorted by ImageId.
+
+       Every ImageId is yielded, rows with BuildingId == -1 or area <= minPolygonSize are dropped
+       from its polygon array.
+    """
+
+    for block_df in block_iter:
+        image_id_list = block_df['ImageId'].values.astype(str)
+        polys = to_geometry_array(block_df.geometry.values)
+        keep = block_df['BuildingId'].values != -1
+        if minPolygonSize >= 0:
+            keep &= shapely.area(polys) > minPolygonSize
+
+        image_ids, starts = np.unique(image_id_list, return_index=True)
+        ends = np.append(starts[1:], len(image_id_list))
+        for image_id, start, end in zip(image_ids.tolist(), starts.tolist(), ends.tolist()):
+            yield image_id, polys[start:end][keep[start:end]]
+
+
+def truth_cache_key(summaryTruthFile, wktColumn='PolygonWKT_Pix'):
+    """sha1 of the truth file content, the geometry column and the cache layout, used to name its truth cache"""
+
+    sha = hashlib.sha1()
+    sha.update(b'truth_cache_v2')
+    sha.update(wktColumn.encode('utf-8'))
+    with open(summaryTruthFile, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def create_truth_cache(summaryTruthFile, cacheDirectory, wktColumn='PolygonWKT_Pix', processgeoJson=False):
+    """Parse a truth file once and store it in cacheDirectory for load_truth_cache.
+
+       The cache is a directory named after truth_cache_key holding
+       imageIds.npy -- every ImageId of the truth file, sorted (including images without buildings)
+       imageOffsets.npy -- polygons of imageIds[i] are rows imageOffsets[i]:imageOffsets[i+1]
+       wkb.bin, wkbOffsets.npy -- polygons packed with geoTools.geomListToWKBBuffer
+       bounds.npy -- (minx, miny, maxx, maxy) of each polygon, packed per image, see truth_cache_candidates
+       area.npy -- area of each polygon, so minPolygonSize is applied without decoding
+
+       Rows with BuildingId == -1 only contribute their ImageId.
+
+       returns the cache directory
+    """
+
+    cacheName = os.path.join(cacheDirectory, 'truth_' + truth_cache_key(summaryTruthFile, wktColumn=wktColumn))
+    if os.path.isdir(cacheName):
+        return cacheName
+
+    if processgeoJson:
+        sol_polys = gT.import_summary_geojson(summaryTruthFile, removeNoBuildings=False)
+    else:
+        sol_polys = gT.readwktcsv(summaryTruthFile, wktColumn=wktColumn)
+
+    image_ids = np.unique(sol_polys['ImageId'].to_numpy(dtype=str))
+    sol_polys = sol_polys[sol_polys['BuildingId'] != -1]
+    sol_polysIdsList = sol_polys['ImageId'].to_numpy(dtype=str)
+    order = np.argsort(sol_polysIdsList, kind='stable')
+    sol_polysPoly = to_geometry_array(sol_polys.geometry.values)[order]
+    image_offsets = np.searchsorted(sol_polysIdsList[order], image_ids, side='left')
+    image_offsets = np.append(image_offsets, len(order)).astype(np.int64)
+
+    wkb_buffer, wkb_offsets = gT.geomListToWKBBuffer(sol_polysPoly)
+
+    if not os.path.isdir(cacheDirectory):
+        os.makedirs(cacheDirectory)
+    # write to a temporary directory first so a partly written cache is never loaded
+    tmpName = tempfile.mkdtemp(prefix='tmp_truth_', dir=cacheDirectory)
+    np.save(os.path.join(tmpName, 'imageIds.npy'), image_ids)
+    np.save(os.path.join(tmpName, 'imageOffsets.npy'), image_offsets)
+    np.save(os.path.join(tmpName, 'wkbOffsets.npy'), wkb_offsets)
+    np.save(os.path.join(tmpName, 'bounds.npy'), shapely.bounds(sol_polysPoly).reshape(-1, 4))
+    np.save(os.path.join(tmpName, 'area.npy'), shapely.area(sol_polysPoly))
+    with open(os.path.join(tmpName, 'wkb.bin'), 'wb') as f:
+        f.write(wkb_buffer)
+    with open(os.path.join(tmpName, 'source.json'), 'w') as f:
+        json.dump({'summaryTruthFile': os.path.abspath(summaryTruthFile), 'wktColumn': wktColumn}, f)
+
+    try:
+        os.rename(tmpName, cacheName)
+    except OSError:
+        # another process created the same cache first
+        shutil.rmtree(tmpName, ignore_errors=True)
+
+    return cacheName
+
+
+def load_truth_cache(summaryTruthFile, cacheDirectory, wktColumn='PolygonWKT_Pix', processgeoJson=False):
+    """Memory-map the truth cache of summaryTruthFile, creating it on the first call.
+
+       returns dict with the arrays described in create_truth_cache
+    """
+
+    cacheName = create_truth_cache(summaryTruthFile, cacheDirectory, wktColumn=wktColumn,
+                                   processgeoJson=processgeoJson)
+
+    truth_cache = {'cacheName': cacheName}
+    for name in ['imageIds', 'imageOffsets', 'wkbOffsets', 'bounds', 'area']:
+        truth_cache[name] = np.load(os.path.join(cacheName, name + '.npy'), mmap_mode='r')
+
+    if os.path.getsize(os.path.join(cacheName, 'wkb.bin')) > 0:
+        truth_cache['wkb'] = np.memmap(os.path.join(cacheName, 'wkb.bin'), dtype=np.uint8, mode='r')
+    else:
+        truth_cache['wkb'] = np.zeros(0, dtype=np.uint8)
+
+    return truth_cache
+
+
+def truth_cache_candidates(truth_cache, prop_polysIdList, prop_polysPoly):
+    """Mask of the truth cache polygons whose packed bounds overlap the bounds of a proposal of the same image.
+
+       Only these polygons can be part of an iou_batch candidate pair, the test is done on the cached bounds
+       without decoding any truth polygon.  Images without proposals have no candidates.
+    """
+
+    image_ids = np.asarray(truth_cache['imageIds'])
+    image_offsets = np.asarray(truth_cache['imageOffsets'])
+    truth_bounds = np.asarray(truth_cache['bounds'])
+    prop_bounds = shapely.bounds(to_geometry_array(prop_polysPoly))
+    prop_rows = group_rows_by_image(image_ids, np.asarray(prop_polysIdList, dtype=str))
+
+    candidate = np.zeros(len(truth_bounds), dtype=bool)
+    for start, end, rows in zip(image_offsets[:-1].tolist(), image_offsets[1:].tolist(), prop_rows):
+        if start == end or len(rows) == 0:
+            continue
+        image_truth = truth_bounds[start:end, None, :]
+        image_prop = prop_bounds[None, rows, :]
+        overlap = (image_truth[:, :, 0] <= image_prop[:, :, 2]) & (image_truth[:, :, 2] >= image_prop[:, :, 0]) & \
+                  (image_truth[:, :, 1] <= image_prop[:, :, 3]) & (image_truth[:, :, 3] >= image_prop[:, :, 1])
+        candidate[start:end] = overlap.any(axis=1)
+
+    return candidate
+
+
+def truth_cache_polys(truth_cache, minPolygonSize=0, prop_polysIdList=None, prop_polysPoly=None):
+    """Decode the polygons of a truth cache with area > minPolygonSize.
+
+       If the proposals are given only the truth polygons truth_cache_candidates finds are decoded, the others
+       can not match a proposal and are returned as empty polygons.  The truth count and polygon order of every
+       image, and so the scores, are unchanged, while images without proposals decode nothing.
+
+       returns (image_ids, sol_polysIdsList, sol_polysPoly) as used by create_eval_function_input
+    """
+
+    image_ids = np.asarray(truth_cache['imageIds'])
+    counts = np.diff(truth_cache['imageOffsets'])
+    sol_polysIdsList = np.repeat(image_ids, counts)
+
+    keep = np.asarray(truth_cache['area']) > minPolygonSize
+    if prop_polysPoly is None:
+        decode = keep
+    else:
+        decode = keep & truth_cache_candidates(truth_cache, prop_polysIdList, prop_polysPoly)
+
+    decode_idx = np.flatnonzero(decode)
+    wkb_offsets = np.asarray(truth_cache['wkbOffsets'])
+    # memoryview slices of the memory-mapped buffer are much cheaper than numpy slices
+    wkb = memoryview(truth_cache['wkb'])
+    wkbList = np.empty(len(decode_idx), dtype=object)
+    wkbList[:] = [wkb[start:end].tobytes() for start, end in zip(wkb_offsets[decode_idx].tolist(),
+                                                                  wkb_offsets[decode_idx + 1].tolist())]
+
+    sol_polysPoly = np.full(np.count_nonzero(keep), shapely.Polygon(), dtype=object)
+    sol_polysPoly[decode[keep]] = shapely.from_wkb(wkbList)
+
+    return image_ids, sol_polysIdsList[keep], sol_polysPoly
+
+
+def image_hash_list(image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly, params={}):
+    """sha1 of the proposal and truth polygons of each image and of params, in image_ids order.
+
+       Polygons are hashed as WKB in row order, since greedy matching depends on proposal order.
+       params should hold every setting that changes a result, e.g. threshold and matching.
+    """
+
+    param_bytes = json.dumps(params, sort_keys=True).encode('utf-8')
+    prop_wkb = shapely.to_wkb(to_geometry_array(prop_polysPoly))
+    sol_wkb = shapely.to_wkb(to_geometry_array(sol_polysPoly))
+    prop_rows = group_rows_by_image(image_ids, prop_polysIdList)
+    sol_rows = group_rows_by_image(image_ids, sol_polysIdsList)
+
+    hash_list = []
+    for prop_index, sol_index in zip(prop_rows, sol_rows):
+        sha = hashlib.sha1(param_bytes)
+        sha.update(np.int64(len(prop_index)).tobytes())
+        sha.update(b''.join(prop_wkb[prop_index]))
+        sha.update(np.int64(len(sol_index)).tobytes())
+        sha.update(b''.join(sol_wkb[sol_index]))
+        hash_list.append(sha.hexdigest())
+
+    return hash_list
+
+
+def load_image_results(resultsCacheFile):
+    """Read the per image results written by save_image_results.
+
+       returns dict {image_id: (hash, (F1score, true_pos_count, false_pos_count, false_neg_count))},
+       empty if resultsCacheFile does not exist
+    """
+
+    if not os.path.isfile(resultsCacheFile):
+        return {}
+
+    with open(resultsCacheFile, 'r') as f:
+        image_results = json.load(f)
+
+    return {image_id: (entry['hash'], tuple(entry['result'])) for image_id, entry in image_results.items()}
+
+
+def save_image_results(resultsCacheFile, image_ids, hash_list, result_list):
+    """Write the (F1score, true_pos_count, false_pos_count, false_neg_count) of each image and its image_hash_list
+       hash to a json file, replacing it atomically.
+    """
+
+    image_results = {}
+    for image_id, image_hash, result in zip(image_ids, hash_list, result_list):
+        image_results[image_id] = {'hash': image_hash,
+                                   'result': [float(result[0]), int(result[1]), int(result[2]), int(result[3])]}
+
+    cacheDirectory = os.path.dirname(os.path.abspath(resultsCacheFile))
+    if not os.path.isdir(cacheDirectory):
+        os.makedirs(cacheDirectory)
+    fd, tmpName = tempfile.mkstemp(prefix='tmp_results_', suffix='.json', dir=cacheDirectory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(image_results, f)
+    os.replace(tmpName, resultsCacheFile)
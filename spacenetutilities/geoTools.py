@@ -1,11 +1,22 @@
 import numpy as np
 import os
 import subprocess
+import time
+import csv
+import heapq
+import itertools
+import tempfile
+import shutil
 import math
+import collections
+import contextlib
+import hashlib
+import json
+import multiprocessing
 import geopandas as gpd
 import shapely
-from shapely import wkt
 import rasterio as rio
+from rasterio.windows import Window
 import affine as af
 import pandas as pd
 from shapely.geometry import Point
@@ -17,8 +28,9 @@ from shapely.geometry.linestring import LineString
 from shapely.geometry.multilinestring import MultiLineString
 from shapely.geometry import shape
 from tqdm import tqdm
+from scipy.spatial import cKDTree
 import rtree
-from functools import partial
+from functools import lru_cache
 
 
 
@@ -77,7 +89,7 @@ def mergePolyList(geojsonfilename):
     return buildingList_df.unary_union
 
 
-def readwktcsv(csv_path):
+def readwktcsv(csv_path, wktColumn='', chunksize=None, dropWKT=False, verbose=False):
     """read spacenetV2 csv and return geopandas dataframe
 
                Keyword arguments:
@@ -85,33 +97,226 @@ def readwktcsv(csv_path):
                csv_path -- path to csv of spacenetV2 ground truth or solution submission format 
                     csv Format Expected = ['ImageId', 'BuildingId', 'PolygonWKT_Pix', 'PolygonWKT_Geo'] or
                     csv Format Expected = ['ImageId', 'BuildingId', 'PolygonWKT', 'Confidence']
+               wktColumn -- column to read geometry from.  If not specified the first of
+                    "PolygonWKT_Geo", "PolygonWKT_Pix", "PolygonWKT" found is used
+               chunksize -- if set, read and parse the csv chunksize rows at a time (see readwktcsv_chunks)
+               dropWKT -- drop the WKT text columns once parsed to reduce memory (default =False)
+               verbose -- print the read / parse / build timing breakdown (default =False)
+
+            The whole geometry column is parsed at once with shapely.from_wkt.  The timing breakdown
+            in seconds is stored in geo_df.attrs['readTiming'] = {'read': , 'parse': , 'build': }
 
             see https://community.topcoder.com/longcontest/?module=ViewProblemStatement&rd=16892&pm=14551 to 
             learn more about the spacenetV2 csv formats   
     """
     #
 
+    timing = {'read': 0.0, 'parse': 0.0, 'build': 0.0}
+    if chunksize:
+        chunkList = list(readwktcsv_chunks(csv_path, wktColumn=wktColumn, chunksize=chunksize,
+                                           dropWKT=dropWKT, timing=timing))
+        if not chunkList:
+            return -1
+
+        t0 = time.time()
+        geo_df = gpd.GeoDataFrame(pd.concat(chunkList, ignore_index=True), crs=chunkList[0].crs)
+        timing['build'] += time.time() - t0
+    else:
+        t0 = time.time()
+        df = pd.read_csv(csv_path)
+        timing['read'] += time.time() - t0
+
+        geo_df = wktDFToGeoDF(df, wktColumn=wktColumn, dropWKT=dropWKT, timing=timing)
+        if not isinstance(geo_df, gpd.GeoDataFrame):
+            return -1
+
+    geo_df.attrs['readTiming'] = timing
+    if verbose:
+        print('readwktcsv {}: read {:.3f}s, parse {:.3f}s, build {:.3f}s'.format(csv_path,
+                                                                                timing['read'],
+                                                                                timing['parse'],
+                                                                                timing['build']))
+
+    return geo_df
+
+
+def readwktcsv_chunks(csv_path, wktColumn='', chunksize=100000, dropWKT=False, timing=None):
+    """Yield geopandas dataframes of chunksize rows of a spacenetV2 csv.
+
+               Keyword arguments:
+
+               csv_path -- path to csv of spacenetV2 ground truth or solution submission format
+               wktColumn -- column to read geometry from (see readwktcsv)
+               chunksize -- number of rows per chunk (default =100000)
+               dropWKT -- drop the WKT text columns once parsed to reduce memory (default =False)
+               timing -- optional dict, 'read', 'parse' and 'build' seconds are added to it
+
+            Only one chunk is held in memory at a time, so files larger than RAM can be processed
+    """
+
+    if timing is None:
+        timing = {'read': 0.0, 'parse': 0.0, 'build': 0.0}
+
+    t0 = time.time()
+    reader = pd.read_csv(csv_path, chunksize=chunksize)
+    for df in reader:
+        timing['read'] += time.time() - t0
+
+        geo_df = wktDFToGeoDF(df, wktColumn=wktColumn, dropWKT=dropWKT, timing=timing)
+        if not isinstance(geo_df, gpd.GeoDataFrame):
+            return
+
+        yield geo_df
+        t0 = time.time()
+
+
+def readwktcsv_sorted_blocks(csv_path, wktColumn='', chunksize=100000, tmpDirectory=None):
+    """Yield geopandas dataframes of a spacenetV2 csv sorted by ImageId, no image spans two blocks.
+
+               Keyword arguments:
+
+               csv_path -- path to csv of spacenetV2 ground truth or solution submission format
+               wktColumn -- column to read geometry from (see readwktcsv)
+               chunksize -- number of rows sorted in memory at a time (default =100000)
+               tmpDirectory -- directory for the sorted runs of an external sort (default = system tmp)
+
+            The csv is sorted by ImageId once, O(rows log rows).  A csv that fits in one chunk is
+            sorted in memory, larger files are written as sorted runs to tmpDirectory and merged,
+            so only about chunksize rows (or one image, if larger) are held in memory at a time.
+            Rows of an image keep their order in the csv.  Geometry is parsed once per block.
+    """
+
+    reader = pd.read_csv(csv_path, chunksize=chunksize, dtype={'ImageId': str})
+    firstChunk = next(reader, None)
+    if firstChunk is None:
+        return
+    secondChunk = next(reader, None)
+
+    if secondChunk is None:
+        firstChunk = firstChunk.sort_values('ImageId', kind='stable').reset_index(drop=True)
+        yield wktDFToGeoDF(firstChunk, wktColumn=wktColumn)
+        return
+
+    columns = list(firstChunk.columns)
+    # the merged rows are csv text, these columns are converted back to numbers as read_csv inferred them
+    numericColumns = [column for column in columns
+                      if pd.api.types.is_numeric_dtype(firstChunk[column]) and
+                      not pd.api.types.is_bool_dtype(firstChunk[column])]
+    runDirectory = tempfile.mkdtemp(prefix='spacenet_sort_', dir=tmpDirectory)
+    try:
+        # write sorted runs, rows carry their csv row number so the merge is stable
+        runFileList = []
+        rowStart = 0
+        for chunk in itertools.chain([firstChunk, secondChunk], reader):
+            chunk = chunk[columns].copy()
+            chunk.insert(1, '_row', np.arange(rowStart, rowStart + len(chunk)))
+            rowStart += len(chunk)
+            runFileName = os.path.join(runDirectory, 'run_{}.csv'.format(len(runFileList)))
+            chunk.sort_values(['ImageId', '_row'], kind='stable').to_csv(runFileName, index=False, header=False)
+            runFileList.append(runFileName)
+
+        runHandleList = [open(runFileName, 'r', newline='') for runFileName in runFileList]
+        try:
+            runReaderList = [((row[0], int(row[1]), row) for row in csv.reader(runHandle))
+                             for runHandle in runHandleList]
+            blockRows = []
+            for imageId, rowGroup in itertools.groupby(heapq.merge(*runReaderList), key=lambda x: x[0]):
+                blockRows.extend(row[:1] + row[2:] for _, _, row in rowGroup)
+                if len(blockRows) >= chunksize:
+                    yield _rowsToGeoDF(columns, blockRows, wktColumn, numericColumns)
+                    blockRows = []
+            if blockRows:
+                yield _rowsToGeoDF(columns, blockRows, wktColumn, numericColumns)
+        finally:
+            for runHandle in runHandleList:
+                runHandle.close()
+    finally:
+        shutil.rmtree(runDirectory, ignore_errors=True)
+
+
+def _rowsToGeoDF(columns, rows, wktColumn, numericColumns):
+    # build the block from the already split csv rows, empty fields of numeric columns are NaN as in read_csv
+    df = pd.DataFrame(rows, columns=columns)
+    for column in numericColumns:
+        df[column] = pd.to_numeric(df[column].replace('', np.nan))
+
+    return wktDFToGeoDF(df, wktColumn=wktColumn)
+
+
+def wktDFToGeoDF(df, wktColumn='', dropWKT=False, timing=None):
+    """Parse the WKT column of a spacenetV2 dataframe into a geopandas dataframe
+
+               Keyword arguments:
+
+               df -- pandas dataframe read from a spacenetV2 csv
+               wktColumn -- column to read geometry from (see readwktcsv)
+               dropWKT -- drop the WKT text columns once parsed (default =False)
+               timing -- optional dict, 'parse' and 'build' seconds are added to it
+    """
+
+    if timing is None:
+        timing = {'read': 0.0, 'parse': 0.0, 'build': 0.0}
 
-    df = pd.read_csv(csv_path)
     crs = {}
-    if 'PolygonWKT_Geo' in df.columns:
-        geometry = [wkt.loads(x) for x in df['PolygonWKT_Geo'].values]
-        crs = {'init': 'epsg:4326'}
-    elif 'PolygonWKT_Pix' in df.columns:
-        geometry = [wkt.loads(x) for x in df['PolygonWKT_Pix'].values]
-    elif 'PolygonWKT' in df.columns:
-        geometry = [wkt.loads(x) for x in df['PolygonWKT'].values]
+    if wktColumn == '':
+        for column in ['PolygonWKT_Geo', 'PolygonWKT_Pix', 'PolygonWKT']:
+            if column in df.columns:
+                wktColumn = column
+                break
 
-    else:
+    if wktColumn == '' or wktColumn not in df.columns:
         print(
             'Eror No Geometry Column detected, column must be called "PolygonWKT_Geo", "PolygonWKT_Pix", or "PolygonWKT"')
         return -1
 
+    if wktColumn == 'PolygonWKT_Geo':
+        crs = {'init': 'epsg:4326'}
+
+    t0 = time.time()
+    geometry = shapely.from_wkt(df[wktColumn].values.astype(object))
+    t1 = time.time()
+
+    if dropWKT:
+        df = df.drop(columns=[column for column in ['PolygonWKT_Geo', 'PolygonWKT_Pix', 'PolygonWKT']
+                              if column in df.columns])
+
     geo_df = gpd.GeoDataFrame(df, crs=crs, geometry=geometry)
+    t2 = time.time()
+
+    timing['parse'] += t1 - t0
+    timing['build'] += t2 - t1
 
     return geo_df
 
 
+def geomListToWKBBuffer(geomList):
+    """Pack shapely geometries into a single WKB byte string.
+
+           Keyword arguments:
+           geomList -- list or array of shapely geometries
+
+        returns (wkbBuffer, wkbOffsets) where geometry i is wkbBuffer[wkbOffsets[i]:wkbOffsets[i+1]]
+
+    """
+    geomArray = np.empty(len(geomList), dtype=object)
+    geomArray[:] = list(geomList)
+
+    wkbList = shapely.to_wkb(geomArray)
+    wkbOffsets = np.zeros(len(wkbList) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in wkbList], out=wkbOffsets[1:])
+
+    return b''.join(wkbList), wkbOffsets
+
+
+def wkbBufferToGeomArray(wkbBuffer, wkbOffsets):
+    """Unpack a WKB byte string created by geomListToWKBBuffer into a numpy array of shapely geometries"""
+
+    wkbList = np.empty(len(wkbOffsets) - 1, dtype=object)
+    wkbList[:] = [bytes(wkbBuffer[start:end]) for start, end in zip(wkbOffsets[:-1], wkbOffsets[1:])]
+
+    return shapely.from_wkb(wkbList)
+
+
 def exporttogeojson(geojsonfilename, geo_df):
     """Write geopandas dataframe to geo_df 
 
@@ -251,7 +456,7 @@ def createBoxFromLine(tmpGeom, ratio=1, halfWidth=-999, transformRequired=True,
 
     if transformRequired:
         if transform_WGS84_To_UTM == '':
-            transform_WGS84_To_UTM, transform_UTM_To_WGS84 = createUTMTransform(tmpGeom)
+            transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = createUTMTransform(tmpGeom)
 
         tmpGeom = shapely.ops.transform(transform_WGS84_To_UTM, tmpGeom)
 
@@ -266,8 +471,8 @@ def createBoxFromLine(tmpGeom, ratio=1, halfWidth=-999, transformRequired=True,
 
     polyGeom = tmpGeom.buffer(halfWidth, cap_style=shapely.geometry.CAP_STYLE.flat)
 
-    angRad = math.atan2((tmpGeom.coords[1][1]-tmpGeom.coords[0][1],
-                        tmpGeom.coords[1][0] - tmpGeom.coords[0][0]))
+    angRad = math.atan2(tmpGeom.coords[1][1]-tmpGeom.coords[0][1],
+                        tmpGeom.coords[1][0] - tmpGeom.coords[0][0])
 
     areaM = polyGeom.area
 
@@ -279,29 +484,67 @@ def createBoxFromLine(tmpGeom, ratio=1, halfWidth=-999, transformRequired=True,
     return (polyGeom, areaM, angRad, lengthM)
 
 
-def create_rtreefromdict(buildinglist):
-    # create index
-    index = rtree.index.Index(interleaved=True)
-    for idx, building in enumerate(buildinglist):
-        index.insert(idx, building['poly'].bounds)
+def create_rtreefromdict(buildinglist, indexType='rtree'):
+    # create index, see create_rtree_from_poly
 
-    return index
+    return create_rtree_from_poly([building['poly'] for building in buildinglist], indexType=indexType)
 
 
-def create_rtree_from_poly(poly_list):
-    # create index
-    index = rtree.index.Index(interleaved=True)
-    for idx, building in enumerate(poly_list):
-        index.insert(idx, building.bounds)
+def create_rtree_from_poly(poly_list, indexType='rtree'):
+    """Bulk load a spatial index of the bounds of poly_list, ids are the list positions.
 
-    return index
+           Keyword arguments:
+           poly_list -- list or array of shapely geometries
+           indexType -- 'rtree' for a stream loaded rtree.index.Index (supports delete) or
+                        'strtree' for an immutable shapely.STRtree (default ='rtree')
+
+    """
+
+    geomArray = np.empty(len(poly_list), dtype=object)
+    geomArray[:] = list(poly_list)
+
+    if indexType == 'strtree':
+        return shapely.STRtree(geomArray)
+    elif indexType != 'rtree':
+        raise ValueError("indexType must be 'rtree' or 'strtree', not {}".format(indexType))
+
+    return create_rtree_from_bounds(shapely.bounds(geomArray))
+
+
+def create_rtree_from_bounds(boundsArray):
+    """Bulk load an rtree.index.Index from an (N, 4) array of (minx, miny, maxx, maxy), ids are the row numbers.
+
+       Stream loading packs the tree in one pass, which is much faster than inserting entries one at a
+       time and gives better query performance.  Rows with NaN bounds (empty geometries) are skipped.
+    """
+
+    boundsArray = np.asarray(boundsArray, dtype=np.float64).reshape(-1, 4)
+    validIdx = np.flatnonzero(~np.isnan(boundsArray).any(axis=1))
+
+    if len(validIdx) == 0:
+        return rtree.index.Index(interleaved=True)
+
+    stream = ((idx, bounds, None) for idx, bounds in zip(validIdx.tolist(), boundsArray[validIdx].tolist()))
+
+    return rtree.index.Index(stream, interleaved=True)
 
 
 def search_rtree(test_building, index):
-    # input test poly ogr.Geometry  and rtree index
-    if test_building.GetGeometryName() == 'POLYGON' or \
-                    test_building.GetGeometryName() == 'MULTIPOLYGON':
-        fidlist = index.intersection(test_building.bounds)
+    # input test poly shapely geometry or ogr.Geometry and rtree index or shapely STRtree
+    # returns ids of the index entries whose bounds intersect the bounds of polygons and multipolygons
+    if hasattr(test_building, 'GetGeometryName'):
+        geomName = test_building.GetGeometryName()
+        minX, maxX, minY, maxY = test_building.GetEnvelope()
+        bounds = (minX, minY, maxX, maxY)
+    else:
+        geomName = test_building.geom_type.upper()
+        bounds = test_building.bounds
+
+    if geomName == 'POLYGON' or geomName == 'MULTIPOLYGON':
+        if isinstance(index, shapely.STRtree):
+            fidlist = index.query(shapely.box(*bounds)).tolist()
+        else:
+            fidlist = index.intersection(bounds)
     else:
         fidlist = []
 
@@ -344,44 +587,71 @@ def createUTMandLatLonCrs(polyGeom):
     return utm_crs, latlong_crs
 
 def createUTMTransform(polyGeom, srcCrs="+proj=longlat +datum=WGS84 +no_defs"):
+    # returns (projectTO_UTM, projectTO_SrcCRS, utm_crs), projectTO_* are (x, y) functions for shapely.ops.transform
+    # that also accept numpy arrays, see createUTMTransformer
 
-    wgs84CRS = "+proj=longlat +datum=WGS84 +no_defs"
-    projectTO_WGSBase = partial(
-        pyproj.transform,
-        pyproj.Proj(srcCrs),
-        pyproj.Proj(wgs84CRS)  # Proj(proj='latlong',datum='WGS84')
+    transformer_Src_To_UTM, transformer_UTM_To_Src, utm_crs = createUTMTransformer(polyGeom, srcCrs=srcCrs)
 
-    )
-    polyGeomWGS = shapely.ops.transform(projectTO_WGSBase, polyGeom)
+    return transformer_Src_To_UTM.transform, transformer_UTM_To_Src.transform, utm_crs
 
 
-    polyCentroid = polyGeomWGS.centroid
-    utm_zone = utm_getZone(polyCentroid.x)
-    is_northern = utm_isNorthern(polyCentroid.y)
+def _crsCacheKey(crs):
+    # hashable stand in for a crs given as a proj string, pyproj.CRS or a dict such as {'init': 'epsg:4326'}
+    if isinstance(crs, dict):
+        return tuple(sorted(crs.items()))
+
+    return crs
+
+
+@lru_cache(maxsize=None)
+def _cachedTransformer(srcCrsKey, dstCrsKey):
+    srcCrs = dict(srcCrsKey) if isinstance(srcCrsKey, tuple) else srcCrsKey
+    dstCrs = dict(dstCrsKey) if isinstance(dstCrsKey, tuple) else dstCrsKey
+
+    return pyproj.Transformer.from_crs(srcCrs, dstCrs, always_xy=True)
+
+
+def getTransformer(srcCrs, dstCrs):
+    """Return the always_xy pyproj.Transformer from srcCrs to dstCrs.
+
+       Transformers are cached for the life of the process, building one is much slower than using it.
+    """
+
+    return _cachedTransformer(_crsCacheKey(srcCrs), _crsCacheKey(dstCrs))
+
+
+@lru_cache(maxsize=None)
+def _cachedUTMTransformers(srcCrsKey, utm_zone, is_northern):
     if is_northern:
         directionIndicator = '+north'
     else:
         directionIndicator = '+south'
 
-    print('utm zone = {}'.format(utm_zone))
-
     utm_crs = "+proj=utm +zone={} {} +ellps=WGS84 +datum=WGS84 +units=m +no_defs".format(utm_zone,
                                                                                         directionIndicator)
-    projectTO_UTM = partial(
-        pyproj.transform,
-        pyproj.Proj(srcCrs),  #Proj(proj='latlong',datum='WGS84')
-        pyproj.Proj(utm_crs)
-    )
 
+    return _cachedTransformer(srcCrsKey, utm_crs), _cachedTransformer(utm_crs, srcCrsKey), utm_crs
 
-    projectTO_SrcCRS = partial(
-        pyproj.transform,
-        pyproj.Proj(utm_crs),
-        pyproj.Proj(srcCrs)  # Proj(proj='latlong',datum='WGS84')
 
-    )
+def createUTMTransformer(polyGeom, srcCrs="+proj=longlat +datum=WGS84 +no_defs"):
+    """Return (transformer_Src_To_UTM, transformer_UTM_To_Src, utm_crs) for the UTM zone of polyGeom's centroid.
+
+       The transformers are pyproj.Transformer objects with always_xy=True, whose transform(x, y) takes
+       numpy arrays, so many coordinates are reprojected in one call.  shapely.ops.transform(transformer.transform,
+       geom) reprojects a single geometry.  Transformers are cached per (srcCrs, UTM zone, hemisphere).
+    """
+
+    wgs84CRS = "+proj=longlat +datum=WGS84 +no_defs"
+    if srcCrs == wgs84CRS:
+        polyCentroid = polyGeom.centroid
+    else:
+        polyCentroid = shapely.ops.transform(getTransformer(srcCrs, wgs84CRS).transform, polyGeom).centroid
+
+    utm_zone = utm_getZone(polyCentroid.x)
+    is_northern = utm_isNorthern(polyCentroid.y)
+
+    return _cachedUTMTransformers(_crsCacheKey(srcCrs), utm_zone, is_northern)
 
-    return projectTO_UTM,  projectTO_SrcCRS, utm_crs
 
 def transformGeomToUTM(geom, srcCrs="+proj=longlat +datum=WGS84 +no_defs"):
     projectTO_UTM, projectTO_Src, utm_cs = createUTMTransform(geom, srcCrs=srcCrs)
@@ -421,14 +691,14 @@ def createPolygonFromCenterPointXY(cX,cY, radiusMeters, transform_WGS_To_UTM_Fla
 
     point = Point(cX, cY)
 
-    return createPolygonFromCenterPoint(point, radiusMeters, transform_WGS_To_UTM_Flag=True)
+    return createPolygonFromCenterPoint(point, radiusMeters, transform_WGS_To_UTM_Flag=transform_WGS_To_UTM_Flag)
 
 def createPolygonFromCenterPoint(point, radiusMeters, transform_WGS_To_UTM_Flag=True):
 
 
 
     if transform_WGS_To_UTM_Flag:
-        transform_WGS84_To_UTM, transform_UTM_To_WGS84 = createUTMTransform(point)
+        transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = createUTMTransform(point)
         point = shapely.ops.transform(transform_WGS84_To_UTM, point)
 
     poly = point.buffer(radiusMeters)
@@ -440,15 +710,15 @@ def createPolygonFromCenterPoint(point, radiusMeters, transform_WGS_To_UTM_Flag=
 
 def createPolygonFromCentroidGDF(gdf, radiusMeters, transform_WGS_To_UTM_Flag=True):
 
-    #TODO needs fixing
+    srcCrs = gdf.crs
     if transform_WGS_To_UTM_Flag:
-        transform_WGS84_To_UTM, transform_UTM_To_WGS84 = createUTMTransform(gdf.centroid.values[0])
-        gdf.to_crs(transform_WGS84_To_UTM)
+        transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = createUTMTransform(gdf.geometry.values[0].centroid)
+        gdf = gdf.to_crs(utm_cs)
 
-    poly = gdf.centroids.buffer(radiusMeters)
+    poly = gdf.centroid.buffer(radiusMeters)
 
     if transform_WGS_To_UTM_Flag:
-        poly = shapely.ops.transform(transform_UTM_To_WGS84, poly)
+        poly = poly.to_crs(srcCrs)
 
     return poly
 
@@ -467,14 +737,9 @@ def createPolygonFromCorners(left,bottom,right, top):
     return poly
 
 
-def clipShapeFile(geoDF, outputFileName, polyToCut, minpartialPerc=0.0, geomType="Polygon", shapeLabel='Geo', debug=False):
-    # check if geoDF has origAreaField
-    outGeoJSon = os.path.splitext(outputFileName)[0] + '.geojson'
-    if not os.path.exists(os.path.dirname(outGeoJSon)):
-        os.makedirs(os.path.dirname(outGeoJSon))
-    if debug:
-        print(outGeoJSon)
-
+def addOrigAreaLength(geoDF, geomType="Polygon"):
+    # add the origarea and origlen columns clipShapeFile uses for partialDec, unless geoDF already has them
+    # call once per source before clipping many chips so they are not recomputed per chip or per worker
     if geomType == "LineString":
 
         if 'origarea' in geoDF.columns:
@@ -497,10 +762,38 @@ def clipShapeFile(geoDF, outputFileName, polyToCut, minpartialPerc=0.0, geomType
             pass
         else:
             geoDF['origlen'] = 0
-    #TODO must implement different case for lines and for spatialIndex
 
-    cutGeoDF = geoDF.copy()
-    cutGeoDF.geometry=geoDF.intersection(polyToCut)
+    return geoDF
+
+
+def prepareClipSource(geoDF, geomType="Polygon"):
+    # precompute origarea/origlen and the spatial index of a vector source clipped by clipShapeFile
+    geoDF = addOrigAreaLength(geoDF, geomType=geomType)
+    geoDF.sindex
+
+    return geoDF
+
+
+def clipShapeFile(geoDF, outputFileName, polyToCut, minpartialPerc=0.0, geomType="Polygon", shapeLabel='Geo', debug=False,
+                  useSpatialIndex=True):
+    # useSpatialIndex -- only intersect the features the geoDF.sindex finds intersecting polyToCut instead of
+    #                    every feature, features outside polyToCut are never written
+    outGeoJSon = os.path.splitext(outputFileName)[0] + '.geojson'
+    if not os.path.exists(os.path.dirname(outGeoJSon)):
+        os.makedirs(os.path.dirname(outGeoJSon), exist_ok=True)
+    if debug:
+        print(outGeoJSon)
+
+    # check if geoDF has origAreaField
+    geoDF = addOrigAreaLength(geoDF, geomType=geomType)
+
+    if useSpatialIndex:
+        candidateIndex = np.sort(geoDF.sindex.query(polyToCut, predicate='intersects'))
+        cutGeoDF = geoDF.iloc[candidateIndex].copy()
+        cutGeoDF.geometry = cutGeoDF.intersection(polyToCut)
+    else:
+        cutGeoDF = geoDF.copy()
+        cutGeoDF.geometry=geoDF.intersection(polyToCut)
 
     if geomType=='Polygon':
         cutGeoDF['partialDec'] = cutGeoDF.area / cutGeoDF['origarea']
@@ -520,52 +813,52 @@ def clipShapeFile(geoDF, outputFileName, polyToCut, minpartialPerc=0.0, geomType
         cutGeoDF.to_file(outGeoJSon, driver='GeoJSON')
 
 
-def cutChipFromMosaic(rasterFileList, shapeFileSrcList, outlineSrc='',outputDirectory='', outputPrefix='clip_',
-                      clipSizeMX=100, clipSizeMY=100, clipOverlap=0.0, minpartialPerc=0.0, createPix=False,
-                      baseName='',
-                      imgIdStart=-1,
-                      parrallelProcess=False,
-                      noBlackSpace=False,
-                      randomClip=-1,
-                      verbose=False):
+def readClipSources(shapeFileSrcList):
+    # shapeFileSrcList = [['path/to/vector.geojson' or GeoDataFrame, 'vectorDescription']]
+    # returns [[GeoDataFrame, 'vectorDescription']] prepared with prepareClipSource
+    shapeSrcList = []
+    for shapeFileSrc in shapeFileSrcList:
+        print(shapeFileSrc[1])
+        if isinstance(shapeFileSrc[0], gpd.GeoDataFrame):
+            shapeSrcList.append([prepareClipSource(shapeFileSrc[0]), shapeFileSrc[1]])
+        else:
+            shapeSrcList.append([prepareClipSource(gpd.read_file(shapeFileSrc[0])), shapeFileSrc[1]])
 
-    #rasterFileList = [['rasterLocation', 'rasterDescription']]
-    # i.e rasterFileList = [['/path/to/3band_AOI_1.tif, '3band'],
-    #                       ['/path/to/8band_AOI_1.tif, '8band']
-    #                        ]
-    # open Base Image
-    #print(rasterFileList[0][0])
-    srcImage = rio.open(rasterFileList[0][0])
-    geoTrans, poly, ulX, ulY, lrX, lrY = getRasterExtent(srcImage)
-    # geoTrans.a w-e pixel resolution
-    # geoTrans.e n-s pixel resolution
-    if outputDirectory=="":
-        outputDirectory=os.path.dirname(rasterFileList[0][0])
+    return shapeSrcList
 
-    rasterFileBaseList = []
-    for rasterFile in rasterFileList:
-        rasterFileBaseList.append(os.path.basename(rasterFile[0]))
 
-    if not createPix:
-        transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = createUTMTransform(poly)
-        poly = shapely.ops.transform(transform_WGS84_To_UTM, poly)
+def planChipGrid(rasterFileName, outlineSrc='', shapeSrcList=[],
+                 clipSizeMX=100, clipSizeMY=100, clipOverlap=0.0, createPix=False,
+                 imgIdStart=-1,
+                 noBlackSpace=False,
+                 verbose=False):
+    """Compute every chip cutChipFromMosaic would cut from rasterFileName without cutting it.
 
+       The grid is laid out in UTM meters (or in the raster crs in pixels if createPix) and all chips are
+       reprojected and tested against the outline at once.  Chips not intersecting the outline are dropped.
 
-    env = poly.bounds
-    minX = env[0]
-    minY = env[1]
-    maxX = env[2]
-    maxY = env[3]
+       returns pandas DataFrame with a row per chip in cutting order:
+       chipIdx, imgId -- position in the manifest and image id used for the chip names
+       gridMinX, gridMinY, gridMaxX, gridMaxY -- chip bounds in the grid crs (UTM unless createPix)
+       minXCut, minYCut, maxXCut, maxYCut -- chip bounds in the raster crs, as passed to createclip
+       colOff, rowOff, width, height -- pixel window of the chip in rasterFileName
+       outlineCoverage -- fraction of the chip inside the outline (raster extent if no outlineSrc)
+       featureCount -- number of features of shapeSrcList intersecting the chip
+    """
 
-    #return poly to WGS84
-    if not createPix:
-        poly = shapely.ops.transform(transform_UTM_To_WGS84, poly)
+    srcImage = rio.open(rasterFileName)
+    geoTrans, poly, ulX, ulY, lrX, lrY = getRasterExtent(srcImage)
+    srcImage.close()
 
-    shapeSrcList = []
-    for shapeFileSrc in shapeFileSrcList:
-        print(shapeFileSrc[1])
-        shapeSrcList.append([gpd.read_file(shapeFileSrc[0]), shapeFileSrc[1]])
+    if not createPix:
+        transformer_WGS84_To_UTM, transformer_UTM_To_WGS84, utm_cs = createUTMTransformer(poly)
+        polyGrid = shapely.ops.transform(transformer_WGS84_To_UTM.transform, poly)
+    else:
+        polyGrid = poly
+        clipSizeMX = clipSizeMX*geoTrans.a
+        clipSizeMY = abs(clipSizeMY*geoTrans.e)
 
+    minX, minY, maxX, maxY = polyGrid.bounds
 
     if outlineSrc == '':
         geomOutline = poly
@@ -575,17 +868,6 @@ def cutChipFromMosaic(rasterFileList, shapeFileSrcList, outlineSrc='',outputDire
             geomOutlineBase = shape(outline['geometry'])
             geomOutline = geomOutlineBase.intersection(poly)
 
-    chipSummaryList = []
-
-    for rasterFile in rasterFileList:
-        if not os.path.exists(os.path.join(outputDirectory, rasterFile[1])):
-            os.makedirs(os.path.join(outputDirectory, rasterFile[1]))
-    idx = 0
-    if createPix:
-        print(geoTrans)
-        clipSizeMX=clipSizeMX*geoTrans.a
-        clipSizeMY=abs(clipSizeMY*geoTrans.e)
-
     xInterval = np.arange(minX, maxX, clipSizeMX*(1.0-clipOverlap))
     yInterval = np.arange(minY, maxY, clipSizeMY*(1.0-clipOverlap))
 
@@ -597,88 +879,783 @@ def cutChipFromMosaic(rasterFileList, shapeFileSrcList, outlineSrc='',outputDire
         print(xInterval)
         print(yInterval)
 
-    pbar = tqdm(total=len(xInterval)* len(yInterval), desc='Creating Chips')
+    # x outer, y inner, the order chips are cut in
+    llX, llY = np.meshgrid(xInterval, yInterval, indexing='ij')
+    llX = llX.ravel()
+    llY = llY.ravel()
+
+    # move chips crossing the top or right edge inside the image
+    if noBlackSpace:
+        llX = np.where(llX + clipSizeMX > maxX, maxX - clipSizeMX, llX)
+        llY = np.where(llY + clipSizeMY > maxY, maxY - clipSizeMY, llY)
+    uRX = llX + clipSizeMX
+    uRY = llY + clipSizeMY
+
+    # chip corners in the raster crs, in createPolygonFromCorners order, reprojected in one call
+    cornerX = np.stack([llX, llX, uRX, uRX], axis=1)
+    cornerY = np.stack([uRY, llY, llY, uRY], axis=1)
+    if not createPix:
+        cornerX, cornerY = transformer_UTM_To_WGS84.transform(cornerX, cornerY)
+    polyCutList = shapely.polygons(np.stack([cornerX, cornerY], axis=2))
+
+    keep = np.flatnonzero(shapely.intersects(polyCutList, geomOutline))
+    polyCutList = polyCutList[keep]
+    cornerX = cornerX[keep]
+    cornerY = cornerY[keep]
+
+    chipManifest = pd.DataFrame({'chipIdx': np.arange(len(keep)),
+                                 'imgId': np.arange(1, len(keep)+1) if imgIdStart != -1 else -1,
+                                 'gridMinX': llX[keep],
+                                 'gridMinY': llY[keep],
+                                 'gridMaxX': uRX[keep],
+                                 'gridMaxY': uRY[keep],
+                                 'minXCut': cornerX.min(axis=1),
+                                 'minYCut': cornerY.min(axis=1),
+                                 'maxXCut': cornerX.max(axis=1),
+                                 'maxYCut': cornerY.max(axis=1)})
+
+    addChipPixelWindow(chipManifest, geoTrans)
+
+    chipManifest['outlineCoverage'] = shapely.area(shapely.intersection(polyCutList, geomOutline)) / \
+                                      shapely.area(polyCutList)
+
+    chipManifest['featureCount'] = countChipFeatures(chipManifest, poly, shapeSrcList)
+
+    return chipManifest
+
+
+def addChipPixelWindow(chipManifest, geoTrans):
+    # add the colOff, rowOff, width, height pixel window of each manifest chip in a raster with geoTrans
+    chipManifest['colOff'] = np.floor((chipManifest['minXCut'] - geoTrans.c) / geoTrans.a).astype(np.int64)
+    chipManifest['rowOff'] = np.floor((chipManifest['maxYCut'] - geoTrans.f) / geoTrans.e).astype(np.int64)
+    chipManifest['width'] = np.ceil((chipManifest['maxXCut'] - geoTrans.c) / geoTrans.a).astype(np.int64) - \
+                            chipManifest['colOff']
+    chipManifest['height'] = np.ceil((chipManifest['minYCut'] - geoTrans.f) / geoTrans.e).astype(np.int64) - \
+                             chipManifest['rowOff']
+
+    return chipManifest
+
+
+def countChipFeatures(chipManifest, poly, shapeSrcList):
+    # number of features of shapeSrcList intersecting each manifest chip inside the raster extent poly,
+    # createclip clips the vectors with the chip envelope inside the raster extent
+    polyVectorCutList = shapely.intersection(shapely.box(chipManifest['minXCut'].values,
+                                                         chipManifest['minYCut'].values,
+                                                         chipManifest['maxXCut'].values,
+                                                         chipManifest['maxYCut'].values), poly)
+    featureCount = np.zeros(len(chipManifest), dtype=np.int64)
+    for shapeSrc in shapeSrcList:
+        chipIdx, featureIdx = shapeSrc[0].sindex.query(polyVectorCutList, predicate='intersects')
+        featureCount += np.bincount(chipIdx, minlength=len(chipManifest))
+
+    return featureCount
 
 
+def createCenterEnvelopes(centerX, centerY, radiusMeters, transform_WGS_To_UTM_Flag=True):
+    """Vectorized createPolygonFromCenterPoint, returns (minX, minY, maxX, maxY, utmX, utmY) arrays.
 
+       Each center is buffered by radiusMeters in the UTM zone of that center (if transform_WGS_To_UTM_Flag)
+       and the envelope of the buffer reprojected to WGS84 is returned, the same bounds as
+       createPolygonFromCenterPoint(Point(x, y), radiusMeters).bounds.  All centers of a UTM zone are
+       reprojected in one call.  utmX, utmY are the centers in meters (the input if not transformed).
+    """
 
-    for llX in xInterval:
-        if parrallelProcess:
-            for llY in yInterval:
-                pass
+    centerX = np.asarray(centerX, dtype=np.float64)
+    centerY = np.asarray(centerY, dtype=np.float64)
+    if not transform_WGS_To_UTM_Flag:
+        return (centerX - radiusMeters, centerY - radiusMeters, centerX + radiusMeters, centerY + radiusMeters,
+                centerX, centerY)
+
+    minX = np.empty_like(centerX)
+    minY = np.empty_like(centerX)
+    maxX = np.empty_like(centerX)
+    maxY = np.empty_like(centerX)
+    utmX = np.empty_like(centerX)
+    utmY = np.empty_like(centerX)
+
+    wgs84CRS = "+proj=longlat +datum=WGS84 +no_defs"
+    utmZone = np.floor(1 + (centerX + 180.0) / 6.0).astype(np.int64)
+    isNorthern = centerY >= 0.0
+    zoneKey = utmZone * 2 + isNorthern
+    for zone in np.unique(zoneKey):
+        zoneIdx = np.flatnonzero(zoneKey == zone)
+        transformer_WGS84_To_UTM, transformer_UTM_To_WGS84, utm_crs = _cachedUTMTransformers(
+            wgs84CRS, int(zone // 2), int(zone % 2))
+        utmX[zoneIdx], utmY[zoneIdx] = transformer_WGS84_To_UTM.transform(centerX[zoneIdx], centerY[zoneIdx])
+
+        # buffer vertices of every center, reprojected back in one call and reduced per center
+        bufferCoords, bufferIdx = shapely.get_coordinates(
+            shapely.buffer(shapely.points(utmX[zoneIdx], utmY[zoneIdx]), radiusMeters), return_index=True)
+        bufferX, bufferY = transformer_UTM_To_WGS84.transform(bufferCoords[:, 0], bufferCoords[:, 1])
+        bufferStart = np.flatnonzero(np.r_[True, np.diff(bufferIdx) != 0])
+        minX[zoneIdx] = np.minimum.reduceat(bufferX, bufferStart)
+        maxX[zoneIdx] = np.maximum.reduceat(bufferX, bufferStart)
+        minY[zoneIdx] = np.minimum.reduceat(bufferY, bufferStart)
+        maxY[zoneIdx] = np.maximum.reduceat(bufferY, bufferStart)
+
+    return minX, minY, maxX, maxY, utmX, utmY
+
+
+def dedupeChipCenters(centerX, centerY, groupKey, tolerance):
+    """Return (keepIdx, mergedCount) for centers closer than tolerance sharing a groupKey.
+
+       Centers are visited in order, each kept center absorbs every not yet absorbed center of its group
+       within tolerance, so the first object of a cluster gets the chip.  mergedCount is the number of
+       centers each kept center stands for.
+    """
 
+    keep = np.zeros(len(centerX), dtype=bool)
+    mergedCount = np.zeros(len(centerX), dtype=np.int64)
+    groupCodes, groupInverse = np.unique(groupKey, return_inverse=True)
+    for groupCode in range(len(groupCodes)):
+        groupIdx = np.flatnonzero(groupInverse == groupCode)
+        tree = cKDTree(np.stack([centerX[groupIdx], centerY[groupIdx]], axis=1))
+        neighbourList = tree.query_ball_point(tree.data, r=tolerance)
+        absorbed = np.zeros(len(groupIdx), dtype=bool)
+        for pos, neighbours in enumerate(neighbourList):
+            if absorbed[pos]:
+                continue
+            neighbours = [neighbour for neighbour in neighbours if not absorbed[neighbour]]
+            absorbed[neighbours] = True
+            keep[groupIdx[pos]] = True
+            mergedCount[groupIdx[pos]] = len(neighbours)
+
+    keepIdx = np.flatnonzero(keep)
+
+    return keepIdx, mergedCount[keepIdx]
+
+
+def planChipCenters(rasterFileName, shapeFileSrc, outlineSrc='', shapeSrcList=[],
+                    clipSizeMeters=50,
+                    classFieldName='TYPE',
+                    preciseMatch=False,
+                    dedupeTolerance=0.0,
+                    imgIdStart=-1,
+                    verbose=False):
+    """Compute the object centered chips cutChipFromRasterCenter would cut from rasterFileName.
+
+       A chip is the envelope of a clipSizeMeters radius around the centroid of each feature of shapeFileSrc
+       (a GeoDataFrame) inside the outline, see createCenterEnvelopes.  Features of the same class whose
+       centroids are closer than dedupeTolerance meters share one chip (0 keeps every feature).
+
+       returns pandas DataFrame in the planChipGrid manifest layout, with a row per chip in feature order and
+       featureIdx -- index of the feature of shapeFileSrc the chip is centered on
+       className -- class of the feature, '' if classFieldName is ''
+       centerX, centerY -- chip center in UTM meters (raster crs units if shapeFileSrc is not in EPSG:4326)
+       mergedCount -- number of features the chip stands for
+    """
+
+    srcImage = rio.open(rasterFileName)
+    geoTrans, poly, ulX, ulY, lrX, lrY = getRasterExtent(srcImage)
+    srcImage.close()
+
+    if outlineSrc == '':
+        geomOutline = poly
+    else:
+        with fiona.open(outlineSrc) as src:
+            outline = src.next()
+            geomOutlineBase = shape(outline['geometry'])
+            geomOutline = geomOutlineBase.intersection(poly)
+
+    utmConversionNeeded = pyproj.CRS.from_user_input(shapeFileSrc.crs).to_epsg() == 4326
+
+    possible_matches = shapeFileSrc.iloc[shapeFileSrc.sindex.query(geomOutline.envelope)]
+    # if geomOutline is very irregular, preciseMatch will be neccessary
+    if preciseMatch:
+        layerBase = possible_matches[possible_matches.intersects(geomOutline)]
+    else:
+        layerBase = possible_matches
+    if verbose:
+        print("srcFileShape = {}".format(shapeFileSrc.shape))
+        print("PossibleMatches = {}".format(possible_matches.shape))
+
+    if classFieldName == '':
+        classNameList = np.full(len(layerBase), '', dtype=object)
+    elif classFieldName in layerBase:
+        classNameList = layerBase[classFieldName].astype(str).str.replace(' ', '').values
+    else:
+        classNameList = np.full(len(layerBase), 'unknown', dtype=object)
+
+    centroid = shapely.get_coordinates(shapely.centroid(layerBase.geometry.values))
+    minXCut, minYCut, maxXCut, maxYCut, centerX, centerY = createCenterEnvelopes(
+        centroid[:, 0], centroid[:, 1], clipSizeMeters, transform_WGS_To_UTM_Flag=utmConversionNeeded)
+
+    if dedupeTolerance > 0:
+        # never merge across UTM zones, their meters are not comparable
+        if utmConversionNeeded:
+            zoneKey = np.floor(1 + (centroid[:, 0] + 180.0) / 6.0).astype(np.int64) * 2 + (centroid[:, 1] >= 0)
+        else:
+            zoneKey = np.zeros(len(centroid), dtype=np.int64)
+        groupKey = np.asarray(['{}_{}'.format(zone, className) for zone, className in zip(zoneKey, classNameList)])
+        keep, mergedCount = dedupeChipCenters(centerX, centerY, groupKey, dedupeTolerance)
+    else:
+        keep = np.arange(len(layerBase))
+        mergedCount = np.ones(len(layerBase), dtype=np.int64)
+
+    chipManifest = pd.DataFrame({'chipIdx': np.arange(len(keep)),
+                                 'imgId': np.arange(1, len(keep)+1) if imgIdStart != -1 else -1,
+                                 'featureIdx': layerBase.index.values[keep],
+                                 'className': classNameList[keep],
+                                 'centerX': centerX[keep],
+                                 'centerY': centerY[keep],
+                                 'mergedCount': mergedCount,
+                                 'minXCut': minXCut[keep],
+                                 'minYCut': minYCut[keep],
+                                 'maxXCut': maxXCut[keep],
+                                 'maxYCut': maxYCut[keep]})
+
+    addChipPixelWindow(chipManifest, geoTrans)
+
+    chipManifest['featureCount'] = countChipFeatures(chipManifest, poly, shapeSrcList)
+
+    return chipManifest
+
+
+def writeChipManifest(chipManifest, manifestFileName):
+    # write a planChipGrid manifest to csv
+    chipManifest.to_csv(manifestFileName, index=False, float_format='%.17g')
+
+
+def readChipManifest(manifestFileName):
+    # read a manifest written by writeChipManifest, an empty className stays ''
+    return pd.read_csv(manifestFileName, dtype={'className': str}, keep_default_na=False)
+
+
+def cutChipFromManifest(chipManifest, rasterFileList, shapeFileSrcList, outputDirectory='', outputPrefix='clip_',
+                        minpartialPerc=0.0, createPix=False,
+                        baseName='',
+                        shardIdx=0,
+                        shardCount=1,
+                        minFeatureCount=0,
+                        parrallelProcess=False,
+                        max_cpu=-1,
+                        clipMethod='gdalwarp',
+                        outputProfile='plain',
+                        resume=False,
+                        journalFileName='',
+                        verifyChecksums=True):
+
+    # cut the chips of a planChipGrid manifest (DataFrame or manifest file name) with createclip
+    # shardIdx, shardCount -- only cut chips with chipIdx % shardCount == shardIdx, i.e. one node of a
+    #                         chipping job split across shardCount nodes
+    # minFeatureCount -- skip chips intersecting fewer vector features
+    # resume -- record every finished chip and the md5 of its outputs in journalFileName (default
+    #           outputDirectory + '_chipJournal.jsonl') and skip chips the journal lists whose outputs still
+    #           exist (and match their md5 if verifyChecksums), so a crashed run only cuts the remaining chips
+    # shapeFileSrcList = [['path/to/vector.geojson' or GeoDataFrame, 'vectorDescription']]
+    # returns the createclip chip summaries in manifest order
+    if isinstance(chipManifest, str):
+        chipManifest = readChipManifest(chipManifest)
+
+    chipManifest = chipManifest[(chipManifest['chipIdx'] % shardCount == shardIdx) &
+                                (chipManifest['featureCount'] >= minFeatureCount)]
+
+    srcImage = rio.open(rasterFileList[0][0])
+    geoTrans, poly, ulX, ulY, lrX, lrY = getRasterExtent(srcImage)
+    srcImage.close()
+
+    if outputDirectory=="":
+        outputDirectory=os.path.dirname(rasterFileList[0][0])
+
+    rasterFileBaseList = []
+    for rasterFile in rasterFileList:
+        rasterFileBaseList.append(os.path.basename(rasterFile[0]))
+
+    shapeSrcList = readClipSources(shapeFileSrcList)
+
+    # planChipCenters manifests cut every chip into the directory of its class
+    if 'className' in chipManifest:
+        classNameList = chipManifest['className'].tolist()
+    else:
+        classNameList = ['']*len(chipManifest)
+
+    for rasterFile in rasterFileList:
+        for className in set(classNameList) | {''}:
+            os.makedirs(os.path.join(outputDirectory, rasterFile[1], className), exist_ok=True)
+
+    chipCutList = [{'maxXCut': maxXCut,
+                    'maxYCut': maxYCut,
+                    'minYCut': minYCut,
+                    'minXCut': minXCut,
+                    'imgId': int(imgId)}
+                   for maxXCut, maxYCut, minYCut, minXCut, imgId in zip(chipManifest['maxXCut'],
+                                                                       chipManifest['maxYCut'],
+                                                                       chipManifest['minYCut'],
+                                                                       chipManifest['minXCut'],
+                                                                       chipManifest['imgId'])]
+    for chipCut, className in zip(chipCutList, classNameList):
+        if className != '':
+            chipCut['className'] = className
+
+    clipOptions = {'outputDirectory': outputDirectory,
+                   'rasterFileList': rasterFileList,
+                   'rasterFileBaseList': rasterFileBaseList,
+                   'minpartialPerc': minpartialPerc,
+                   'outputPrefix': outputPrefix,
+                   'createPix': createPix,
+                   'rasterPolyEnvelope': poly,
+                   'baseName': baseName,
+                   'clipMethod': clipMethod,
+                   'outputProfile': outputProfile}
+
+    chipSummaryList = [None]*len(chipCutList)
+    chipKeyList = []
+    if resume:
+        if journalFileName == '':
+            journalFileName = os.path.normpath(outputDirectory) + '_chipJournal.jsonl'
+        chipJournal = readChipJournal(journalFileName)
+
+        shapeSrcKeyList = [[shapeSrc[1], clipSourceChecksum(shapeSrc[0])] for shapeSrc in shapeSrcList]
+        for chipPos, chipCut in enumerate(chipCutList):
+            chipKey = chipJournalKey(chipCut, clipOptions, shapeSrcKeyList)
+            chipKeyList.append(chipKey)
+            if chipKey in chipJournal and \
+                    chipOutputsValid(chipJournal[chipKey]['fileChecksums'], verifyChecksums=verifyChecksums):
+                chipSummaryList[chipPos] = chipJournal[chipKey]['chipSummary']
+
+        print('{} of {} chips already cut'.format(len(chipCutList) - chipSummaryList.count(None),
+                                                   len(chipCutList)))
+
+    chipPosList = [chipPos for chipPos, chipSummary in enumerate(chipSummaryList) if chipSummary is None]
+
+    # the journal, the workers and the progress bar are closed when the loop ends, also if a chip raises
+    with contextlib.ExitStack() as exitStack:
+        if resume:
+            journalFile = exitStack.enter_context(openChipJournal(journalFileName))
+        pbar = exitStack.enter_context(tqdm(total=len(chipPosList), desc='Creating Chips'))
+
+        if parrallelProcess:
+            if max_cpu == -1:
+                max_cpu = multiprocessing.cpu_count()
+            # each worker gets the vector sources once and keeps its own open raster datasets,
+            # imap returns the chip summaries in chipCutList order
+            p = exitStack.enter_context(multiprocessing.Pool(processes=max_cpu, initializer=_initChipWorker,
+                                                             initargs=(shapeSrcList, clipOptions, resume)))
+            chipResultIter = p.imap(_createclipWorker, [chipCutList[chipPos] for chipPos in chipPosList],
+                                    chunksize=max(1, min(64, len(chipPosList) // (max_cpu * 4))))
         else:
-            for llY in yInterval:
-                uRX = llX+clipSizeMX
-                uRY = llY+clipSizeMY
+            chipResultIter = (createclipWithChecksums(chipCutList[chipPos], shapeSrcList, clipOptions,
+                                                      checksums=resume)
+                              for chipPos in chipPosList)
+
+        for chipPos, (chipSummary, fileChecksums) in zip(chipPosList, chipResultIter):
+            chipSummaryList[chipPos] = chipSummary
+            if resume:
+                journalFile.write(json.dumps({'chipKey': chipKeyList[chipPos],
+                                              'chipSummary': chipSummary,
+                                              'fileChecksums': fileChecksums}) + '\n')
+                journalFile.flush()
+            pbar.update(1)
 
-                # check if uRX or uRY is outside image
-                if noBlackSpace:
-                    if uRX > maxX:
-                        uRX = maxX
-                        llX = maxX - clipSizeMX
-                    if uRY > maxY:
-                        uRY = maxY
-                        llY = maxY - clipSizeMY
+    return chipSummaryList
 
 
+def fileChecksum(fileName):
+    # md5 hex digest of a file
+    md5 = hashlib.md5()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
 
+    return md5.hexdigest()
 
-                polyCut = createPolygonFromCorners(llX, llY, uRX, uRY)
 
+def chipOutputFileList(chipSummary, clipOptions, className=''):
+    # raster and vector files written by createclip for a chip of cutChipFromManifest
+    fileList = [os.path.join(clipOptions['outputDirectory'], rasterFile[1], className, chipName)
+                for rasterFile, chipName in zip(clipOptions['rasterFileList'], chipSummary['chipName'])]
+    fileList.extend(chipSummary['geoVectorName'])
 
+    return fileList
 
 
+def createclipWithChecksums(chipCut, shapeSrcList, clipOptions, checksums=False):
+    # returns (createclip chip summary, {outputFile: md5} or {} if not checksums)
+    chipSummary = createclip(shapeSrcList=shapeSrcList, **chipCut, **clipOptions)
+    fileChecksums = {}
+    if checksums:
+        for fileName in chipOutputFileList(chipSummary, clipOptions, className=chipCut.get('className', '')):
+            fileChecksums[fileName] = fileChecksum(fileName)
 
+    return chipSummary, fileChecksums
 
 
-                if not createPix:
-                    polyCut = shapely.ops.transform(transform_UTM_To_WGS84, polyCut)
+def clipSourceChecksum(geoDF):
+    # sha1 of the columns, geometry and attributes of a vector source, an edited source gets a new checksum
+    sha = hashlib.sha1()
+    sha.update(json.dumps([str(column) for column in geoDF.columns]).encode('utf-8'))
+    sha.update(b''.join(shapely.to_wkb(np.asarray(geoDF.geometry.values))))
+    attributeDF = geoDF.drop(columns=geoDF.geometry.name)
+    if len(attributeDF.columns) > 0:
+        sha.update(pd.util.hash_pandas_object(attributeDF.astype(str), index=True).values.tobytes())
 
-                ## add debug line do cuts
-                if polyCut.intersects(geomOutline):
-                    if verbose:
-                        print("Do it.")
-                        print('minYCut = {}'.format(minYCut))
-                        print('maxYCut = {}'.format(maxYCut))
-                        print('minXCut = {}'.format(minXCut))
-                        print('maxXCut = {}'.format(maxXCut))
+    return sha.hexdigest()
 
-                        print('clipsizeMX ={}'.format(clipSizeMX))
-                        print('clipsizeMY ={}'.format(clipSizeMY))
 
+def chipJournalKey(chipCut, clipOptions, shapeSrcKeyList):
+    # sha1 identifying a chip and every option that changes its outputs
+    # shapeSrcKeyList -- [['vectorDescription', clipSourceChecksum]] of the vector sources
+    keyDict = {'chipCut': chipCut,
+               'rasterPolyEnvelope': clipOptions['rasterPolyEnvelope'].wkt,
+               'shapeSrc': shapeSrcKeyList}
+    for key, value in clipOptions.items():
+        if key != 'rasterPolyEnvelope':
+            keyDict[key] = value
 
-                    minXCut = llX
-                    minYCut = llY
-                    maxXCut = uRX
-                    maxYCut = uRY
+    return hashlib.sha1(json.dumps(keyDict, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
 
+def readChipJournal(journalFileName):
+    # returns {chipKey: journal entry} of a cutChipFromManifest journal, a line cut off by a crash is ignored
+    chipJournal = {}
+    if not os.path.isfile(journalFileName):
+        return chipJournal
 
+    with open(journalFileName, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            chipJournal[entry['chipKey']] = entry
 
+    return chipJournal
 
-                    idx = idx+1
-                    if imgIdStart == -1:
-                        imgId = -1
-                    else:
-                        imgId = idx
 
-                    chipSummary = createclip(outputDirectory, rasterFileList, shapeSrcList,
-                                             maxXCut, maxYCut, minYCut, minXCut,
-                                             rasterFileBaseList=rasterFileBaseList,
-                                             minpartialPerc=minpartialPerc,
-                                             outputPrefix=outputPrefix,
-                                             createPix=createPix,
-                                             rasterPolyEnvelope=poly,
-                                             baseName=baseName,
-                                             imgId=imgId)
-                    chipSummaryList.append(chipSummary)
+def openChipJournal(journalFileName):
+    # open a chip journal for appending, ending a line cut off by a crash first
+    journalFile = open(journalFileName, 'a')
+    if journalFile.tell() > 0:
+        with open(journalFileName, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                journalFile.write('\n')
 
-                    pbar.update(1)
+    return journalFile
 
-    pbar.close()
 
-    return chipSummaryList
+def chipOutputsValid(fileChecksums, verifyChecksums=True):
+    # True if every journalled output exists and, if verifyChecksums, still has its md5
+    for fileName, checksum in fileChecksums.items():
+        if not os.path.isfile(fileName):
+            return False
+        if verifyChecksums and fileChecksum(fileName) != checksum:
+            return False
+
+    return True
+
+
+def cutChipFromMosaic(rasterFileList, shapeFileSrcList, outlineSrc='',outputDirectory='', outputPrefix='clip_',
+                      clipSizeMX=100, clipSizeMY=100, clipOverlap=0.0, minpartialPerc=0.0, createPix=False,
+                      baseName='',
+                      imgIdStart=-1,
+                      parrallelProcess=False,
+                      noBlackSpace=False,
+                      randomClip=-1,
+                      verbose=False,
+                      clipMethod='gdalwarp',
+                      max_cpu=-1,
+                      manifestFileName='',
+                      dryRun=False,
+                      minFeatureCount=0,
+                      resume=False,
+                      journalFileName='',
+                      outputProfile='plain'):
+
+    #rasterFileList = [['rasterLocation', 'rasterDescription']]
+    # i.e rasterFileList = [['/path/to/3band_AOI_1.tif, '3band'],
+    #                       ['/path/to/8band_AOI_1.tif, '8band']
+    #                        ]
+    # parrallelProcess -- cut the chips with a Pool of max_cpu workers (-1 uses every core)
+    # manifestFileName -- write the chip grid of planChipGrid to this csv, see cutChipFromManifest
+    # dryRun -- only plan the chip grid and return the manifest DataFrame instead of the chip summaries
+    # minFeatureCount -- skip chips intersecting fewer vector features
+    # resume -- skip chips a previous, interrupted run already cut, see cutChipFromManifest
+    # outputProfile -- tiling, compression or COG layout of the chips, see rasterOutputProfile
+
+    shapeSrcList = readClipSources(shapeFileSrcList)
+
+    chipManifest = planChipGrid(rasterFileList[0][0], outlineSrc=outlineSrc, shapeSrcList=shapeSrcList,
+                                clipSizeMX=clipSizeMX, clipSizeMY=clipSizeMY, clipOverlap=clipOverlap,
+                                createPix=createPix,
+                                imgIdStart=imgIdStart,
+                                noBlackSpace=noBlackSpace,
+                                verbose=verbose)
+    print('{} chips planned'.format(len(chipManifest)))
+
+    if manifestFileName != '':
+        writeChipManifest(chipManifest, manifestFileName)
+
+    if dryRun:
+        return chipManifest
+
+    return cutChipFromManifest(chipManifest, rasterFileList, shapeSrcList,
+                               outputDirectory=outputDirectory,
+                               outputPrefix=outputPrefix,
+                               minpartialPerc=minpartialPerc,
+                               createPix=createPix,
+                               baseName=baseName,
+                               minFeatureCount=minFeatureCount,
+                               parrallelProcess=parrallelProcess,
+                               max_cpu=max_cpu,
+                               clipMethod=clipMethod,
+                               outputProfile=outputProfile,
+                               resume=resume,
+                               journalFileName=journalFileName)
+
+
+_chipWorkerShapeSrcList = []
+_chipWorkerClipOptions = {}
+_chipWorkerChecksums = False
+
+
+def _initChipWorker(shapeSrcList, clipOptions, checksums=False):
+    # Pool initializer of cutChipFromManifest, datasets opened by the parent are not shared with the workers
+    global _chipWorkerShapeSrcList, _chipWorkerClipOptions, _chipWorkerChecksums
+    _chipWorkerShapeSrcList = shapeSrcList
+    _chipWorkerClipOptions = clipOptions
+    _chipWorkerChecksums = checksums
+    _rasterDatasetCache.clear()
+
+
+def _createclipWorker(chipCut):
+
+    return createclipWithChecksums(chipCut, _chipWorkerShapeSrcList, _chipWorkerClipOptions,
+                                   checksums=_chipWorkerChecksums)
+
+
+_rasterDatasetCache = collections.OrderedDict()
+
+
+def openRasterCached(rasterFileName, maxOpenDatasets=64):
+    """Return an open rasterio dataset for rasterFileName, reusing the dataset opened by an earlier call.
+
+       Datasets stay open for the life of the process (each Pool worker keeps its own) so cutting many chips
+       does not reopen the source every time.  The least recently used dataset is closed once more than
+       maxOpenDatasets are open, see closeRasterCache.
+    """
+
+    if rasterFileName in _rasterDatasetCache:
+        _rasterDatasetCache.move_to_end(rasterFileName)
+        return _rasterDatasetCache[rasterFileName]
+
+    src = rio.open(rasterFileName)
+    _rasterDatasetCache[rasterFileName] = src
+    while len(_rasterDatasetCache) > maxOpenDatasets:
+        rasterFileNameOld, srcOld = _rasterDatasetCache.popitem(last=False)
+        srcOld.close()
+
+    return src
+
+
+def closeRasterCache():
+    # close every dataset opened by openRasterCached
+    while _rasterDatasetCache:
+        rasterFileName, src = _rasterDatasetCache.popitem()
+        src.close()
+
+
+rasterOutputProfiles = {'plain': {'driver': 'GTiff'},
+                        'deflate': {'driver': 'GTiff', 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+                                    'compress': 'deflate', 'zlevel': 6},
+                        'zstd': {'driver': 'GTiff', 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+                                 'compress': 'zstd', 'zstd_level': 9},
+                        'lzw': {'driver': 'GTiff', 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+                                'compress': 'lzw'},
+                        'jpeg': {'driver': 'GTiff', 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+                                 'compress': 'jpeg', 'photometric': 'ycbcr', 'jpeg_quality': 90},
+                        'cog': {'driver': 'COG', 'blocksize': 256, 'compress': 'deflate', 'level': 6,
+                                'overviews': 'auto'}
+                        }
+
+
+def rasterOutputProfile(outputProfile, count, dtype):
+    """Return the rasterio creation options of a rasterOutputProfiles entry for a count band raster of dtype.
+
+       'plain' -- untiled, uncompressed GTiff (the gdalwarp chip default)
+       'deflate', 'zstd', 'lzw' -- 256x256 tiled GTiff, lossless, with horizontal (integer) or floating point predictor
+       'jpeg' -- tiled JPEG-in-TIFF in YCbCr, lossy, only for 3 band uint8 rasters, others get 'deflate'
+       'cog' -- Cloud Optimized GeoTIFF with deflate, predictor and overviews
+
+       PHOTOMETRIC=RGB is set for GTiffs with 3 or more bands, as gdalwarp -co PHOTOMETRIC=rgb does.
+    """
+
+    if outputProfile not in rasterOutputProfiles:
+        raise ValueError('outputProfile must be one of {}, not {}'.format(sorted(rasterOutputProfiles), outputProfile))
+
+    if outputProfile == 'jpeg' and not (count == 3 and np.dtype(dtype) == np.uint8):
+        outputProfile = 'deflate'
+
+    profile = dict(rasterOutputProfiles[outputProfile])
+    if profile['driver'] == 'GTiff' and count >= 3 and 'photometric' not in profile:
+        profile['photometric'] = 'rgb'
+
+    if outputProfile == 'cog':
+        profile['predictor'] = 'YES'
+    elif profile.get('compress', 'jpeg') != 'jpeg':
+        if np.issubdtype(np.dtype(dtype), np.floating):
+            profile['predictor'] = 3
+        else:
+            profile['predictor'] = 2
+
+    return profile
+
+
+def gdalOutputOptions(profile):
+    # gdal command line -of/-co options of a rasterOutputProfile
+    optionList = ['-of', profile['driver']]
+    for key, value in profile.items():
+        if key == 'driver':
+            continue
+        if value is True:
+            value = 'YES'
+        optionList.extend(['-co', '{}={}'.format(key.upper(), value)])
+
+    return optionList
+
+
+def clipWindowGrid(srcTransform, srcWidth, srcHeight, minXCut, minYCut, maxXCut, maxYCut,
+                   pixelOffset=None, ratio=(1, 1)):
+    """Return the gdalwarp -te output grid of a chip and the source pixel under each output pixel centre.
+
+       The output size is the extent over the source resolution, rounded, as gdalwarp computes it without -tr.
+       pixelOffset -- (col, row) fractional pixel position of (minXCut, maxYCut) in a finer grid with the same
+                      origin whose resolution is srcTransform's divided by ratio.  Grids at integer resolution
+                      ratios (PAN and MUL) then share one offset computation (default =None, use srcTransform)
+
+       returns dict with outTransform, width, height, rowList, colList (source pixel of each output row/column),
+       validRow, validCol (positions inside the source) and window (source window covering them, or None)
+    """
+
+    xRes = abs(srcTransform.a)
+    yRes = abs(srcTransform.e)
+    width = max(1, int((maxXCut - minXCut + xRes / 2.0) / xRes))
+    height = max(1, int((maxYCut - minYCut + yRes / 2.0) / yRes))
+    outTransform = af.Affine((maxXCut - minXCut) / width, 0, minXCut, 0, -(maxYCut - minYCut) / height, maxYCut)
+
+    if pixelOffset is None:
+        colOffset = (minXCut - srcTransform.c) / srcTransform.a
+        rowOffset = (maxYCut - srcTransform.f) / srcTransform.e
+    else:
+        colOffset = pixelOffset[0] / ratio[0]
+        rowOffset = pixelOffset[1] / ratio[1]
+
+    colList = np.floor(colOffset + (np.arange(width) + 0.5) * (outTransform.a / srcTransform.a)).astype(np.int64)
+    rowList = np.floor(rowOffset + (np.arange(height) + 0.5) * (outTransform.e / srcTransform.e)).astype(np.int64)
+    validCol = np.flatnonzero((colList >= 0) & (colList < srcWidth))
+    validRow = np.flatnonzero((rowList >= 0) & (rowList < srcHeight))
+
+    if len(validCol) > 0 and len(validRow) > 0:
+        colStart = colList[validCol].min()
+        rowStart = rowList[validRow].min()
+        window = Window(colStart, rowStart, colList[validCol].max() + 1 - colStart,
+                        rowList[validRow].max() + 1 - rowStart)
+    else:
+        window = None
+
+    return {'outTransform': outTransform,
+            'width': width,
+            'height': height,
+            'rowList': rowList,
+            'colList': colList,
+            'validRow': validRow,
+            'validCol': validCol,
+            'window': window}
+
+
+def clipRasterWindowSet(rasterFileNameList, outputFileNameList, minXCut, minYCut, maxXCut, maxYCut,
+                        outputProfile='plain'):
+    """Clip the same extent from several co-registered rasters in one pass, see clipRasterWindow.
+
+       The chip grid and source windows are computed once per distinct source grid (e.g. PS-RGB and PS-MS
+       share one).  Grids sharing the origin of the finest grid at an integer resolution ratio (PAN and MUL)
+       reuse its pixel offset.  Each source is read once, through the open dataset cache, and all outputs are
+       written with outputProfile (see rasterOutputProfile).
+
+       returns the output transform of each raster
+    """
+
+    srcList = [openRasterCached(rasterFileName) for rasterFileName in rasterFileNameList]
+    for src, rasterFileName in zip(srcList, rasterFileNameList):
+        if src.transform.b != 0 or src.transform.d != 0:
+            raise ValueError('{} has a rotated geotransform, use clipMethod=gdalwarp'.format(rasterFileName))
+
+    refTransform = min((src.transform for src in srcList), key=lambda srcTransform: abs(srcTransform.a))
+    refOffset = ((minXCut - refTransform.c) / refTransform.a, (maxYCut - refTransform.f) / refTransform.e)
+
+    gridDict = {}
+    outTransformList = []
+    for src, outputFileName in zip(srcList, outputFileNameList):
+        srcTransform = src.transform
+        gridKey = (srcTransform.a, srcTransform.c, srcTransform.e, srcTransform.f, src.width, src.height)
+        if gridKey not in gridDict:
+            xRatio = srcTransform.a / refTransform.a
+            yRatio = srcTransform.e / refTransform.e
+            if np.isclose(srcTransform.c, refTransform.c) and np.isclose(srcTransform.f, refTransform.f) and \
+                    np.isclose(xRatio, round(xRatio)) and np.isclose(yRatio, round(yRatio)):
+                gridDict[gridKey] = clipWindowGrid(srcTransform, src.width, src.height,
+                                                   minXCut, minYCut, maxXCut, maxYCut,
+                                                   pixelOffset=refOffset, ratio=(round(xRatio), round(yRatio)))
+            else:
+                gridDict[gridKey] = clipWindowGrid(srcTransform, src.width, src.height,
+                                                   minXCut, minYCut, maxXCut, maxYCut)
+
+        outTransformList.append(writeClipWindow(src, gridDict[gridKey], outputFileName,
+                                                outputProfile=outputProfile))
+
+    return outTransformList
+
+
+def writeClipWindow(src, clipGrid, outputFileName, outputProfile='plain'):
+    # read the window of a clipWindowGrid from the open dataset src and write it as a GTiff
+    # areas outside src are filled with its nodata value (or 0)
+    if src.nodata is not None:
+        fillValue = src.nodata
+    else:
+        fillValue = 0
+    clipArray = np.full((src.count, clipGrid['height'], clipGrid['width']), fillValue, dtype=src.dtypes[0])
+
+    window = clipGrid['window']
+    if window is not None:
+        validRow = clipGrid['validRow']
+        validCol = clipGrid['validCol']
+        srcArray = src.read(window=window)
+        clipArray[:, validRow[:, None], validCol[None, :]] = \
+            srcArray[:, (clipGrid['rowList'][validRow] - window.row_off)[:, None],
+                     (clipGrid['colList'][validCol] - window.col_off)[None, :]]
+
+    profile = {'width': clipGrid['width'],
+               'height': clipGrid['height'],
+               'count': src.count,
+               'dtype': src.dtypes[0],
+               'crs': src.crs,
+               'transform': clipGrid['outTransform'],
+               'nodata': src.nodata}
+    profile.update(rasterOutputProfile(outputProfile, src.count, src.dtypes[0]))
+
+    with rio.open(outputFileName, 'w', **profile) as dst:
+        dst.write(clipArray)
+
+    return clipGrid['outTransform']
+
+
+def clipRasterWindow(rasterFileName, outputFileName, minXCut, minYCut, maxXCut, maxYCut,
+                     outputProfile='plain'):
+    """Clip minXCut, minYCut, maxXCut, maxYCut (in the raster crs) from rasterFileName into outputFileName in process.
+
+       The output grid and pixels are those of
+       gdalwarp -te minXCut minYCut maxXCut maxYCut -co PHOTOMETRIC=rgb rasterFileName outputFileName
+       i.e. the source resolution adjusted to fit the extent exactly and nearest neighbour sampling of each
+       output pixel centre, with areas outside the source filled with its nodata value (or 0).
+       Only the source window covering the clip is read.  Rotated sources raise a ValueError.
+       outputProfile selects tiling and compression, see rasterOutputProfile.
+
+       returns the output rasterio transform
+    """
+
+    return clipRasterWindowSet([rasterFileName], [outputFileName], minXCut, minYCut, maxXCut, maxYCut,
+                               outputProfile=outputProfile)[0]
+
 
 def createclip(outputDirectory, rasterFileList, shapeSrcList,
                maxXCut, maxYCut, minYCut, minXCut,
@@ -691,8 +1668,13 @@ def createclip(outputDirectory, rasterFileList, shapeSrcList,
                baseName='',
                imgId=-1,
                s3Options=[],
-               verbose=False):
+               verbose=False,
+               clipMethod='gdalwarp',
+               outputProfile='plain'):
 
+    # clipMethod -- 'gdalwarp' runs a gdalwarp subprocess per raster, s3Options are added to its command line
+    #               'rasterio' clips in process with clipRasterWindow, reusing open datasets, same output pixels
+    # outputProfile -- tiling, compression or COG layout of the chips, see rasterOutputProfile
     #rasterFileList = [['rasterLocation', 'rasterDescription']]
     # i.e rasterFileList = [['/path/to/3band_AOI_1.tif, '3band'],
     #                       ['/path/to/8band_AOI_1.tif, '8band']
@@ -731,20 +1713,32 @@ def createclip(outputDirectory, rasterFileList, shapeSrcList,
 
     # clip raster
 
-    for chipName, rasterFile in zip(chipNameList, rasterFileList):
-        outputFileName = os.path.join(outputDirectory, rasterFile[1], className, chipName)
-        ## Clip Image
-        if verbose:
+    outputFileNameList = [os.path.join(outputDirectory, rasterFile[1], className, chipName)
+                          for chipName, rasterFile in zip(chipNameList, rasterFileList)]
+    if verbose:
+        for rasterFile, outputFileName in zip(rasterFileList, outputFileNameList):
             print(rasterFile)
             print(outputFileName)
-        #TODO replace gdalwarp with rasterio and windowed reads
 
-        cmd = ["gdalwarp", "-te", "{}".format(minXCut), "{}".format(minYCut),  "{}".format(maxXCut),
-                         "{}".format(maxYCut),
-                         '-co', 'PHOTOMETRIC=rgb',
-                         rasterFile[0], outputFileName]
-        cmd.extend(s3Options)
-        subprocess.call(cmd)
+    if clipMethod == 'rasterio':
+        # all rasters in one pass, window math shared between rasters on the same or integer ratio grids
+        clipRasterWindowSet([rasterFile[0] for rasterFile in rasterFileList], outputFileNameList,
+                            minXCut, minYCut, maxXCut, maxYCut, outputProfile=outputProfile)
+    elif clipMethod == 'gdalwarp':
+        for rasterFile, outputFileName in zip(rasterFileList, outputFileNameList):
+            if outputProfile == 'plain':
+                outputOptions = ['-co', 'PHOTOMETRIC=rgb']
+            else:
+                src = openRasterCached(rasterFile[0])
+                outputOptions = gdalOutputOptions(rasterOutputProfile(outputProfile, src.count, src.dtypes[0]))
+            cmd = ["gdalwarp", "-te", "{}".format(minXCut), "{}".format(minYCut),  "{}".format(maxXCut),
+                             "{}".format(maxYCut)]
+            cmd.extend(outputOptions)
+            cmd.extend(['-overwrite', rasterFile[0], outputFileName])
+            cmd.extend(s3Options)
+            subprocess.call(cmd)
+    else:
+        raise ValueError("clipMethod must be 'gdalwarp' or 'rasterio', not {}".format(clipMethod))
 
     baseLayerRasterName = os.path.join(outputDirectory, rasterFileList[0][1], className, chipNameList[0])
     outputFileName = os.path.join(outputDirectory, rasterFileList[0][1], chipNameList[0])
@@ -754,6 +1748,7 @@ def createclip(outputDirectory, rasterFileList, shapeSrcList,
     if rasterPolyEnvelope.area == 0:
         srcImage = rio.open(rasterFileList[0][0])
         geoTrans, rasterPolyEnvelope, ulX, ulY, lrX, lrY = getRasterExtent(srcImage)
+        polyVectorCut = polyCutWGS.intersection(rasterPolyEnvelope)
         if verbose:
             print("rasterPolyEnvelope={}".format(rasterPolyEnvelope.wkt))
             print("polyCutWGS={}".format(polyCutWGS.wkt))
@@ -800,106 +1795,58 @@ def cutChipFromRasterCenter(rasterFileList, shapeFileSrc, shapeFileSrcList, outl
                             minpartialPerc=0.1,
                             preciseMatch=False,
                             verbose=False,
-                            baseName=''
+                            baseName='',
+                            clipMethod='gdalwarp',
+                            outputProfile='plain',
+                            dedupeTolerance=0.0,
+                            parrallelProcess=False,
+                            max_cpu=-1,
+                            manifestFileName='',
+                            dryRun=False,
+                            resume=False,
+                            journalFileName='',
+                            imgIdStart=-1
                             ):
     #rasterFileList = [['rasterLocation', 'rasterDescription']]
     # i.e rasterFileList = [['/path/to/3band_AOI_1.tif, '3band'],
     #                       ['/path/to/8band_AOI_1.tif, '8band']
     #                        ]
-    srcImage = rio.open(rasterFileList[0][0])
-    geoTrans, poly, ulX, ulY, lrX, lrY = getRasterExtent(srcImage)
-
-    if outputDirectory == "":
-        outputDirectory = os.path.dirname(rasterFileList[0])
-
-    rasterFileBaseList = []
-    for rasterFile in rasterFileList:
-        rasterFileBaseList.append(os.path.basename(rasterFile[0]))
-    # Check if Transform Is Neccessary
-    #transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = createUTMTransform(poly)
-    #poly = shapely.ops.transform(transform_WGS84_To_UTM, poly)
-
-
-
-
-
-    if outlineSrc == '':
-        geomOutline = poly
-        print('geomOutline poly={}'.format(geomOutline.wkt))
-
-    else:
-        with fiona.open(outlineSrc) as src:
-            outline = src.next()
-            geomOutlineBase = shape(outline['geometry'])
-            geomOutline = geomOutlineBase.intersection(poly)
-
-    # use sindex function of geoPandas for filter
-    shapeSrcBaseGDF = shapeFileSrc
-    if shapeFileSrc.crs['init'] == 'epsg:4326':
-        utmConversionNeeded = True
-    else:
-        utmConversionNeeded = False
-
-    print("srcFileShape = {}".format(shapeSrcBaseGDF.shape))
-    shapeSrcBaseIndex = shapeSrcBaseGDF.sindex
-    possible_matches_index = list(shapeSrcBaseIndex.intersection(geomOutline.bounds))
-    possible_matches = shapeSrcBaseGDF.iloc[possible_matches_index]
-    print("PossibleMatches = {}".format(possible_matches.shape))
-    #if geomOutline is very irregular, preciseMatch will be neccessary
-    if preciseMatch:
-        layerBase = possible_matches[possible_matches.intersects(geomOutline)]
-    else:
-        layerBase = possible_matches
-
-
-
-    for rasterFile in rasterFileList:
-        if not os.path.exists(os.path.join(outputDirectory, rasterFile[1])):
-            os.makedirs(os.path.join(outputDirectory, rasterFile[1]))
-
-    shapeSrcList = []
-    for shapeFileSrc in shapeFileSrcList:
-        print(shapeFileSrc[1])
-        shapeSrcList.append([gpd.read_file(shapeFileSrc[0]), shapeFileSrc[1]])
-
-    chipSummaryList = []
-    for idx, feature in tqdm(layerBase.iterrows(), desc="Processing Features"):
-        featureGeom = feature['geometry']
-        #cx = featureGeom.centroid.x
-        #cy = featureGeom.centroid.y
-
-        polyCut = createPolygonFromCenterPoint(featureGeom.centroid, radiusMeters=clipSizeMeters, transform_WGS_To_UTM_Flag=utmConversionNeeded)
-
-        if verbose:
-            print(classFieldName)
-        if classFieldName!='':
-            if classFieldName in feature:
-                classDescription = feature[classFieldName]
-            else:
-                classDescription = 'unknown'
-
-            for rasterFile in rasterFileList:
-                if not os.path.exists(os.path.join(outputDirectory, rasterFile[1], classDescription)):
-                    os.makedirs(os.path.join(outputDirectory, rasterFile[1], classDescription))
-        else:
-            classDescription=''
-        #Eliminate WhiteSpace
-        classDescription = classDescription.replace(" ","")
-
-        minXCut, minYCut, maxXCut, maxYCut = polyCut.bounds
-
-        chipSummary = createclip(outputDirectory, rasterFileList, shapeSrcList,
-                       maxXCut, maxYCut, minYCut, minXCut,
-                       rasterFileBaseList=rasterFileBaseList,
-                       minpartialPerc=minpartialPerc,
-                       outputPrefix=outputPrefix,
-                       createPix=createPix,
-                       rasterPolyEnvelope=poly,
-                       className=classDescription,
-                       baseName=baseName
-                                 )
-
-        chipSummaryList.append(chipSummary)
+    # shapeFileSrc -- GeoDataFrame of the objects, a chip is cut around the centroid of each
+    # dedupeTolerance -- objects of the same class closer than this many meters share one chip
+    # parrallelProcess, max_cpu, manifestFileName, dryRun, resume -- see cutChipFromMosaic
+    # imgIdStart -- -1 names chips by their bounds, otherwise chips are named img1, img2, ... as cutChipFromMosaic does
+    # returns the createclip chip summaries in object order, or the planChipCenters manifest if dryRun
+
+    shapeSrcList = readClipSources(shapeFileSrcList)
+
+    chipManifest = planChipCenters(rasterFileList[0][0], shapeFileSrc, outlineSrc=outlineSrc,
+                                   shapeSrcList=shapeSrcList,
+                                   clipSizeMeters=clipSizeMeters,
+                                   classFieldName=classFieldName,
+                                   preciseMatch=preciseMatch,
+                                   dedupeTolerance=dedupeTolerance,
+                                   imgIdStart=imgIdStart,
+                                   verbose=verbose)
+    print('{} chips planned for {} objects'.format(len(chipManifest), chipManifest['mergedCount'].sum()))
+
+    if manifestFileName != '':
+        writeChipManifest(chipManifest, manifestFileName)
+
+    if dryRun:
+        return chipManifest
+
+    return cutChipFromManifest(chipManifest, rasterFileList, shapeSrcList,
+                               outputDirectory=outputDirectory,
+                               outputPrefix=outputPrefix,
+                               minpartialPerc=minpartialPerc,
+                               createPix=createPix,
+                               baseName=baseName,
+                               parrallelProcess=parrallelProcess,
+                               max_cpu=max_cpu,
+                               clipMethod=clipMethod,
+                               outputProfile=outputProfile,
+                               resume=resume,
+                               journalFileName=journalFileName)
 
 
 def rotateClip(clipFileName, sourceGeoJson, rotaionList=[0,90,180,275]):
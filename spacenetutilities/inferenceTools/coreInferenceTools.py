@@ -10,6 +10,7 @@ import shapely
 import pyproj
 from functools import partial
 from spacenetutilities import geoTools as gT
+from spacenetutilities.labeltools import coreLabelTools as clT
 
 
 def resampleImage(array, spatialScaleFactor, src_meta=[], src_transform=[], src_crs=[], dst_transform=[],
@@ -152,7 +153,8 @@ def returnImgArrayForTensorFlowFromRasterio(dataArray,
                                             maxPercentToClip=100,
                                             maxBandValue=255,
                                             dataFormat=np.uint8,
-                                            transposeOrder=[1,2,0]
+                                            transposeOrder=[1,2,0],
+                                            stretchStatistics=None
                                             ):
 
     return returnImgArrayFromArray(dataArray,
@@ -161,18 +163,34 @@ def returnImgArrayForTensorFlowFromRasterio(dataArray,
                                    maxPercentToClip=maxPercentToClip,
                                    maxBandValue=maxBandValue,
                                    dataFormat=dataFormat,
-                                   transposeOrder=transposeOrder)
+                                   transposeOrder=transposeOrder,
+                                   stretchStatistics=stretchStatistics)
 
 def returnImgArrayFromArray(dataArray, bandsToInclude=[], maxBandValue=-1,
                             minPercentToClip=0,
                             maxPercentToClip=100,
                             verbose=False,
                             dataFormat=np.uint8,
-                            transposeOrder=[1,2,0]):
+                            transposeOrder=[1,2,0],
+                            stretchStatistics=None):
 
+    # stretchStatistics -- coreLabelTools.computeStretchStatistics dict or sidecar file of the dataset, the clip
+    #                      percentile is taken from its histograms of bandsToInclude (all bands of dataArray if
+    #                      empty) instead of from dataArray, and 8 or 16 bit data is scaled with a lookup table.
+    #                      The statistics must be of dataArray's dtype and have histograms of those bands
 
     ## Set maxBandValue to -1 to perform zero normalization
-    maxImgValue = np.percentile(dataArray, maxPercentToClip)
+    if stretchStatistics is not None:
+        stretchStatistics = clT.readStretchStatistics(stretchStatistics)
+        if bandsToInclude:
+            bandIndexes = [band+1 for band in bandsToInclude]
+        else:
+            bandIndexes = list(range(1, dataArray.shape[0]+1))
+        histograms = clT.stretchStatisticsHistograms(stretchStatistics, bandIndexes, dataArray.dtype)
+        maxImgValue = clT.histogramPercentile(histograms.sum(axis=0), maxPercentToClip,
+                                              valueOffset=stretchStatistics['valueOffset'])
+    else:
+        maxImgValue = np.percentile(dataArray, maxPercentToClip)
     if bandsToInclude:
         img = dataArray[bandsToInclude]
     else:
@@ -183,6 +201,16 @@ def returnImgArrayFromArray(dataArray, bandsToInclude=[], maxBandValue=-1,
         #maxImgValue = np.percentile(img, maxPercentToClip)
         scale_factor = maxBandValue/maxImgValue
 
+    valueOffset = clT.histogramValueOffset(img.dtype)
+    if stretchStatistics is not None and valueOffset is not None and maxBandValue > -1:
+        levels = 1 << (8*img.dtype.itemsize)
+        lut = np.clip(scale_factor*(np.arange(levels, dtype=np.float64) + valueOffset), 0, maxBandValue)
+        lut = lut.astype(dataFormat)
+        if valueOffset != 0:
+            img = img.astype(np.int32) - valueOffset
+
+        return lut[img].transpose(transposeOrder)
+
     img = scale_factor*img
     img = np.clip(img, 0, maxBandValue)
 
@@ -6,10 +6,14 @@ import glob
 import shapely
 import fiona
 import json
+import collections
+import multiprocessing
 import geopandas as gpd
 import rasterio
-from scipy.ndimage import morphology
+from scipy import ndimage
+from scipy.spatial import cKDTree
 from rasterio import features
+from rasterio.windows import Window
 from rasterio.rio import convert
 from shapely.geometry.polygon import Polygon
 from shapely.geometry.linestring import LineString
@@ -28,8 +32,8 @@ def evaluateLineStringPlane(geom, label='Airplane'):
 
     transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = gT.createUTMTransform(geom)
 
-    noseToTail = shapely.ops.tranform(transform_WGS84_To_UTM, noseToTail)
-    wingLength = shapely.ops.tranform(transform_WGS84_To_UTM, wingLength)
+    noseToTail = shapely.ops.transform(transform_WGS84_To_UTM, noseToTail)
+    wingLength = shapely.ops.transform(transform_WGS84_To_UTM, wingLength)
 
     Length = noseToTail.length
     Width = wingLength.length
@@ -42,7 +46,7 @@ def evaluateLineStringBoat(geom, label='Boat', aspectRatio=3):
 
 
     transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = gT.createUTMTransform(geom)
-    geom = shapely.ops.tranform(transform_WGS84_To_UTM, geom)
+    geom = shapely.ops.transform(transform_WGS84_To_UTM, geom)
 
     pt0 = geom.coords[0] # Stern
     pt1 = geom.coords[1] # Bow
@@ -158,7 +162,11 @@ def createRasterFromGeoJson(srcGeoJson,
                             burnValue=255,
                             burnValueField='',
                            bufferSizeM=0,
-                           bufferMuliplierField=''):
+                           bufferMuliplierField='',
+                           blockStreaming=False,
+                           blockSize=512,
+                           parallelProcess=False,
+                           max_cpu=-1):
 
     try:
         srcGDF = gpd.read_file(srcGeoJson)
@@ -183,7 +191,11 @@ def createRasterFromGeoJson(srcGeoJson,
                        srcRasterFileName=srcRasterFileName,
                        outRasterFileName=outRasterFileName,
                        burnValue=burnValue,
-                       burnValueField=burnValueField)
+                       burnValueField=burnValueField,
+                       blockStreaming=blockStreaming,
+                       blockSize=blockSize,
+                       parallelProcess=parallelProcess,
+                       max_cpu=max_cpu)
 
     return srcGDF
 
@@ -193,39 +205,122 @@ def createRasterFromGDF(srcGDF,
                         srcRasterFileName,
                         outRasterFileName,
                         burnValue=255,
-                        burnValueField=''
+                        burnValueField='',
+                        blockStreaming=False,
+                        blockSize=512,
+                        parallelProcess=False,
+                        max_cpu=-1
                        ):
+    """Burn srcGDF into a single band uint8 raster on the grid of srcRasterFileName.
 
-    if list(srcGDF.geometry):
-        if burnValueField == '':
-            featureList = ((geom, int(burnValue)) for geom in srcGDF.geometry)
-        else:
-            featureList = ((geom, int(value)) for geom, value in zip(srcGDF.geometry, srcGDF[burnValueField]))
+       blockStreaming -- write a blockSize tiled, deflate compressed raster one tile at a time, each tile only
+                         rasterizes the geometries the spatial index returns for it, so full mosaic masks do not
+                         need the whole raster in memory. The burned pixels are the same as the in memory burn.
+       parallelProcess -- with blockStreaming, burn the tiles with a Pool of max_cpu workers (-1 uses every core),
+                          the parent writes them
+    """
+
+    if burnValueField == '' or len(srcGDF) == 0:
+        burnValueList = np.full(len(srcGDF), int(burnValue))
     else:
-        featureList = []
+        burnValueList = np.asarray(srcGDF[burnValueField]).astype(int)
 
     with rasterio.open(srcRasterFileName) as rst:
         meta = rst.meta.copy()
         meta.update(count=1)
         meta.update(dtype='uint8')
+        if blockStreaming:
+            meta.update(driver='GTiff', tiled=True, blockxsize=blockSize, blockysize=blockSize, compress='deflate')
 
         with rasterio.open(
                 outRasterFileName, 'w',
                 **meta) as dst:
 
-            if featureList:
-                print(featureList)
-                burned = features.rasterize(shapes=featureList,
+            if blockStreaming:
+                burnRasterBlocks(srcGDF.geometry, burnValueList, dst,
+                                 parallelProcess=parallelProcess, max_cpu=max_cpu)
+            elif len(srcGDF) > 0:
+                burned = features.rasterize(shapes=zip(srcGDF.geometry, burnValueList.tolist()),
                                             out_shape=rst.shape,
                                             transform=rst.transform
                                            )
+                dst.write(burned, indexes=1)
             else:
-                burned = np.empty(rst.shape, dtype='uint8')
-
-            dst.write(burned, indexes=1)
+                dst.write(np.zeros(rst.shape, dtype='uint8'), indexes=1)
 
     return srcGDF
 
+
+def burnBlock(geoSeries, burnValueList, window, transform):
+    # rasterize the geometries of geoSeries that intersect window of a raster with transform,
+    # in srcGDF order so overlapping geometries burn as in a full raster rasterize
+    blockBox = box(*rasterio.windows.bounds(window, transform))
+    featureIdx = np.sort(geoSeries.sindex.query(blockBox, predicate='intersects'))
+    if len(featureIdx) == 0:
+        return np.zeros((window.height, window.width), dtype='uint8')
+
+    return features.rasterize(shapes=zip(geoSeries.values[featureIdx], burnValueList[featureIdx].tolist()),
+                              out_shape=(window.height, window.width),
+                              transform=rasterio.windows.transform(window, transform),
+                              dtype='uint8')
+
+
+_burnWorkerGeoSeries = None
+_burnWorkerValueList = None
+_burnWorkerTransform = None
+
+
+def _initBurnWorker(geoSeries, burnValueList, transform):
+    # Pool initializer of burnRasterBlocks, each worker builds its own spatial index once
+    global _burnWorkerGeoSeries, _burnWorkerValueList, _burnWorkerTransform
+    _burnWorkerGeoSeries = geoSeries
+    _burnWorkerValueList = burnValueList
+    _burnWorkerTransform = transform
+    _burnWorkerGeoSeries.sindex
+
+
+def _burnBlockWorker(window):
+
+    return burnBlock(_burnWorkerGeoSeries, _burnWorkerValueList, window, _burnWorkerTransform)
+
+
+def burnRasterBlocks(geoSeries, burnValueList, dst, parallelProcess=False, max_cpu=-1, maxPendingBlocks=0):
+    # burn geoSeries into band 1 of the open dataset dst one internal block at a time
+    # maxPendingBlocks -- with parallelProcess, at most this many blocks are burned ahead of the writer so memory
+    #                     stays bounded when the workers are faster than the compressed write (0 is 4 per worker)
+    windowList = [window for blockIdx, window in dst.block_windows(1)]
+    if len(geoSeries) == 0:
+        for window in windowList:
+            dst.write(np.zeros((window.height, window.width), dtype='uint8'), indexes=1, window=window)
+        return dst
+
+    if not parallelProcess:
+        for window in windowList:
+            dst.write(burnBlock(geoSeries, burnValueList, window, dst.transform), indexes=1, window=window)
+        return dst
+
+    if max_cpu == -1:
+        max_cpu = multiprocessing.cpu_count()
+    if maxPendingBlocks <= 0:
+        maxPendingBlocks = max_cpu * 4
+
+    # the parent writes the blocks in order, the pool is terminated on leaving the with block, also if a write fails
+    with multiprocessing.Pool(processes=max_cpu, initializer=_initBurnWorker,
+                              initargs=(geoSeries, burnValueList, dst.transform)) as p:
+        pendingList = collections.deque()
+        for window in windowList:
+            pendingList.append((window, p.apply_async(_burnBlockWorker, (window,))))
+            if len(pendingList) >= maxPendingBlocks:
+                pendingWindow, pendingResult = pendingList.popleft()
+                dst.write(pendingResult.get(), indexes=1, window=pendingWindow)
+
+        while pendingList:
+            pendingWindow, pendingResult = pendingList.popleft()
+            dst.write(pendingResult.get(), indexes=1, window=pendingWindow)
+
+    return dst
+
+
 def createCSVSummaryFile(chipSummaryList, outputFileName, rasterChipDirectory='', replaceImageID='',
                          createProposalsFile=False, competitionType='buildings',
                          pixPrecision=2):
@@ -433,7 +528,9 @@ def createAOIName(AOI_Name, AOI_Num,
                   verbose=False,
                   dumpChipListToJSON=True,
                   createSummaryCSVChallenge=False,
-                  objectSrcFile=''):
+                  objectSrcFile='',
+                  resume=False,
+                  outputProfile='plain'):
 
 
     srcImageryList = []
@@ -488,7 +585,9 @@ def createAOIName(AOI_Name, AOI_Num,
                                            minpartialPerc=minpartialPerc, createPix=createPix,
                                            baseName='AOI_{}_{}'.format(AOI_Num, AOI_Name),
                                            imgIdStart=1,
-                                           verbose=verbose)
+                                           verbose=verbose,
+                                           resume=resume,
+                                           outputProfile=outputProfile)
 
 
     else:
@@ -498,7 +597,9 @@ def createAOIName(AOI_Name, AOI_Num,
                                                clipSizeMeters=windowSizeMeters,
                                                minpartialPerc=minpartialPerc, createPix=createPix,
                                                baseName='AOI_{}_{}'.format(AOI_Num, AOI_Name),
-                                               verbose=verbose)
+                                               verbose=verbose,
+                                               resume=resume,
+                                               outputProfile=outputProfile)
 
 
     return chipSummaryList
@@ -693,9 +794,82 @@ def convertPixDimensionToPercent(size, box):
 
 
 
-def createDistanceTransform(rasterSrc, vectorSrc, npDistFileName='', units='pixels'):
+distanceTransformEngines = ['scipy', 'opencv', 'banded']
+
+
+def signedDistanceTransform(featureMask, engine='scipy', maxDistance=0):
+    """Return the float32 signed pixel distance of featureMask, positive inside features, negative outside.
+
+       Inside a feature the value is the distance to the closest background pixel, outside it is minus the
+       distance to the closest feature pixel, as scipy.ndimage.distance_transform_edt computes them.
 
-    #TODO evaluate scipy.ndimage.morphology.distance_transform_edt vs cv2.distanceTransform for speed
+       engine -- 'scipy' exact EDT with scipy.ndimage
+                 'opencv' exact EDT with cv2.distanceTransform (DIST_MASK_PRECISE), needs opencv-python
+                 'banded' exact distances within maxDistance pixels of a feature edge only, found with a
+                 cKDTree of the edge pixels, fast when features are sparse
+       maxDistance -- clip the distances to [-maxDistance, maxDistance], required by 'banded', 0 does not clip
+
+       If the mask has no background (or no features) the missing distance is the chip diagonal.
+    """
+
+    featureMask = np.asarray(featureMask, dtype=bool)
+    if engine not in distanceTransformEngines:
+        raise ValueError('engine must be one of {}, not {}'.format(distanceTransformEngines, engine))
+    if engine == 'banded' and maxDistance <= 0:
+        raise ValueError("engine 'banded' needs maxDistance > 0")
+
+    noFeatureDist = np.float32(np.hypot(*featureMask.shape))
+    if not featureMask.any():
+        proxTotal = np.full(featureMask.shape, -noFeatureDist, dtype=np.float32)
+    elif featureMask.all():
+        proxTotal = np.full(featureMask.shape, noFeatureDist, dtype=np.float32)
+    elif engine == 'scipy':
+        #calculate distance from Any point inside a feature to the closest background pixel and
+        # from any point exterior a feature to the closet feature pixel
+        proxTotal = ndimage.distance_transform_edt(featureMask).astype(np.float32)
+        proxTotal -= ndimage.distance_transform_edt(~featureMask).astype(np.float32)
+    elif engine == 'opencv':
+        import cv2
+        featureImage = featureMask.astype(np.uint8)
+        proxTotal = cv2.distanceTransform(featureImage, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        proxTotal -= cv2.distanceTransform(1 - featureImage, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    else:
+        proxTotal = bandedDistanceTransform(featureMask, maxDistance)
+
+    if maxDistance > 0:
+        np.clip(proxTotal, -maxDistance, maxDistance, out=proxTotal)
+
+    return proxTotal
+
+
+def bandedDistanceTransform(featureMask, maxDistance):
+    # signed distance of the 'banded' engine of signedDistanceTransform.  The closest background pixel of a
+    # feature pixel always touches a feature pixel (and the other way around), so only edge pixels are indexed
+    # and only pixels within maxDistance (chessboard) of an edge are queried, all others are +-maxDistance
+    # square maximum filters are separable, two 1d passes are much faster than binary_dilation
+    def squareMaximum(image, size):
+        return ndimage.maximum_filter1d(ndimage.maximum_filter1d(image, size, axis=0), size, axis=1)
+
+    featureImage = featureMask.view(np.uint8)
+    backgroundEdge = (squareMaximum(featureImage, 3) > 0) & ~featureMask
+    featureEdge = (squareMaximum(1 - featureImage, 3) > 0) & featureMask
+
+    band = squareMaximum((backgroundEdge | featureEdge).view(np.uint8), 2*int(np.ceil(maxDistance))+1) > 0
+
+    proxTotal = np.where(featureMask, np.float32(maxDistance), np.float32(-maxDistance))
+    for edge, inside, sign in [(backgroundEdge, True, 1), (featureEdge, False, -1)]:
+        queryIdx = np.argwhere(band & (featureMask == inside))
+        dist, nearest = cKDTree(np.argwhere(edge)).query(queryIdx, distance_upper_bound=maxDistance, workers=-1)
+        proxTotal[queryIdx[:, 0], queryIdx[:, 1]] = sign*np.minimum(dist, maxDistance)
+
+    return proxTotal
+
+
+def createDistanceTransform(rasterSrc, vectorSrc, npDistFileName='', units='pixels', engine='scipy',
+                            maxDistance=0):
+
+    # engine, maxDistance -- see signedDistanceTransform, maxDistance is in pixels
+    # returns the float32 signed distance, positive inside features, in pixels or meters
 
     # image = features.rasterize(
     #         ((g, 255) for g, v in shapes),
@@ -712,104 +886,316 @@ def createDistanceTransform(rasterSrc, vectorSrc, npDistFileName='', units='pixe
             geoTrans, poly, ulX, ulY, lrX, lrY = gT.getRasterExtent(srcRas_ds)
             transform_WGS84_To_UTM, transform_UTM_To_WGS84, utm_cs = gT.createUTMTransform(poly)
             line = LineString([(geoTrans.c, geoTrans.f),
-                               (geoTrans.c + geoTrans.a, geoTrans.f + geoTrans.e)
+                               (geoTrans.c + geoTrans.a, geoTrans.f)
                                ]
                               )
 
-            line = shapely.ops.tranform(transform_WGS84_To_UTM, line)
-            metersIndex = line.lenth
+            line = shapely.ops.transform(transform_WGS84_To_UTM, line)
+            metersIndex = line.length
         else:
             metersIndex = 1
 
     ## Burn source layer into image
     source_layer = gpd.read_file(vectorSrc)
-    shapes = ((geom,value) for geom, value in zip(source_layer.geometry, 255))
-    baseImage = features.rasterize(shapes,
-                               out_shape=src_shape,
-                               transform=src_transform)
+    shapes = [(geom, 255) for geom in source_layer.geometry if geom is not None and not geom.is_empty]
+    if shapes:
+        baseImage = features.rasterize(shapes,
+                                       out_shape=src_shape,
+                                       transform=src_transform)
+    else:
+        baseImage = np.zeros(src_shape, dtype=np.uint8)
 
     ## calculate Distance between Feature point and closest background pixel
     # distance_transform_edt takes the place of ComputeProximity
+    proxTotal = signedDistanceTransform(baseImage > 0, engine=engine, maxDistance=maxDistance)
+    if metersIndex != 1:
+        proxTotal *= np.float32(metersIndex)
 
-    #calculate distance from Any point inside a feature to the closest background pixel
-    interiorDist = morphology.distance_transform_edt(baseImage)
+    if npDistFileName != '':
+        np.save(npDistFileName, proxTotal)
 
-    #inverse Image so that background is a feature and interior feature values = 0
-    inverseImage = baseImage
-    inverseImage[inverseImage==0]=200
-    inverseImage[inverseImage==255]=0
+    return proxTotal
 
-    # calculate distance from any point exterior a feature to the closet feature pixel
-    exteriorDist = morphology.distance_transform_edt(inverseImage)
 
 
-    proxTotal = interiorDist - exteriorDist
-    proxTotal = proxTotal*metersIndex
 
-    if npDistFileName != '':
-        np.save(npDistFileName, proxTotal)
 
-    return proxTotal
+def rasterBlockWindows(src, blockRows=1024):
+    # full width row strips of src with about blockRows rows, aligned to the source blocks
+    rowStep = max(1, blockRows // src.block_shapes[0][0]) * src.block_shapes[0][0]
+    for rowOff in range(0, src.height, rowStep):
+        yield Window(0, rowOff, src.width, min(rowStep, src.height - rowOff))
 
 
+def histogramValueOffset(dtype):
+    # value of histogram bin 0 for an integer dtype histogram, None if dtype is not an 8 or 16 bit integer
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'ui' or dtype.itemsize > 2:
+        return None
 
+    return int(np.iinfo(dtype).min)
 
 
-def convertGTiffTo8Bit(rasterImageName, outputImageName, outputFormat='GTiff',
-                       minPercent=0,
-                       maxPercent=98,
-                       maxValue=255,
-                       verbose=False,
-                       bandsToInclude=[]
-                       ):
+def rasterBandHistograms(src, bandsToInclude=[], blockRows=1024, sampleFraction=1.0, seed=0):
+    """Return the per band value histograms of an 8 or 16 bit integer raster, read block by block.
 
-    # Other Format would be JPG
-    if outputFormat.upper() == 'JPG':
-        if not bandsToInclude:
-            bandsToInclude = [0,1,2]
+       histograms[band, value - histogramValueOffset(dtype)] counts value in each band of bandsToInclude
+       (0 based, all bands if empty).  Memory use does not depend on the raster size.
+       sampleFraction < 1 only reads that fraction of the row strips, picked at random with seed.
+    """
+
+    valueOffset = histogramValueOffset(src.dtypes[0])
+    levels = 1 << (8*np.dtype(src.dtypes[0]).itemsize)
+    bandIndexes = [band+1 for band in bandsToInclude] if bandsToInclude else list(range(1, src.count+1))
+
+    windowList = list(rasterBlockWindows(src, blockRows=blockRows))
+    if sampleFraction < 1.0:
+        sampleCount = max(1, int(round(len(windowList)*sampleFraction)))
+        sampleIdx = np.sort(np.random.default_rng(seed).choice(len(windowList), sampleCount, replace=False))
+        windowList = [windowList[idx] for idx in sampleIdx]
 
+    histograms = np.zeros((len(bandIndexes), levels), dtype=np.int64)
+    for window in windowList:
+        data = src.read(bandIndexes, window=window)
+        for bandIdx, bandData in enumerate(data):
+            if valueOffset != 0:
+                bandData = bandData.astype(np.int32) - valueOffset
+            histograms[bandIdx] += np.bincount(bandData.ravel(), minlength=levels)
 
+    return histograms
 
 
+def histogramPercentile(histogram, percent, valueOffset=0):
+    """Return np.percentile(values, percent) of the values counted by histogram, without the values.
 
+       The same linear interpolation between order statistics as np.percentile is used, so the result is
+       identical.  histogram is indexed by value - valueOffset.
+    """
+
+    cumulative = np.cumsum(histogram)
+    valueCount = cumulative[-1]
+    virtualIndex = (valueCount - 1) * np.true_divide(percent, 100)
+    previousIndex = np.floor(virtualIndex)
+    nextIndex = min(previousIndex + 1, valueCount - 1)
+    gamma = virtualIndex - previousIndex
+
+    # the k-th smallest value is the first bin whose cumulative count exceeds k
+    previousValue = np.float64(np.searchsorted(cumulative, previousIndex, side='right') + valueOffset)
+    nextValue = np.float64(np.searchsorted(cumulative, nextIndex, side='right') + valueOffset)
+
+    diff = nextValue - previousValue
+    if gamma >= 0.5:
+        return nextValue - diff * (1 - gamma)
+
+    return previousValue + diff * gamma
+
+
+def createStretchLUT(maxBand, maxValue, valueOffset, levels):
+    # uint8 lookup table of the convertGTiffTo8Bit stretch, values above maxBand are clipped to it and
+    # scaled by maxValue/maxBand, lut[value - valueOffset]
+    values = np.arange(levels, dtype=np.float64) + valueOffset
+    values[values >= maxBand] = maxBand
+
+    return (values*(maxValue/maxBand)).astype('uint8', casting='unsafe', copy=False)
+
+
+def _stretchHistogramWorker(histogramArgs):
+    # histograms of one raster of computeStretchStatistics
+    rasterImageName, bandsToInclude, overviewLevel, sampleFraction, blockRows, seed = histogramArgs
     with rasterio.open(rasterImageName) as src:
-        data = src.read()
-        profile = src.profile
+        dtype = src.dtypes[0]
+        useOverview = overviewLevel >= 0 and len(src.overviews(1)) > overviewLevel
+    if histogramValueOffset(dtype) is None:
+        raise ValueError('stretch statistics need 8 or 16 bit integer rasters, {} is {}'.format(rasterImageName,
+                                                                                               dtype))
+
+    if useOverview:
+        src = rasterio.open(rasterImageName, overview_level=overviewLevel)
+    else:
+        src = rasterio.open(rasterImageName)
+    with src:
+        return dtype, rasterBandHistograms(src, bandsToInclude=bandsToInclude, blockRows=blockRows,
+                                           sampleFraction=sampleFraction, seed=seed)
+
+
+def computeStretchStatistics(rasterFileList, bandsToInclude=[], overviewLevel=-1, sampleFraction=1.0,
+                             blockRows=1024, parallelProcess=False, max_cpu=-1, seed=0, statsFileName=''):
+    """Accumulate the per band value histograms of every raster of an AOI for a dataset wide 8 bit stretch.
+
+       rasterFileList -- 8 or 16 bit rasters with the same data type and bands, i.e. the AOI mosaic or its tiles
+       bandsToInclude -- 0 based bands to count, all if empty
+       overviewLevel -- read this overview level (0 is the first) of rasters that have it, -1 reads full resolution
+       sampleFraction -- fraction of each raster's row strips to read, see rasterBandHistograms
+       parallelProcess -- histogram the rasters with a Pool of max_cpu workers (-1 uses every core)
+       statsFileName -- also write the statistics to this .npz sidecar, see writeStretchStatistics
+
+       returns dict with histograms (bands, levels), valueOffset, bandIndexes (1 based), dtype and rasterCount,
+       used as stretchStatistics by convertGTiffTo8Bit and inferenceTools.returnImgArrayFromArray
+    """
+
+    histogramArgsList = [(rasterImageName, bandsToInclude, overviewLevel, sampleFraction, blockRows, seed+rasterIdx)
+                         for rasterIdx, rasterImageName in enumerate(rasterFileList)]
+
+    if parallelProcess:
+        if max_cpu == -1:
+            max_cpu = multiprocessing.cpu_count()
+        p = multiprocessing.Pool(processes=max_cpu)
+        histogramResultList = p.map(_stretchHistogramWorker, histogramArgsList)
+        p.close()
+        p.join()
+    else:
+        histogramResultList = [_stretchHistogramWorker(histogramArgs) for histogramArgs in histogramArgsList]
 
-    # Which bands to include in conversion
-    if bandsToInclude:
-        data = data[bandsToInclude]
+    dtypeSet = set(dtype for dtype, histograms in histogramResultList)
+    shapeSet = set(histograms.shape for dtype, histograms in histogramResultList)
+    if len(dtypeSet) != 1 or len(shapeSet) != 1:
+        raise ValueError('rasters have different data types {} or bands {}'.format(dtypeSet, shapeSet))
 
-    minBand = np.percentile(data, minPercent)
-    maxBand = np.percentile(data, maxPercent)
+    dtype = dtypeSet.pop()
+    bandCount = shapeSet.pop()[0]
+    stretchStatistics = {'histograms': np.sum([histograms for dtype, histograms in histogramResultList], axis=0),
+                         'valueOffset': histogramValueOffset(dtype),
+                         'bandIndexes': np.asarray([band+1 for band in bandsToInclude] if bandsToInclude
+                                                   else list(range(1, bandCount+1))),
+                         'dtype': dtype,
+                         'rasterCount': len(rasterFileList)}
+
+    if statsFileName != '':
+        writeStretchStatistics(statsFileName, stretchStatistics)
+
+    return stretchStatistics
+
+
+def stretchStatisticsFileName(statsFileName):
+    # name of the sidecar np.savez_compressed writes for statsFileName, it appends .npz if missing
+    if not statsFileName.endswith('.npz'):
+        statsFileName = statsFileName + '.npz'
+
+    return statsFileName
 
-    scale_ratio = maxValue/maxBand
-    if verbose:
-        print('scale_ratio = {}'.format(scale_ratio))
-        print('offset = {}'.format(minBand))
-        print('rasterImageName={}'.format(rasterImageName))
-    # Clip lower percent of values to Zero
 
-    data=data.astype('float64', casting='unsafe', copy=False)
-    data[data>=maxBand] = maxBand
-    data=data*scale_ratio
+def writeStretchStatistics(statsFileName, stretchStatistics):
+    # write computeStretchStatistics to a compressed .npz sidecar, returns its file name
+    statsFileName = stretchStatisticsFileName(statsFileName)
+    np.savez_compressed(statsFileName, **stretchStatistics)
 
+    return statsFileName
 
-    data=data.astype('uint8', casting='unsafe', copy=False)
 
+def readStretchStatistics(statsFileName):
+    # read a sidecar of writeStretchStatistics, a statistics dict is passed through
+    if isinstance(statsFileName, dict):
+        return statsFileName
 
+    with np.load(stretchStatisticsFileName(statsFileName)) as statsFile:
+        return {'histograms': statsFile['histograms'],
+                'valueOffset': int(statsFile['valueOffset']),
+                'bandIndexes': statsFile['bandIndexes'],
+                'dtype': str(statsFile['dtype']),
+                'rasterCount': int(statsFile['rasterCount'])}
 
-    profile['driver']=outputFormat
-    profile['dtype']='uint8'
-    del profile['tiled']
-    del profile['interleave']
-    #profile.update(dtype='uint8',
-    #               driver=outputFormat,
-    #               photometric)
 
+def stretchStatisticsHistograms(stretchStatistics, bandIndexes, dtype):
+    # rows of the cached histograms for the 1 based bandIndexes of a raster of dtype
+    if histogramValueOffset(dtype) != stretchStatistics['valueOffset'] or \
+            np.dtype(dtype) != np.dtype(stretchStatistics['dtype']):
+        raise ValueError('stretch statistics of {} data can not stretch {} data'.format(stretchStatistics['dtype'],
+                                                                                       dtype))
+    statsBandIndexes = list(stretchStatistics['bandIndexes'])
+    missingBands = [band for band in bandIndexes if band not in statsBandIndexes]
+    if missingBands:
+        raise ValueError('stretch statistics have no histograms of bands {}'.format(missingBands))
+
+    return stretchStatistics['histograms'][[statsBandIndexes.index(band) for band in bandIndexes]]
+
+
+def convertGTiffTo8Bit(rasterImageName, outputImageName, outputFormat='GTiff',
+                       minPercent=0,
+                       maxPercent=98,
+                       maxValue=255,
+                       verbose=False,
+                       bandsToInclude=[],
+                       outputProfile='',
+                       perBand=False,
+                       blockRows=1024,
+                       stretchStatistics=None
+                       ):
 
-    with rasterio.open(outputImageName, 'w', **profile) as dst:
-        dst.write(data)
+    # outputProfile -- '' keeps the source tiling and compression, otherwise a geoTools.rasterOutputProfiles name
+    #                  ('plain', 'deflate', 'zstd', 'lzw', 'jpeg' or 'cog') used for GTiff output
+    # perBand -- take the percentiles of each band instead of all bands together
+    # blockRows -- 8 and 16 bit rasters are stretched in strips of about blockRows rows: one pass builds
+    #              integer histograms for the percentiles, a second applies a lookup table, so memory does not
+    #              grow with the raster.  Other types are read whole and use np.percentile
+    # stretchStatistics -- computeStretchStatistics dict or sidecar file, the percentiles are taken from the
+    #                      dataset wide histograms so every chip gets the same stretch and only the lookup
+    #                      table pass is made
+    # Other Format would be JPG
+    if outputFormat.upper() == 'JPG':
+        if not bandsToInclude:
+            bandsToInclude = [0,1,2]
 
+    with rasterio.open(rasterImageName) as src:
+        profile = src.profile
+        valueOffset = histogramValueOffset(src.dtypes[0])
+        bandIndexes = [band+1 for band in bandsToInclude] if bandsToInclude else list(range(1, src.count+1))
+
+        if stretchStatistics is not None:
+            histograms = stretchStatisticsHistograms(readStretchStatistics(stretchStatistics), bandIndexes,
+                                                     src.dtypes[0])
+        elif valueOffset is not None:
+            histograms = rasterBandHistograms(src, bandsToInclude=bandsToInclude, blockRows=blockRows)
+
+        if valueOffset is not None:
+            if not perBand:
+                histograms = histograms.sum(axis=0, keepdims=True)
+            minBand = np.asarray([histogramPercentile(histogram, minPercent, valueOffset=valueOffset)
+                                  for histogram in histograms])
+            maxBand = np.asarray([histogramPercentile(histogram, maxPercent, valueOffset=valueOffset)
+                                  for histogram in histograms])
+        else:
+            data = src.read(bandIndexes)
+            if perBand:
+                minBand = np.percentile(data, minPercent, axis=(1, 2))
+                maxBand = np.percentile(data, maxPercent, axis=(1, 2))
+            else:
+                minBand = np.percentile(data, minPercent, keepdims=True).ravel()
+                maxBand = np.percentile(data, maxPercent, keepdims=True).ravel()
+
+        scale_ratio = maxValue/maxBand
+        if verbose:
+            print('scale_ratio = {}'.format(scale_ratio))
+            print('offset = {}'.format(minBand))
+            print('rasterImageName={}'.format(rasterImageName))
+
+        profile['driver']=outputFormat
+        profile['dtype']='uint8'
+        profile['count']=len(bandIndexes)
+        del profile['tiled']
+        del profile['interleave']
+        if outputProfile and outputFormat == 'GTiff':
+            for key in ['blockxsize', 'blockysize', 'compress', 'photometric', 'predictor']:
+                profile.pop(key, None)
+            profile.update(gT.rasterOutputProfile(outputProfile, len(bandIndexes), 'uint8'))
+        #profile.update(dtype='uint8',
+        #               driver=outputFormat,
+        #               photometric)
+
+        with rasterio.open(outputImageName, 'w', **profile) as dst:
+            if valueOffset is not None:
+                levels = histograms.shape[1]
+                lutList = [createStretchLUT(bandMax, maxValue, valueOffset, levels) for bandMax in maxBand]
+                for window in rasterBlockWindows(src, blockRows=blockRows):
+                    data = src.read(bandIndexes, window=window)
+                    if valueOffset != 0:
+                        data = data.astype(np.int32) - valueOffset
+                    dst.write(np.stack([lutList[bandIdx % len(lutList)][bandData]
+                                        for bandIdx, bandData in enumerate(data)]), window=window)
+            else:
+                # Clip lower percent of values to Zero
+                data = data.astype('float64', casting='unsafe', copy=False)
+                maxBand = maxBand[:, None, None]
+                data = np.where(data >= maxBand, maxBand, data)*scale_ratio[:, None, None]
+                dst.write(data.astype('uint8', casting='unsafe', copy=False))
 
     return outputImageName
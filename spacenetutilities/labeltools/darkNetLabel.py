@@ -92,7 +92,10 @@ def geoJsonToDARKNET(xmlFileName, geoJson, rasterImageName, im_id='',
                      bboxResize=1.0,
                      objectType='building',
                      objectTypeField='',
-                     outputRasterName=''):
+                     outputRasterName='',
+                     stretchStatistics=None):
+
+    # stretchStatistics -- dataset wide 8 bit stretch, see clT.computeStretchStatistics
 
 
 
@@ -117,7 +120,8 @@ def geoJsonToDARKNET(xmlFileName, geoJson, rasterImageName, im_id='',
             else:
                 outputImageName = xmlFileName.replace('.xml', '_8bit.tif')
 
-            clT.convertGTiffTo8Bit(rasterImageName, outputImageName, outputFormat=outputFormat)
+            clT.convertGTiffTo8Bit(rasterImageName, outputImageName, outputFormat=outputFormat,
+                                   stretchStatistics=stretchStatistics)
     else:
         outputImageName = rasterImageName
 
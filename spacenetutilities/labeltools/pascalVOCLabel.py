@@ -1,4 +1,5 @@
 import os
+import numpy as np
 from PIL import Image
 from xml.etree.ElementTree import Element, SubElement
 from xml.etree import ElementTree
@@ -105,59 +106,92 @@ def geoJsonToPASCALVOC2012Label(xmlFileName, geoJson, rasterImageName, im_id='',
     return xmlFileName
 
 
-def geoJsonToPASCALVOC2012SegmentCls(geoJson, src_meta, bufferSizePix=2.5,
-                                  innerShapeValue=100,
-                                  borderValue=255
-                                  ):
+def readChipVectors(geoJson):
+    # GeoDataFrame of a chip geojson (passed through if already read), empty if the chip has no vectors
+    if isinstance(geoJson, gpd.GeoDataFrame):
+        return geoJson
+    try:
+        return gpd.read_file(geoJson)
+    except:
+        return gpd.GeoDataFrame(geometry=[])
+
+
+def geoJsonToPASCALVOC2012SegmentImages(geoJson, src_meta, bufferSizePix=2.5,
+                                        innerShapeValue=100,
+                                        borderValue=255
+                                        ):
+    """Render the class, instance and boundary masks of a chip in one pass.
+
+       geoJson is a geojson file or an already read GeoDataFrame.  Each shape is buffered out and in by
+       bufferSizePix pixels once.  The outer shapes are burned into one mask and the inner shapes, numbered
+       from 1, into one instance image, so only two rasterize calls are made however many products are used.
+
+       returns (clsImage, objImage, boundaryImage) of shape (height, width):
+       clsImage -- innerShapeValue inside the inner shapes, borderValue in the band around each outline, 0 else
+       objImage -- instance number inside the inner shapes, borderValue in the band, 0 else.  uint8 unless there
+                   are borderValue or more shapes, then uint16 with the band set to 65535
+       boundaryImage -- borderValue in the band, 0 else
+    """
 
     #TODO Implement multi object class segmentation
 
     bufferDist = bufferSizePix*src_meta['transform'].a
+    out_shape = (src_meta['height'], src_meta['width'])
 
-    source_layer = gpd.read_file(geoJson)
-    outerShapes = ((geom,value) for geom, value in zip(source_layer.geometry.buffer(bufferDist), borderValue))
-    innerShapes = ((geom, value) for geom, value in zip(source_layer.geometry.buffer(-bufferDist), innerShapeValue))
+    source_layer = readChipVectors(geoJson)
+    geoms = source_layer.geometry
+    geoms = geoms[~(geoms.isna() | geoms.is_empty)]
 
-    outerShapesImage = features.rasterize(outerShapes,
-                               out_shape=(src_meta['width'], src_meta['height']),
-                               transform=src_meta['transform'])
+    outerMask = np.zeros(out_shape, dtype=np.uint8)
+    instanceImage = np.zeros(out_shape, dtype=np.uint16 if len(geoms) >= borderValue else np.uint8)
+    if len(geoms) > 0:
+        outerShapes = geoms.buffer(bufferDist)
+        innerShapes = geoms.buffer(-bufferDist)
 
-    innerShapesImage = features.rasterize(outerShapes,
-                                   out_shape=(src_meta['width'], src_meta['height']),
-                                   transform=src_meta['transform'])
+        outerMask = features.rasterize(((geom, 1) for geom in outerShapes if not geom.is_empty),
+                                       out=outerMask,
+                                       transform=src_meta['transform'])
+        instanceImage = features.rasterize(((geom, value+1) for value, geom in enumerate(innerShapes)
+                                            if not geom.is_empty),
+                                           out=instanceImage,
+                                           transform=src_meta['transform'])
 
-    totalImage = outerShapesImage + innerShapesImage
-    # set interior value to be innerValue
-    totalImage[totalImage==innerShapeValue+borderValue]=innerShapeValue
+    inner = instanceImage > 0
+    border = (outerMask > 0) & ~inner
 
-    return totalImage
+    clsImage = np.zeros(out_shape, dtype=np.uint8)
+    clsImage[border] = borderValue
+    clsImage[inner] = innerShapeValue
 
+    boundaryImage = np.zeros(out_shape, dtype=np.uint8)
+    boundaryImage[border] = borderValue
 
-def geoJsonToPASCALVOC2012SegmentObj(geoJson, src_meta, bufferSizePix=2.5,
+    objImage = instanceImage
+    objImage[border] = borderValue if objImage.dtype == np.uint8 else np.iinfo(objImage.dtype).max
+
+    return clsImage, objImage, boundaryImage
+
+
+def geoJsonToPASCALVOC2012SegmentCls(geoJson, src_meta, bufferSizePix=2.5,
                                   innerShapeValue=100,
                                   borderValue=255
                                   ):
-    # TODO Implement multi object class segmentation
 
-    bufferDist = bufferSizePix * src_meta['transform'].a
+    # class mask of geoJsonToPASCALVOC2012SegmentImages
+    return geoJsonToPASCALVOC2012SegmentImages(geoJson, src_meta, bufferSizePix=bufferSizePix,
+                                               innerShapeValue=innerShapeValue,
+                                               borderValue=borderValue)[0]
 
-    source_layer = gpd.read_file(geoJson)
-    outerShapes = ((geom, value) for geom, value in zip(source_layer.geometry.buffer(bufferDist), borderValue))
-    innerShapes = ((geom, value) for value, geom in enumerate(source_layer.geometry.buffer(-bufferDist)))
 
-    outerShapesImage = features.rasterize(outerShapes,
-                                          out_shape=(src_meta['width'], src_meta['height']),
-                                          transform=src_meta['transform'])
-
-    innerShapesImage = features.rasterize(outerShapes,
-                                          out_shape=(src_meta['width'], src_meta['height']),
-                                          transform=src_meta['transform'])
-
-    totalImage = outerShapesImage + innerShapesImage
-    # set interior value to be innerValue
-    totalImage[totalImage > 255] = totalImage[totalImage>255]-borderValue
+def geoJsonToPASCALVOC2012SegmentObj(geoJson, src_meta, bufferSizePix=2.5,
+                                  innerShapeValue=100,
+                                  borderValue=255
+                                  ):
 
-    return totalImage
+    # instance mask of geoJsonToPASCALVOC2012SegmentImages
+    return geoJsonToPASCALVOC2012SegmentImages(geoJson, src_meta, bufferSizePix=bufferSizePix,
+                                               innerShapeValue=innerShapeValue,
+                                               borderValue=borderValue)[1]
 
 def geoJsonToPASCALVOC2012(xmlFileName, geoJson, rasterImageName, im_id='',
                            dataset ='SpaceNet',
@@ -175,55 +209,56 @@ def geoJsonToPASCALVOC2012(xmlFileName, geoJson, rasterImageName, im_id='',
                            objPNGName='',
                            outputRasterName='',
                            truncatePercent=0,
-                           truncatedPercentField='partialDec'
+                           truncatedPercentField='partialDec',
+                           segmentBoundary=False,
+                           bndPNGName='',
+                           stretchStatistics=None
                            ):
 
-
-
-    geoJsonToPASCALVOC2012Label(xmlFileName, geoJson, rasterImageName, im_id='',
-                                dataset=dataset,
-                                folder_name=folder_name,
-                                annotationStyle=annotationStyle,
-                                segment=segment,
-                                bufferSizePix=bufferSizePix,
-                                convertTo8Bit=convertTo8Bit,
-                                outputPixType=outputPixType,
-                                outputFormat=outputFormat,
-                                bboxResize=bboxResize,
-                                objectType=objectType,
-                                objectTypeField=objectTypeField,
-                                truncatePercent=truncatePercent,
-                                truncatedPercentField=truncatedPercentField
-                                )
+    # the chip vectors and raster metadata are read once and shared by the annotation and every mask
+    # segmentBoundary -- also write the boundary mask to bndPNGName (default xmlFileName with segbnd.tif)
+    # stretchStatistics -- dataset wide 8 bit stretch, see clT.computeStretchStatistics
 
     with rasterio.open(rasterImageName) as src:
         src_meta = src.meta.copy()
-        src_profile = src.profile.copy()
 
+    source_layer = readChipVectors(geoJson)
+
+    imageDescriptionDict, objectDictList = clT.geoDFtoDict(source_layer, rasterImageName, src_meta,
+                                                           datasetName=dataset,
+                                                           annotationStyle=annotationStyle,
+                                                           bboxResize=bboxResize,
+                                                           objectType=objectType,
+                                                           objectTypeField=objectTypeField,
+                                                           objectPose='Left',
+                                                           objectTruncatedField='',
+                                                           objectDifficultyField='',
+                                                           truncatePercent=truncatePercent,
+                                                           truncatedPercentField=truncatedPercentField
+                                                           )
 
+    writeToPascalVOCLabel(xmlFileName, imageDescriptionDict, objectDictList)
 
     #Write Segemeentation Images
     if segment:
         if clsPNGName=='':
             clsPNGName = xmlFileName.replace('.xml', 'segcls.tif')
-
-        clsImageArray = geoJsonToPASCALVOC2012SegmentCls(geoJson, src_meta, bufferSizePix=2.5,
-                                                         innerShapeValue=100,
-                                                         borderValue=255
-                                                         )
-
-        clsImageArray = Image.fromarray(clsImageArray)
-        clsImageArray.save(clsPNGName)
-
         if objPNGName=='':
             objPNGName = xmlFileName.replace('.xml', 'segobj.tif')
 
-        objImageArray = geoJsonToPASCALVOC2012SegmentObj(geoJson, src_meta, bufferSizePix=2.5,
-                                                         innerShapeValue=100,
-                                                         borderValue=255
-                                                         )
-        objImageArray = Image.fromarray(objImageArray)
-        objImageArray.save(objPNGName)
+        clsImageArray, objImageArray, bndImageArray = geoJsonToPASCALVOC2012SegmentImages(source_layer, src_meta,
+                                                                                          bufferSizePix=bufferSizePix,
+                                                                                          innerShapeValue=100,
+                                                                                          borderValue=255
+                                                                                          )
+
+        Image.fromarray(clsImageArray).save(clsPNGName)
+        Image.fromarray(objImageArray).save(objPNGName)
+
+        if segmentBoundary:
+            if bndPNGName=='':
+                bndPNGName = xmlFileName.replace('.xml', 'segbnd.tif')
+            Image.fromarray(bndImageArray).save(bndPNGName)
 
     if convertTo8Bit:
         if outputRasterName=='':
@@ -232,7 +267,8 @@ def geoJsonToPASCALVOC2012(xmlFileName, geoJson, rasterImageName, im_id='',
             else:
                 outputImageName = xmlFileName.replace('.xml', '_8bit.tif')
 
-            clT.convertGTiffTo8Bit(rasterImageName, outputImageName, outputFormat=outputFormat)
+            clT.convertGTiffTo8Bit(rasterImageName, outputImageName, outputFormat=outputFormat,
+                                   stretchStatistics=stretchStatistics)
     else:
         outputImageName = rasterImageName
 
@@ -0,0 +1,132 @@
+from spacenetutilities.labeltools import coreLabelTools as clT
+from spacenetutilities.scripts.benchmarkEvaluation import createSyntheticCity
+from scipy import ndimage
+from rasterio import features
+import numpy as np
+import platform
+import argparse
+import time
+import json
+
+
+def createSyntheticChipMask(chipSizePixels, buildingCount, seed=0):
+    # feature mask of a chip with buildingCount synthetic building footprints, see createSyntheticCity
+    image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly = \
+        createSyntheticCity(buildingCount, buildingsPerImage=buildingCount, imageSize=chipSizePixels, seed=seed)
+
+    return features.rasterize(((geom, 1) for geom in sol_polysPoly),
+                              out_shape=(chipSizePixels, chipSizePixels)).astype(bool)
+
+
+def runDistanceTransformBenchmark(chipSizePixels, buildingCount, engine='scipy', maxDistance=0, repeat=5, seed=0):
+    """Time signedDistanceTransform with one engine on a synthetic chip.
+
+       returns dict with the best and mean time of repeat runs and the largest difference to the float64
+       scipy EDT, clipped to maxDistance if maxDistance > 0
+    """
+
+    featureMask = createSyntheticChipMask(chipSizePixels, buildingCount, seed=seed)
+
+    reference = ndimage.distance_transform_edt(featureMask) - ndimage.distance_transform_edt(~featureMask)
+    if maxDistance > 0:
+        reference = np.clip(reference, -maxDistance, maxDistance)
+
+    timeList = []
+    for repeatIdx in range(repeat):
+        t0 = time.time()
+        proxTotal = clT.signedDistanceTransform(featureMask, engine=engine, maxDistance=maxDistance)
+        timeList.append(time.time() - t0)
+
+    return {'chipSizePixels': chipSizePixels,
+            'buildingCount': buildingCount,
+            'featureFraction': float(featureMask.mean()),
+            'engine': engine,
+            'maxDistance': maxDistance,
+            'repeat': repeat,
+            'bestTime': min(timeList),
+            'meanTime': float(np.mean(timeList)),
+            'dtype': str(proxTotal.dtype),
+            'maxAbsError': float(np.abs(proxTotal - reference).max())}
+
+
+def runBenchmarkSuite(chipSizeList=[650, 1300, 2600], buildingCountList=[50, 200],
+                      engineList=['scipy', 'opencv', 'banded'], maxDistanceList=[0, 10], repeat=5, seed=0, label=''):
+
+    results = {'label': label,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'runs': []}
+
+    for chipSizePixels in chipSizeList:
+        for buildingCount in buildingCountList:
+            for maxDistance in maxDistanceList:
+                for engine in engineList:
+                    if engine == 'banded' and maxDistance <= 0:
+                        continue
+                    try:
+                        result = runDistanceTransformBenchmark(chipSizePixels, buildingCount, engine=engine,
+                                                               maxDistance=maxDistance, repeat=repeat, seed=seed)
+                    except ImportError as e:
+                        print('skip {}, {}'.format(engine, e))
+                        continue
+
+                    print('{}px, {} buildings, maxDistance {}, {}: {:.4f}s, max error {:.2e}'.format(
+                        chipSizePixels, buildingCount, maxDistance, engine, result['bestTime'],
+                        result['maxAbsError']))
+                    results['runs'].append(result)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the signed distance transform engines on synthetic chips')
+    parser.add_argument("--resultsOutputFile",
+                        help="json file the benchmark results are written to",
+                        default='benchmarkDistanceTransform.json')
+    parser.add_argument("--label",
+                        help="Name of this run, i.e. the version or machine being measured",
+                        default='')
+    parser.add_argument("--chipSizeList",
+                        help="Width and height of the synthetic chips in pixels",
+                        type=int,
+                        nargs='+',
+                        default=[650, 1300, 2600])
+    parser.add_argument("--buildingCountList",
+                        help="Number of buildings per chip",
+                        type=int,
+                        nargs='+',
+                        default=[50, 200])
+    parser.add_argument("--engineList",
+                        help="Distance transform engines",
+                        choices=clT.distanceTransformEngines,
+                        nargs='+',
+                        default=clT.distanceTransformEngines)
+    parser.add_argument("--maxDistanceList",
+                        help="Distance clip values in pixels, 0 does not clip ('banded' is skipped)",
+                        type=float,
+                        nargs='+',
+                        default=[0, 10])
+    parser.add_argument("--repeat",
+                        help="Number of timed runs of each case",
+                        type=int,
+                        default=5)
+    parser.add_argument("--seed",
+                        help="Random seed of the synthetic chips",
+                        type=int,
+                        default=0)
+
+    args = parser.parse_args()
+
+    results = runBenchmarkSuite(chipSizeList=args.chipSizeList,
+                                buildingCountList=args.buildingCountList,
+                                engineList=args.engineList,
+                                maxDistanceList=args.maxDistanceList,
+                                repeat=args.repeat,
+                                seed=args.seed,
+                                label=args.label)
+
+    with open(args.resultsOutputFile, 'w') as f:
+        json.dump(results, f, indent=2)
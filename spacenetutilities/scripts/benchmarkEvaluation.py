@@ -0,0 +1,252 @@
+from spacenetutilities import evalTools as eT
+from spacenetutilities import geoTools as gT
+import numpy as np
+import shapely
+import multiprocessing
+import platform
+import resource
+import argparse
+import time
+import json
+import sys
+
+
+def createSyntheticCity(polygonCount, buildingsPerImage=100, overlapRate=0.1, invalidRate=0.01,
+                        detectionRate=0.8, falsePositiveRate=0.1, imageSize=650, seed=0):
+    """Create synthetic building footprint truth and perturbed proposals.
+
+       Keyword arguments:
+       polygonCount -- number of truth buildings
+       buildingsPerImage -- average number of truth buildings per ImageId (default =100)
+       overlapRate -- fraction of truth buildings with an overlapping neighbour and of detected buildings
+                      with a second, shifted detection (default =0.1)
+       invalidRate -- fraction of proposals replaced by a self-intersecting (bowtie) polygon (default =0.01)
+       detectionRate -- fraction of truth buildings with a proposal (default =0.8)
+       falsePositiveRate -- number of proposals without a building, as a fraction of polygonCount (default =0.1)
+       imageSize -- width and height of each image in pixels (default =650)
+       seed -- random seed, the same arguments always give the same city (default =0)
+
+       returns (image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly)
+    """
+
+    rng = np.random.default_rng(seed)
+    imageCount = max(1, int(np.ceil(polygonCount / float(buildingsPerImage))))
+    image_ids = np.asarray(['AOI_0_Synthetic_img{}'.format(idx) for idx in range(imageCount)])
+
+    # truth, axis aligned boxes of 5 to 30 pixels, some with an overlapping neighbour
+    sol_image = np.sort(rng.integers(0, imageCount, polygonCount))
+    size = rng.uniform(5, 30, polygonCount)
+    minx = rng.uniform(0, imageSize - 30, polygonCount)
+    miny = rng.uniform(0, imageSize - 30, polygonCount)
+    neighbour = np.flatnonzero(rng.random(polygonCount) < overlapRate)
+    neighbour = neighbour[neighbour > 0]
+    sol_image[neighbour] = sol_image[neighbour - 1]
+    minx[neighbour] = minx[neighbour - 1] + size[neighbour - 1] * 0.5
+    miny[neighbour] = miny[neighbour - 1]
+    sol_polysPoly = shapely.box(minx, miny, minx + size, miny + size)
+
+    # proposals, jittered and rescaled copies of the detected buildings
+    detected = np.flatnonzero(rng.random(polygonCount) < detectionRate)
+    duplicate = detected[rng.random(len(detected)) < overlapRate]
+    source = np.concatenate([detected, duplicate])
+    shift = rng.normal(0, 0.15, (len(source), 2)) * size[source, None]
+    shift[len(detected):] += 0.4 * size[duplicate, None]
+    scale = rng.uniform(0.8, 1.2, len(source)) * size[source]
+    prop_minx = minx[source] + shift[:, 0]
+    prop_miny = miny[source] + shift[:, 1]
+    prop_image = sol_image[source]
+
+    falsePositiveCount = int(polygonCount * falsePositiveRate)
+    prop_image = np.concatenate([prop_image, rng.integers(0, imageCount, falsePositiveCount)])
+    prop_minx = np.concatenate([prop_minx, rng.uniform(0, imageSize - 30, falsePositiveCount)])
+    prop_miny = np.concatenate([prop_miny, rng.uniform(0, imageSize - 30, falsePositiveCount)])
+    scale = np.concatenate([scale, rng.uniform(5, 30, falsePositiveCount)])
+
+    # corners of each proposal, bowties swap the last two corners and widen the bottom edge so the two
+    # lobes differ and the bowtie keeps a non-zero area
+    coords = np.empty((len(prop_image), 5, 2))
+    coords[:, :, 0] = prop_minx[:, None] + scale[:, None] * np.array([0, 1, 1, 0, 0])
+    coords[:, :, 1] = prop_miny[:, None] + scale[:, None] * np.array([0, 0, 1, 1, 0])
+    invalid = rng.random(len(prop_image)) < invalidRate
+    coords[invalid, 2], coords[invalid, 3] = coords[invalid, 3].copy(), coords[invalid, 2].copy()
+    coords[invalid, 1, 0] += 0.5 * scale[invalid]
+    prop_polysPoly = shapely.polygons(coords)
+    assert not shapely.is_valid(prop_polysPoly[invalid]).any()
+    assert (shapely.area(prop_polysPoly[invalid]) > 0).all()
+
+    order = rng.permutation(len(prop_image))
+
+    return (image_ids,
+            image_ids[prop_image[order]], prop_polysPoly[order],
+            image_ids[sol_image], sol_polysPoly)
+
+
+def peakRSSMB():
+    # peak resident set size of this process, ru_maxrss is in kB on linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / float(1 << 20)
+    return maxrss / float(1 << 10)
+
+
+def runEvaluationBenchmark(polygonCount, mode='greedy', buildingsPerImage=100, overlapRate=0.1,
+                           invalidRate=0.01, iouThreshold=0.5, seed=0):
+    """Generate a synthetic city and score it with one evaluation mode.
+
+       mode -- 'legacy' per proposal rtree search (evalfunction batchIoU=False),
+               'greedy' batch IoU with greedy matching, or 'optimal' batch IoU with optimal matching
+
+       returns dict with wall time, per stage timings, peak RSS and the summed counts
+    """
+
+    stageTimings = {}
+    t0 = time.time()
+    image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly = \
+        createSyntheticCity(polygonCount, buildingsPerImage=buildingsPerImage, overlapRate=overlapRate,
+                            invalidRate=invalidRate, seed=seed)
+    stageTimings['generate'] = time.time() - t0
+    rssGenerateMB = peakRSSMB()
+
+    t1 = time.time()
+    eval_function_input_list = eT.create_eval_function_input(image_ids,
+                                                             prop_polysIdList, prop_polysPoly,
+                                                             sol_polysIdsList, sol_polysPoly,
+                                                             createIndex=False)
+    stageTimings['group'] = time.time() - t1
+
+    t2 = time.time()
+    if mode == 'legacy':
+        for eval_input in eval_function_input_list:
+            eval_input[3] = gT.create_rtree_from_poly(eval_input[2])
+    stageTimings['index'] = time.time() - t2
+
+    t3 = time.time()
+    result_list = []
+    for image_id, test_polys, truth_polys, truth_index in eval_function_input_list:
+        result_list.append(eT.evalfunction(image_id, test_polys, truth_polys,
+                                           truth_index=truth_index,
+                                           threshold=iouThreshold,
+                                           batchIoU=(mode != 'legacy'),
+                                           matching=('optimal' if mode == 'optimal' else 'greedy')))
+    stageTimings['score'] = time.time() - t3
+
+    result_sum = np.sum(np.asarray([item[0] for item in result_list]), axis=0)
+
+    return {'polygonCount': polygonCount,
+            'proposalCount': len(prop_polysPoly),
+            'imageCount': len(image_ids),
+            'mode': mode,
+            'buildingsPerImage': buildingsPerImage,
+            'overlapRate': overlapRate,
+            'invalidRate': invalidRate,
+            'seed': seed,
+            'wallTime': time.time() - t0,
+            'stageTimings': stageTimings,
+            'peakRSSGenerateMB': rssGenerateMB,
+            'peakRSSMB': peakRSSMB(),
+            'TruePositiveTotal': int(result_sum[1]),
+            'FalsePositiveTotal': int(result_sum[2]),
+            'FalseNegativeTotal': int(result_sum[3])}
+
+
+def runBenchmarkSuite(polygonCountList=[1000, 10000, 100000, 1000000], modeList=['legacy', 'greedy', 'optimal'],
+                      buildingsPerImage=100, overlapRateList=[0.1], invalidRateList=[0.01], iouThreshold=0.5,
+                      legacyMaxPolygons=100000, seed=0, label=''):
+    # every run is done in a new process so its peak RSS is not inflated by earlier runs
+
+    results = {'label': label,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'shapely': shapely.__version__,
+               'platform': platform.platform(),
+               'cpuCount': multiprocessing.cpu_count(),
+               'runs': []}
+
+    ctx = multiprocessing.get_context('spawn')
+    for polygonCount in polygonCountList:
+        for overlapRate in overlapRateList:
+            for invalidRate in invalidRateList:
+                for mode in modeList:
+                    if mode == 'legacy' and polygonCount > legacyMaxPolygons:
+                        print('skip legacy, {} polygons > legacyMaxPolygons'.format(polygonCount))
+                        continue
+
+                    p = ctx.Pool(processes=1)
+                    result = p.apply(runEvaluationBenchmark, (polygonCount,),
+                                     {'mode': mode,
+                                      'buildingsPerImage': buildingsPerImage,
+                                      'overlapRate': overlapRate,
+                                      'invalidRate': invalidRate,
+                                      'iouThreshold': iouThreshold,
+                                      'seed': seed})
+                    p.close()
+                    p.join()
+
+                    print('{} polygons, overlap {}, invalid {}, {}: {:.2f}s, peak RSS {:.0f}MB'.format(
+                        polygonCount, overlapRate, invalidRate, mode, result['wallTime'], result['peakRSSMB']))
+                    results['runs'].append(result)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark evaluateScene scoring on synthetic cities')
+    parser.add_argument("--resultsOutputFile",
+                        help="json file the benchmark results are written to",
+                        default='benchmarkEvaluation.json')
+    parser.add_argument("--label",
+                        help="Name of this run, i.e. the version or commit being measured",
+                        default='')
+    parser.add_argument("--polygonCountList",
+                        help="Number of truth buildings of each synthetic city",
+                        type=int,
+                        nargs='+',
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--modeList",
+                        help="Evaluation modes, 'legacy' per proposal rtree search, 'greedy' or 'optimal' batch IoU",
+                        choices=['legacy', 'greedy', 'optimal'],
+                        nargs='+',
+                        default=['legacy', 'greedy', 'optimal'])
+    parser.add_argument("--buildingsPerImage",
+                        help="Average number of truth buildings per ImageId",
+                        type=int,
+                        default=100)
+    parser.add_argument("--overlapRateList",
+                        help="Fractions of buildings with an overlapping neighbour and a duplicate proposal",
+                        type=float,
+                        nargs='+',
+                        default=[0.1])
+    parser.add_argument("--invalidRateList",
+                        help="Fractions of self-intersecting proposals",
+                        type=float,
+                        nargs='+',
+                        default=[0.01])
+    parser.add_argument("--iouThreshold",
+                        help="The IOU threshold for a True Positive",
+                        type=float,
+                        default=0.5)
+    parser.add_argument("--legacyMaxPolygons",
+                        help="Skip the legacy mode for cities larger than this",
+                        type=int,
+                        default=100000)
+    parser.add_argument("--seed",
+                        help="Random seed of the synthetic cities",
+                        type=int,
+                        default=0)
+
+    args = parser.parse_args()
+
+    results = runBenchmarkSuite(polygonCountList=args.polygonCountList,
+                                modeList=args.modeList,
+                                buildingsPerImage=args.buildingsPerImage,
+                                overlapRateList=args.overlapRateList,
+                                invalidRateList=args.invalidRateList,
+                                iouThreshold=args.iouThreshold,
+                                legacyMaxPolygons=args.legacyMaxPolygons,
+                                seed=args.seed,
+                                label=args.label)
+
+    with open(args.resultsOutputFile, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,182 @@
+from spacenetutilities import geoTools as gT
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+import platform
+import argparse
+import shutil
+import time
+import json
+import os
+
+
+def planBenchmarkChips(rasterFileName, chipCount, chipSizePixels=650, seed=0):
+    # random chip extents, in source coordinates, that lie inside rasterFileName
+    rng = np.random.default_rng(seed)
+    src = gT.openRasterCached(rasterFileName)
+    chipWidth = min(chipSizePixels, src.width)
+    chipHeight = min(chipSizePixels, src.height)
+    colOff = rng.integers(0, src.width - chipWidth + 1, chipCount)
+    rowOff = rng.integers(0, src.height - chipHeight + 1, chipCount)
+
+    # north up sources, see clipWindowGrid
+    minX = src.transform.c + colOff * src.transform.a
+    maxX = minX + chipWidth * src.transform.a
+    maxY = src.transform.f + rowOff * src.transform.e
+    minY = maxY + chipHeight * src.transform.e
+
+    return list(zip(minX.tolist(), minY.tolist(), maxX.tolist(), maxY.tolist()))
+
+
+def runProfileBenchmark(rasterFileName, outputDirectory, outputProfile, chipExtentList,
+                        readCount=1000, readSizePixels=64, seed=0):
+    """Cut the chips of chipExtentList with one output profile and read random windows back.
+
+       returns dict with the write time, total size on disk and the random window read time
+    """
+
+    profileDirectory = os.path.join(outputDirectory, outputProfile)
+    if os.path.isdir(profileDirectory):
+        shutil.rmtree(profileDirectory)
+    os.makedirs(profileDirectory)
+
+    outputFileList = []
+    t0 = time.time()
+    for chipIdx, (minX, minY, maxX, maxY) in enumerate(chipExtentList):
+        outputFileName = os.path.join(profileDirectory, 'chip{}.tif'.format(chipIdx))
+        gT.clipRasterWindow(rasterFileName, outputFileName, minX, minY, maxX, maxY, outputProfile=outputProfile)
+        outputFileList.append(outputFileName)
+    writeTime = time.time() - t0
+
+    totalBytes = sum(os.path.getsize(outputFileName) for outputFileName in outputFileList)
+
+    # every read opens the chip, as a data loader does over network storage
+    rng = np.random.default_rng(seed)
+    chipIdxList = rng.integers(0, len(outputFileList), readCount)
+    t1 = time.time()
+    for chipIdx in chipIdxList:
+        with rasterio.open(outputFileList[chipIdx]) as src:
+            readWidth = min(readSizePixels, src.width)
+            readHeight = min(readSizePixels, src.height)
+            colOff = int(rng.integers(0, src.width - readWidth + 1))
+            rowOff = int(rng.integers(0, src.height - readHeight + 1))
+            src.read(window=Window(colOff, rowOff, readWidth, readHeight))
+    readTime = time.time() - t1
+
+    # full chip reads, the common training case
+    t2 = time.time()
+    for chipIdx in chipIdxList[:len(outputFileList)]:
+        with rasterio.open(outputFileList[chipIdx]) as src:
+            src.read()
+    fullReadTime = time.time() - t2
+
+    with rasterio.open(outputFileList[0]) as src:
+        profile = src.profile
+        overviewCount = len(src.overviews(1))
+
+    return {'outputProfile': outputProfile,
+            'chipCount': len(outputFileList),
+            'writeTime': writeTime,
+            'totalBytes': totalBytes,
+            'readCount': int(readCount),
+            'readSizePixels': readSizePixels,
+            'randomReadTime': readTime,
+            'fullReadCount': int(min(readCount, len(outputFileList))),
+            'fullReadTime': fullReadTime,
+            'compress': str(profile.get('compress', '')),
+            'tiled': bool(profile.get('tiled', False)),
+            'overviewCount': overviewCount}
+
+
+def runBenchmarkSuite(rasterFileName, outputDirectory,
+                      outputProfileList=['plain', 'deflate', 'zstd', 'lzw', 'jpeg', 'cog'],
+                      chipCount=100, chipSizePixels=650, readCount=1000, readSizePixels=64, seed=0, label='',
+                      keepChips=False):
+
+    results = {'label': label,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'rasterio': rasterio.__version__,
+               'gdal': rasterio.__gdal_version__,
+               'platform': platform.platform(),
+               'rasterFileName': rasterFileName,
+               'runs': []}
+
+    chipExtentList = planBenchmarkChips(rasterFileName, chipCount, chipSizePixels=chipSizePixels, seed=seed)
+    for outputProfile in outputProfileList:
+        result = runProfileBenchmark(rasterFileName, outputDirectory, outputProfile, chipExtentList,
+                                     readCount=readCount, readSizePixels=readSizePixels, seed=seed)
+        if not keepChips:
+            shutil.rmtree(os.path.join(outputDirectory, outputProfile))
+
+        print('{}: write {:.2f}s, {:.1f}MB, {} random reads {:.2f}s, {} full reads {:.2f}s'.format(
+            outputProfile, result['writeTime'], result['totalBytes'] / float(1 << 20),
+            result['readCount'], result['randomReadTime'], result['fullReadCount'], result['fullReadTime']))
+        results['runs'].append(result)
+
+    gT.closeRasterCache()
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark chip output profiles, write time, size and read time')
+    parser.add_argument("rasterFileName",
+                        help="Raster the benchmark chips are cut from")
+    parser.add_argument("--outputDirectory",
+                        help="Directory the benchmark chips are written to",
+                        default='benchmarkOutputProfiles')
+    parser.add_argument("--resultsOutputFile",
+                        help="json file the benchmark results are written to",
+                        default='benchmarkOutputProfiles.json')
+    parser.add_argument("--label",
+                        help="Name of this run, i.e. the storage or machine being measured",
+                        default='')
+    parser.add_argument("--outputProfileList",
+                        help="Output profiles to compare",
+                        choices=sorted(gT.rasterOutputProfiles),
+                        nargs='+',
+                        default=['plain', 'deflate', 'zstd', 'lzw', 'jpeg', 'cog'])
+    parser.add_argument("--chipCount",
+                        help="Number of chips cut with each profile",
+                        type=int,
+                        default=100)
+    parser.add_argument("--chipSizePixels",
+                        help="Width and height of the chips in source pixels",
+                        type=int,
+                        default=650)
+    parser.add_argument("--readCount",
+                        help="Number of random window reads",
+                        type=int,
+                        default=1000)
+    parser.add_argument("--readSizePixels",
+                        help="Width and height of the random window reads",
+                        type=int,
+                        default=64)
+    parser.add_argument("--seed",
+                        help="Random seed of the chip and read locations",
+                        type=int,
+                        default=0)
+    parser.add_argument("--keepChips",
+                        help="Do not delete the benchmark chips",
+                        action="store_true",
+                        default=False)
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.outputDirectory):
+        os.makedirs(args.outputDirectory)
+
+    results = runBenchmarkSuite(args.rasterFileName, args.outputDirectory,
+                                outputProfileList=args.outputProfileList,
+                                chipCount=args.chipCount,
+                                chipSizePixels=args.chipSizePixels,
+                                readCount=args.readCount,
+                                readSizePixels=args.readSizePixels,
+                                seed=args.seed,
+                                label=args.label,
+                                keepChips=args.keepChips)
+
+    with open(args.resultsOutputFile, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -7,6 +7,7 @@ import random
 from spacenetutilities import geoTools as gT
 from spacenetutilities.labeltools import darkNetLabel
 from spacenetutilities.labeltools import pascalVOCLabel
+from spacenetutilities.labeltools import coreLabelTools as clT
 
 
 def processRasterChip(rasterImage, rasterDescription, geojson, geojsonDescription, outputDirectory='',
@@ -56,7 +57,8 @@ def processChipSummaryList(chipSummaryList, outputDirectory='', annotationType='
                            outputPixType='',
                            datasetName='spacenetV2',
                            folder_name='folder_name',
-                           bboxResize=1.0
+                           bboxResize=1.0,
+                           stretchStatistics=None
                            ):
 
     if outputPixType == '':
@@ -85,7 +87,8 @@ def processChipSummaryList(chipSummaryList, outputDirectory='', annotationType='
                                                           convertTo8Bit=convertTo8Bit,
                                                           outputPixType=outputPixType,
                                                           outputFormat=outputFormat,
-                                                          bboxResize=bboxResize
+                                                          bboxResize=bboxResize,
+                                                          stretchStatistics=stretchStatistics
                                                           )
         elif annotationType=='DARKNET':
             entry = darkNetLabel.geoJsonToDARKNET(annotationName, chipSummary['geoVectorName'], chipSummary['rasterSource'],
@@ -95,7 +98,8 @@ def processChipSummaryList(chipSummaryList, outputDirectory='', annotationType='
                                                   convertTo8Bit=convertTo8Bit,
                                                   outputPixType=outputPixType,
                                                   outputFormat=outputFormat,
-                                                  bboxResize=bboxResize
+                                                  bboxResize=bboxResize,
+                                                  stretchStatistics=stretchStatistics
                                                   )
 
         # elif annotationType=='SBD':
@@ -243,6 +247,10 @@ if __name__ == '__main__':
                              'default is 1.0',
                         type=float,
                         default=1.0)
+    parser.add_argument("--stretchStatistics",
+                        help='Stretch every image to 8bit with the same dataset wide percentiles from this .npz file '
+                             '(.npz is appended if missing), it is computed from the source imagery of the AOI if it does not exist',
+                        default='')
 
     args = parser.parse_args()
 
@@ -294,6 +302,15 @@ if __name__ == '__main__':
 
         print('fullpathImageDirectory = {}'.format(fullPathImageDirectory))
         print('fullpathGeoJsonDirectory = {}'.format(fullPathGeoJsonDirectory))
+
+        stretchStatistics = None
+        if args.convertTo8Bit and args.stretchStatistics != '':
+            statsFileName = clT.stretchStatisticsFileName(args.stretchStatistics)
+            if not os.path.isfile(statsFileName):
+                print('computing stretch statistics of {} rasters'.format(len(listofRaster)))
+                clT.computeStretchStatistics(listofRaster, parallelProcess=True,
+                                             statsFileName=statsFileName)
+            stretchStatistics = clT.readStretchStatistics(statsFileName)
         if len(listofRaster) != len(listofgeojson):
             print('Error lists do not match fix source errors')
 
@@ -318,7 +335,8 @@ if __name__ == '__main__':
                                                       outputPixType=outputDataType,
                                                       datasetName='spacenetV2',
                                                       folder_name='folder_name',
-                                                      bboxResize= args.boundingBoxResize
+                                                      bboxResize= args.boundingBoxResize,
+                                                      stretchStatistics=stretchStatistics
                                        )
                 print(entryListTmp)
                 entryList.extend(entryListTmp)
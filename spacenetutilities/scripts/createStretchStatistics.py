@@ -0,0 +1,68 @@
+import argparse
+import glob
+import os
+from spacenetutilities.labeltools import coreLabelTools as clT
+
+
+if __name__ == '__main__':
+
+    # python createStretchStatistics.py /data/AOI_2_Vegas_Train/MUL-PanSharpen/*.tif \
+    #                                   --statsFileName /data/AOI_2_Vegas_Train/MUL-PanSharpen_stretch.npz
+    parser = argparse.ArgumentParser(description='Accumulate dataset wide band histograms for the 8bit stretch '
+                                                 'of convertGTiffTo8Bit and returnImgArrayFromArray')
+    parser.add_argument("srcRasterList",
+                        help="Rasters of the AOI, file names, glob patterns or a directory of .tif files",
+                        nargs='+')
+    parser.add_argument("--statsFileName",
+                        help=".npz sidecar the statistics are written to, .npz is appended if missing",
+                        default='stretchStatistics.npz')
+    parser.add_argument("--bandsToInclude",
+                        help="0 based bands to count, all bands if not set",
+                        type=int,
+                        nargs='+',
+                        default=[])
+    parser.add_argument("--overviewLevel",
+                        help="Read this overview level of rasters that have it, -1 reads full resolution",
+                        type=int,
+                        default=-1)
+    parser.add_argument("--sampleFraction",
+                        help="Fraction of the row strips of each raster to read",
+                        type=float,
+                        default=1.0)
+    parser.add_argument("--max_cpu",
+                        help="Number of worker processes, -1 uses every core",
+                        type=int,
+                        default=-1)
+    parser.add_argument("--minPercent",
+                        help="Low percentile printed for the resulting stretch",
+                        type=float,
+                        default=0)
+    parser.add_argument("--maxPercent",
+                        help="High percentile printed for the resulting stretch",
+                        type=float,
+                        default=98)
+
+    args = parser.parse_args()
+
+    rasterFileList = []
+    for srcRaster in args.srcRasterList:
+        if os.path.isdir(srcRaster):
+            rasterFileList.extend(sorted(glob.glob(os.path.join(srcRaster, '*.tif'))))
+        else:
+            rasterFileList.extend(sorted(glob.glob(srcRaster)))
+
+    print('computing stretch statistics of {} rasters'.format(len(rasterFileList)))
+    stretchStatistics = clT.computeStretchStatistics(rasterFileList,
+                                                     bandsToInclude=args.bandsToInclude,
+                                                     overviewLevel=args.overviewLevel,
+                                                     sampleFraction=args.sampleFraction,
+                                                     parallelProcess=args.max_cpu != 1,
+                                                     max_cpu=args.max_cpu,
+                                                     statsFileName=args.statsFileName)
+
+    for bandIndex, histogram in zip(stretchStatistics['bandIndexes'], stretchStatistics['histograms']):
+        print('band {}: {} percentile = {}, {} percentile = {}'.format(
+            bandIndex,
+            args.minPercent, clT.histogramPercentile(histogram, args.minPercent, stretchStatistics['valueOffset']),
+            args.maxPercent, clT.histogramPercentile(histogram, args.maxPercent, stretchStatistics['valueOffset'])))
+    print('statistics written to {}'.format(clT.stretchStatisticsFileName(args.statsFileName)))
@@ -60,6 +60,14 @@ if __name__ == '__main__':
     parser.add_argument("--objectVectorFile",
                         help='Object File for chipping if generating object detection',
                         default='')
+    parser.add_argument("--resume",
+                        help='Skip chips an interrupted run already cut, using the chip journal next to outputDirectory',
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--outputProfile",
+                        help='Tiling and compression of the chips, plain, deflate, zstd, lzw, jpeg or cog',
+                        choices=['plain', 'deflate', 'zstd', 'lzw', 'jpeg', 'cog'],
+                        default='plain')
 
     # geoJSON AOI boundary
     args = parser.parse_args()
@@ -123,5 +131,7 @@ if __name__ == '__main__':
                      createSummaryCSVChallenge=args.createSummaryCSV,
                      csvLabel=args.csvLabel,
                      featureName=args.featureName,
-                     objectSrcFile=objectSrcFile
+                     objectSrcFile=objectSrcFile,
+                     resume=args.resume,
+                     outputProfile=args.outputProfile
                      )
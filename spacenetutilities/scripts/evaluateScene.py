@@ -70,97 +70,294 @@ def writeResultsToScreen(resultsDict):
 
 
 
-def evaluateSpaceNetSolution(summaryTruthFile, summaryProposalFile, resultsOutputFile='', processgeoJson=False,
-                             useParallelProcessing=False, minPolygonSize=0,
-                             iouThreshold=0.5,
-                             AOIList=['Total',
-                                      'AOI_1_Rio',
-                                      'AOI_2_Vegas',
-                                      'AOI_3_Paris',
-                                      'AOI_4_Shanghai',
-                                      'AOI_5_Khartoum']
-                             ):
+def evaluateImagesStreaming(truth_fp, test_fp, minPolygonSize=0, iouThreshold=0.5, matching='greedy',
+                            resultGeoJsonBase='', chunksize=100000):
+    # both csv files are grouped by ImageId with an external sort and scored one image at a time,
+    # peak memory is bounded by the largest image instead of the whole dataset
+    t3 = time.time()
+    result_list = []
+    for image_id, test_polys, truth_polys, truth_index in eT.stream_eval_function_input(truth_fp, test_fp,
+                                                                                       minPolygonSize=minPolygonSize,
+                                                                                       chunksize=chunksize):
+        if resultGeoJsonBase != '':
+            result_list.append(eT.evalfunction(image_id, test_polys, truth_polys,
+                                               resultGeoJsonName=resultGeoJsonBase+"_"+image_id+".geojson",
+                                               threshold=iouThreshold,
+                                               matching=matching))
+        else:
+            result_list.append(eT.evalfunction(image_id, test_polys, truth_polys,
+                                               threshold=iouThreshold,
+                                               matching=matching))
 
-    truth_fp = summaryTruthFile
-    test_fp = summaryProposalFile
-    # check for cores available
-    if useParallelProcessing:
+    print('time For Streaming Evaluation {}s'.format(time.time() - t3))
 
-        max_cpu = multiprocessing.cpu_count()
-        parallel = True
+    return result_list
+
+
+def calculateTotals(result_sum):
+    # result_sum = summed (F1score, true_pos_count, false_pos_count, false_neg_count) of a set of images
+    # returns (F1ScoreTotal, precision, recall, true_pos_total, false_pos_total, false_neg_total)
+    true_pos_total = result_sum[1]
+    false_pos_total = result_sum[2]
+    false_neg_total = result_sum[3]
+    if (float(true_pos_total) + float(false_pos_total))  > 0:
+        precision = float(true_pos_total) / (float(true_pos_total) + float(false_pos_total))
     else:
-        max_cpu = 1
-        parallel = False
+        precision = 0
+
+    if (float(true_pos_total) + float(false_neg_total)) > 0:
+        recall = float(true_pos_total) / (float(true_pos_total) + float(false_neg_total))
+    else:
+        recall = 0
+
+    if (precision + recall) > 0:
+        F1ScoreTotal = 2.0 * precision * recall / (precision + recall)
+    else:
+        F1ScoreTotal = 0
+
+    return F1ScoreTotal, precision, recall, true_pos_total, false_pos_total, false_neg_total
 
-    # initialize scene counts
-    true_pos_counts = []
-    false_pos_counts = []
-    false_neg_counts = []
+
+def ingestSummaryFiles(truth_fp, test_fp, processgeoJson=False, minPolygonSize=0, truthCacheDirectory=''):
+    # returns (test_image_ids, prop_polysIdList, prop_polysPoly, prop_confidenceList, sol_polysIdsList, sol_polysPoly)
+    # if truthCacheDirectory is set the truth file is parsed once into an on disk cache (see eT.load_truth_cache)
+    # and memory-mapped on later runs, so only the proposals are parsed.  Truth polygons whose cached bounds
+    # overlap no proposal are not decoded and are scored as empty polygons (see eT.truth_cache_polys)
 
     t0 = time.time()
     # Start Ingest Of Truth and Test Case
-    if processgeoJson:
+    if truthCacheDirectory != '':
+        truth_cache = eT.load_truth_cache(truth_fp, truthCacheDirectory, processgeoJson=processgeoJson)
+        print('truth cache: ', truth_cache['cacheName'])
+    elif processgeoJson:
         sol_polys = gT.import_summary_geojson(truth_fp, removeNoBuildings=False)
-        prop_polys = gT.import_summary_geojson(test_fp)
-        polyFlag = 'poly'
     else:
-        sol_polys = gT.readwktcsv(truth_fp, removeNoBuildings=False)
-        prop_polys = gT.readwktcsv(test_fp, groundTruthFile=False)
-        polyFlag = 'polyPix'
+        sol_polys = gT.readwktcsv(truth_fp, wktColumn='PolygonWKT_Pix', verbose=True)
+
+    if processgeoJson:
+        prop_polys = gT.import_summary_geojson(test_fp, removeNoBuildings=False)
+    else:
+        prop_polys = gT.readwktcsv(test_fp, verbose=True)
+
+    prop_image_ids = set(prop_polys['ImageId'].astype(str))
+    prop_polys = prop_polys[prop_polys['BuildingId'] != -1]
+
+    prop_polysIdList = prop_polys['ImageId'].values.astype(str)
+    prop_polysPoly = eT.to_geometry_array(prop_polys.geometry.values)
+    if 'Confidence' in prop_polys.columns:
+        prop_confidenceList = prop_polys['Confidence'].values.astype(np.float64)
+    else:
+        prop_confidenceList = np.ones(len(prop_polys), dtype=np.float64)
+
+    if truthCacheDirectory != '':
+        truth_image_ids, sol_polysIdsList, sol_polysPoly = eT.truth_cache_polys(truth_cache,
+                                                                                minPolygonSize=minPolygonSize,
+                                                                                prop_polysIdList=prop_polysIdList,
+                                                                                prop_polysPoly=prop_polysPoly)
+    else:
+        truth_image_ids = sol_polys['ImageId'].astype(str)
+
+        # inspect polygons to ensure they are not too small
+        sol_polys = sol_polys[(sol_polys['BuildingId'] != -1) & (sol_polys.geometry.area > minPolygonSize)]
+        sol_polysIdsList = sol_polys['ImageId'].values.astype(str)
+        sol_polysPoly = eT.to_geometry_array(sol_polys.geometry.values)
 
     t1 = time.time()
     total = t1 - t0
     print('time of ingest: ', total)
 
-    # inspect polygons to ensure they are not too small
-    sol_polys  = [item for item in sol_polys if item["ImageId"] > 0 and
-                                item[polyFlag].GetArea()> minPolygonSize]
-    prop_polys = [item for item in prop_polys if item["ImageId"] > 0 ]
-
-    # Speed up search by preprocessing ImageId and polygonIds
-
-    test_image_ids = [item['ImageId'] for item in prop_polys if item['ImageId'] > 0]
-    test_image_ids2 = [item['ImageId'] for item in sol_polys if item['ImageId'] > 0]
-    test_image_ids.extend(test_image_ids2)
-    test_image_ids = set(test_image_ids)
-
-    prop_polysIdList = np.asarray([item['ImageId'] for item in prop_polys if item["ImageId"] >= 0 and \
-                                   item['BuildingId'] != -1])
-    prop_polysPoly = np.asarray([item[polyFlag] for item in prop_polys if item["ImageId"] >= 0 and \
-                                 item['BuildingId'] != -1])
-
-    sol_polysIdsList = np.asarray([item['ImageId'] for item in sol_polys if item["ImageId"] >= 0 and \
-                                   item['BuildingId'] != -1])
-    sol_polysPoly = np.asarray([item[polyFlag] for item in sol_polys if item["ImageId"] >= 0 and \
-                                item['BuildingId'] != -1])
-    bad_count = 0
-    F1ScoreList = []
+    # every ImageId is scored, including images without buildings or without proposals
+    test_image_ids = prop_image_ids
+    test_image_ids.update(truth_image_ids)
+    test_image_ids = sorted(test_image_ids)
+
+    return test_image_ids, prop_polysIdList, prop_polysPoly, prop_confidenceList, sol_polysIdsList, sol_polysPoly
+
+
+def scoreImages(test_image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly,
+                parallel=False, max_cpu=1, iouThreshold=0.5, matching='greedy', resultGeoJsonBase=''):
+    # returns [(F1score, true_pos_count, false_pos_count, false_neg_count), image_id] in test_image_ids order
+
+    t1 = time.time()
     cpu_count = min(multiprocessing.cpu_count(), max_cpu)
     print('{}'.format(max_cpu))
-    p = multiprocessing.Pool(processes=cpu_count)
-    ResultList = []
 
-    eval_function_input_list = eT.create_eval_function_input((test_image_ids,
-                                                              (prop_polysIdList, prop_polysPoly),
-                                                              (sol_polysIdsList, sol_polysPoly)))
+    if parallel == False:
+        eval_function_input_list = eT.create_eval_function_input(test_image_ids,
+                                                                 prop_polysIdList, prop_polysPoly,
+                                                                 sol_polysIdsList, sol_polysPoly,
+                                                                 createIndex=False)
+    else:
+        # several shards per worker keep all workers busy until the end
+        eval_shard_list = eT.create_eval_shards(test_image_ids,
+                                                prop_polysIdList, prop_polysPoly,
+                                                sol_polysIdsList, sol_polysPoly,
+                                                shard_count=cpu_count*4,
+                                                threshold=iouThreshold,
+                                                matching=matching,
+                                                resultGeoJsonBase=resultGeoJsonBase)
 
     # Calculate Values
     t3 = time.time()
     print('time For DataCreation {}s'.format(t3 - t1))
 
-    # result_list = p.map(eT.evalfunction, eval_function_input_list)
     if parallel == False:
         result_list = []
-        for eval_input in eval_function_input_list:
-            if resultsOutputFile != '':
-                result_list.append(eT.evalfunction(eval_input,
-                                                   resultGeoJsonName=os.path.splitext(resultsOutputFile)[0]+"_"+eval_input[0]+".geojson",
-                                                   threshold=iouThreshold))
+        for image_id, test_polys, truth_polys, truth_index in eval_function_input_list:
+            if resultGeoJsonBase != '':
+                result_list.append(eT.evalfunction(image_id, test_polys, truth_polys,
+                                                   resultGeoJsonName=resultGeoJsonBase+"_"+image_id+".geojson",
+                                                   threshold=iouThreshold,
+                                                   matching=matching))
             else:
-                result_list.append(eT.evalfunction(eval_input,
-                                                   threshold=iouThreshold))
+                result_list.append(eT.evalfunction(image_id, test_polys, truth_polys,
+                                                   threshold=iouThreshold,
+                                                   matching=matching))
+    else:
+        result_list = [None]*len(test_image_ids)
+        p = multiprocessing.Pool(processes=cpu_count)
+        for shard_result in p.imap_unordered(eT.evalfunction_shard, eval_shard_list):
+            for image_pos, result in shard_result:
+                result_list[image_pos] = result
+        p.close()
+        p.join()
+
+    print('time For Evaluation {}s'.format(time.time() - t3))
+
+    return result_list
+
+
+def evaluateImagesInMemory(truth_fp, test_fp, processgeoJson=False, parallel=False, max_cpu=1, minPolygonSize=0,
+                           iouThreshold=0.5, matching='greedy', resultGeoJsonBase='', truthCacheDirectory=''):
+
+    test_image_ids, prop_polysIdList, prop_polysPoly, prop_confidenceList, sol_polysIdsList, sol_polysPoly = \
+        ingestSummaryFiles(truth_fp, test_fp, processgeoJson=processgeoJson, minPolygonSize=minPolygonSize,
+                           truthCacheDirectory=truthCacheDirectory)
+
+    return scoreImages(test_image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly,
+                       parallel=parallel, max_cpu=max_cpu, iouThreshold=iouThreshold, matching=matching,
+                       resultGeoJsonBase=resultGeoJsonBase)
+
+
+def evaluateImagesIncremental(truth_fp, test_fp, incrementalCacheFile, processgeoJson=False, parallel=False,
+                              max_cpu=1, minPolygonSize=0, iouThreshold=0.5, matching='greedy',
+                              resultGeoJsonBase='', truthCacheDirectory=''):
+    # Only images whose proposal or truth polygons (or scoring settings) changed since the run that wrote
+    # incrementalCacheFile are scored, the others reuse their stored result.  incrementalCacheFile is then
+    # rewritten with the results of this run.  Result geojsons are only written for rescored images, the
+    # geojsons of the earlier run are reused, so unchanged images without one are rescored as well (images
+    # without truth polygons never write a geojson, see eT.evalfunction)
+
+    test_image_ids, prop_polysIdList, prop_polysPoly, prop_confidenceList, sol_polysIdsList, sol_polysPoly = \
+        ingestSummaryFiles(truth_fp, test_fp, processgeoJson=processgeoJson, minPolygonSize=minPolygonSize,
+                           truthCacheDirectory=truthCacheDirectory)
+
+    # numpy string arrays, np.isin is slow on pandas string arrays
+    prop_polysIdList = np.asarray(prop_polysIdList, dtype=str)
+    sol_polysIdsList = np.asarray(sol_polysIdsList, dtype=str)
+
+    t1 = time.time()
+    hash_list = eT.image_hash_list(test_image_ids, prop_polysIdList, prop_polysPoly, sol_polysIdsList, sol_polysPoly,
+                                   params={'iouThreshold': iouThreshold, 'matching': matching})
+    image_results = eT.load_image_results(incrementalCacheFile)
+
+    has_truth = np.isin(np.asarray(test_image_ids, dtype=str), sol_polysIdsList)
+    changed_image_ids = [image_id for image_id, image_hash, image_has_truth
+                         in zip(test_image_ids, hash_list, has_truth.tolist())
+                         if image_results.get(image_id, ('', None))[0] != image_hash or
+                         (resultGeoJsonBase != '' and image_has_truth and
+                          not os.path.isfile(resultGeoJsonBase+"_"+image_id+".geojson"))]
+    print('time For Hashing {}s, {} of {} images changed'.format(time.time() - t1, len(changed_image_ids),
+                                                                 len(test_image_ids)))
+
+    if len(changed_image_ids) > 0:
+        prop_keep = np.isin(prop_polysIdList, changed_image_ids)
+        sol_keep = np.isin(sol_polysIdsList, changed_image_ids)
+        changed_result_list = scoreImages(changed_image_ids,
+                                          prop_polysIdList[prop_keep], prop_polysPoly[prop_keep],
+                                          sol_polysIdsList[sol_keep], sol_polysPoly[sol_keep],
+                                          parallel=parallel, max_cpu=max_cpu, iouThreshold=iouThreshold,
+                                          matching=matching, resultGeoJsonBase=resultGeoJsonBase)
+        for result, image_id in changed_result_list:
+            image_results[image_id] = ('', result)
+
+    result_list = [(image_results[image_id][1], image_id) for image_id in test_image_ids]
+    eT.save_image_results(incrementalCacheFile, test_image_ids, hash_list, [item[0] for item in result_list])
+
+    return result_list
+
+
+
+def evaluateSpaceNetSolution(summaryTruthFile, summaryProposalFile, resultsOutputFile='', processgeoJson=False,
+                             useParallelProcessing=False, minPolygonSize=0,
+                             iouThreshold=0.5,
+                             matching='greedy',
+                             streaming=False,
+                             chunksize=100000,
+                             truthCacheDirectory='',
+                             incrementalCacheFile='',
+                             AOIList=['Total',
+                                      'AOI_1_Rio',
+                                      'AOI_2_Vegas',
+                                      'AOI_3_Paris',
+                                      'AOI_4_Shanghai',
+                                      'AOI_5_Khartoum']
+                             ):
+
+    truth_fp = summaryTruthFile
+    test_fp = summaryProposalFile
+
+    # the streaming mode reads both csv files one image at a time in a single process
+    if streaming:
+        unsupportedOptionList = [name for name, isSet in [('processgeoJson', processgeoJson),
+                                                          ('useParallelProcessing', useParallelProcessing),
+                                                          ('truthCacheDirectory', truthCacheDirectory != ''),
+                                                          ('incrementalCacheFile', incrementalCacheFile != '')]
+                                 if isSet]
+        if unsupportedOptionList:
+            raise ValueError('streaming cannot be combined with {}'.format(', '.join(unsupportedOptionList)))
+
+    # check for cores available
+    if useParallelProcessing:
+
+        max_cpu = multiprocessing.cpu_count()
+        parallel = True
+    else:
+        max_cpu = 1
+        parallel = False
+
+    if resultsOutputFile != '':
+        resultGeoJsonBase = os.path.splitext(resultsOutputFile)[0]
     else:
-        result_list = p.map(eT.evalfunction, eval_function_input_list)
+        resultGeoJsonBase = ''
+
+    if streaming:
+        result_list = evaluateImagesStreaming(truth_fp, test_fp,
+                                              minPolygonSize=minPolygonSize,
+                                              iouThreshold=iouThreshold,
+                                              matching=matching,
+                                              resultGeoJsonBase=resultGeoJsonBase,
+                                              chunksize=chunksize)
+    elif incrementalCacheFile != '':
+        result_list = evaluateImagesIncremental(truth_fp, test_fp, incrementalCacheFile,
+                                                processgeoJson=processgeoJson,
+                                                parallel=parallel,
+                                                max_cpu=max_cpu,
+                                                minPolygonSize=minPolygonSize,
+                                                iouThreshold=iouThreshold,
+                                                matching=matching,
+                                                resultGeoJsonBase=resultGeoJsonBase,
+                                                truthCacheDirectory=truthCacheDirectory)
+    else:
+        result_list = evaluateImagesInMemory(truth_fp, test_fp,
+                                             processgeoJson=processgeoJson,
+                                             parallel=parallel,
+                                             max_cpu=max_cpu,
+                                             minPolygonSize=minPolygonSize,
+                                             iouThreshold=iouThreshold,
+                                             matching=matching,
+                                             resultGeoJsonBase=resultGeoJsonBase,
+                                             truthCacheDirectory=truthCacheDirectory)
 
     result_listNP = np.asarray([item[0] for item in result_list])
     result_listName = [item[1] for item in result_list]
@@ -178,23 +375,8 @@ def evaluateSpaceNetSolution(summaryTruthFile, summaryProposalFile, resultsOutpu
 
 
         #result_sum = np.sum(result_listNP, axis=0)
-        true_pos_total = result_sum[1]
-        false_pos_total = result_sum[2]
-        false_neg_total = result_sum[3]
-        if (float(true_pos_total) + float(false_pos_total))  > 0:
-            precision = float(true_pos_total) / (float(true_pos_total) + float(false_pos_total))
-        else:
-            precision = 0
-
-        if (float(true_pos_total) + float(false_neg_total)) > 0:
-            recall = float(true_pos_total) / (float(true_pos_total) + float(false_neg_total))
-        else:
-            recall = 0
-
-        if (precision + recall) > 0:
-            F1ScoreTotal = 2.0 * precision * recall / (precision + recall)
-        else:
-            F1ScoreTotal = 0
+        F1ScoreTotal, precision, recall, true_pos_total, false_pos_total, false_neg_total = \
+            calculateTotals(result_sum)
 
         resultsDict = {'AOI_Name': AOI,
                        'TruthFile': truth_fp,
@@ -228,6 +410,105 @@ def evaluateSpaceNetSolution(summaryTruthFile, summaryProposalFile, resultsOutpu
 
 
 
+    return resultsDictList
+
+
+def evaluateSpaceNetSolutionSweep(summaryTruthFile, summaryProposalFile, resultsOutputFile='', processgeoJson=False,
+                                  minPolygonSize=0,
+                                  iouThresholdList=[0.3, 0.5, 0.75],
+                                  apIouThreshold=0.5,
+                                  matching='greedy',
+                                  truthCacheDirectory='',
+                                  AOIList=['Total',
+                                           'AOI_1_Rio',
+                                           'AOI_2_Vegas',
+                                           'AOI_3_Paris',
+                                           'AOI_4_Shanghai',
+                                           'AOI_5_Khartoum']
+                                  ):
+    # Ingest and compute the pairwise IoU table of each image once, then derive F1/precision/recall at every
+    # threshold in iouThresholdList and a Confidence ranked precision recall curve and average precision
+    # at apIouThreshold.  Returns one resultsDict per AOI and threshold, each with 'IoUThreshold' and
+    # the AOI 'AveragePrecision'
+
+    truth_fp = summaryTruthFile
+    test_fp = summaryProposalFile
+
+    t0 = time.time()
+    test_image_ids, prop_polysIdList, prop_polysPoly, prop_confidenceList, sol_polysIdsList, sol_polysPoly = \
+        ingestSummaryFiles(truth_fp, test_fp, processgeoJson=processgeoJson, minPolygonSize=minPolygonSize,
+                           truthCacheDirectory=truthCacheDirectory)
+
+    prop_rows = eT.group_rows_by_image(test_image_ids, prop_polysIdList)
+    sol_rows = eT.group_rows_by_image(test_image_ids, sol_polysIdsList)
+
+    t3 = time.time()
+    result_list = []
+    for image_id, prop_index, sol_index in zip(test_image_ids, prop_rows, sol_rows):
+        result_list.append(eT.evalfunction_sweep(image_id, prop_polysPoly[prop_index], sol_polysPoly[sol_index],
+                                                 thresholds=iouThresholdList,
+                                                 test_confidences=prop_confidenceList[prop_index],
+                                                 apThreshold=apIouThreshold,
+                                                 matching=matching))
+    print('time For Sweep Evaluation {}s'.format(time.time() - t3))
+
+    # result_listNP[image, threshold] = (F1score, true_pos_count, false_pos_count, false_neg_count)
+    result_listNP = np.asarray([item[0] for item in result_list]).reshape(len(result_list), len(iouThresholdList), 4)
+    result_listName = [item[1] for item in result_list]
+
+    resultsDictList = []
+    for AOI in AOIList:
+        if AOI != 'Total':
+            AOIIndex = [i for i, s in enumerate(result_listName) if AOI in s]
+        else:
+            AOIIndex = list(range(len(result_listName)))
+
+        precisionCurve, recallCurve, confidenceCurve = eT.precision_recall_curve(
+            [result_list[i][2][0] for i in AOIIndex],
+            [result_list[i][2][1] for i in AOIIndex],
+            sum([result_list[i][2][2] for i in AOIIndex]))
+        averagePrecision = eT.average_precision(precisionCurve, recallCurve)
+
+        for thresholdIdx, iouThreshold in enumerate(iouThresholdList):
+            result_sum = np.sum(result_listNP[AOIIndex, thresholdIdx], axis=0)
+            F1ScoreTotal, precision, recall, true_pos_total, false_pos_total, false_neg_total = \
+                calculateTotals(result_sum)
+
+            resultsDict = {'AOI_Name': AOI,
+                           'TruthFile': truth_fp,
+                           'ProposalFile': test_fp,
+                           'IoUThreshold': iouThreshold,
+                           'F1ScoreTotal': F1ScoreTotal,
+                           'PrecisionTotal': precision,
+                           'RecalTotal': recall,
+                           'TruePositiveTotal': true_pos_total,
+                           'FalsePositiveTotal': false_pos_total,
+                           'FalseNegativeTotal': false_neg_total,
+                           'APIoUThreshold': apIouThreshold,
+                           'AveragePrecision': averagePrecision,
+                           'PrecisionCurve': precisionCurve,
+                           'RecallCurve': recallCurve,
+                           'ConfidenceCurve': confidenceCurve,
+                           'PerImageStatsResultList': [(tuple(item[0][thresholdIdx]), item[1]) for item in result_list],
+                           'OutputSummaryFile': resultsOutputFile}
+
+            resultsDictList.append(resultsDict)
+            print('IoU Threshold', iouThreshold)
+            writeResultsToScreen(resultsDict)
+
+        print('AveragePrecision@{}'.format(apIouThreshold), averagePrecision)
+
+    print('total time {}s'.format(time.time() - t0))
+
+    if resultsOutputFile != '':
+        with open(resultsOutputFile, 'w') as csvFile:
+            csvwriter = csv.writer(csvFile, delimiter=',')
+            for resultsDict in resultsDictList:
+                csvwriter.writerow(['IoUThreshold', resultsDict['IoUThreshold']])
+                csvwriter.writerow(['AveragePrecision@{}'.format(resultsDict['APIoUThreshold']),
+                                    resultsDict['AveragePrecision']])
+                writeAOISummaryToCSV(resultsDict, csvwriter)
+
     return resultsDictList
 
 
@@ -360,6 +641,22 @@ if __name__ == "__main__":
                              "Spacenet uses 0.5",
                         type=float,
                         default=0.5)
+    parser.add_argument("--iouThresholdList",
+                        help="Evaluate several IoU thresholds in one pass, i.e. --iouThresholdList 0.3 0.5 0.75. "
+                             "Also reports the Confidence ranked average precision at --apIouThreshold. "
+                             "Not with --streaming, --useParallelProcessing or --incrementalCacheFile",
+                        type=float,
+                        nargs='+',
+                        default=[])
+    parser.add_argument("--apIouThreshold",
+                        help="IoU threshold of the average precision computed with --iouThresholdList",
+                        type=float,
+                        default=0.5)
+    parser.add_argument("--matching",
+                        help="Proposal to truth matching, 'greedy' matches in proposal order, "
+                             "'optimal' maximizes the number of true positives",
+                        choices=['greedy', 'optimal'],
+                        default='greedy')
 
     parser.add_argument("--resultsOutputFile",
                         help="If you would like summary data outwritten to a file, specify the file",
@@ -368,6 +665,25 @@ if __name__ == "__main__":
                         help='results Submitted are in geoJson Format',
                         action='store_true')
 
+    parser.add_argument("--streaming",
+                        help='Group both csv files by ImageId with an external sort and evaluate one image at a time '
+                             'so memory is bounded by the largest image, csv input only, not with '
+                             '--geoJson, --useParallelProcessing, --truthCacheDirectory or --incrementalCacheFile',
+                        action='store_true')
+    parser.add_argument("--chunksize",
+                        help='Number of csv rows sorted in memory at a time in --streaming mode',
+                        type=int,
+                        default=100000)
+
+    parser.add_argument("--truthCacheDirectory",
+                        help='Directory for a parsed copy of the truth file, keyed by a hash of its content. '
+                             'Later runs against the same truth file memory-map it and only parse the proposals',
+                        default='')
+    parser.add_argument("--incrementalCacheFile",
+                        help='Json file of per image results keyed by a hash of each image\'s proposals and truth. '
+                             'Only images that changed since the run that wrote it are rescored',
+                        default='')
+
     parser.add_argument("--useParallelProcessing",
                         help='Convert Image from Native format to 8bit',
                         action='store_true')
@@ -387,20 +703,50 @@ if __name__ == "__main__":
                'AOI_4_Shanghai',
                'AOI_5_Khartoum']
     resultsOutputFile = args.resultsOutputFile
-    summaryDict = evaluateSpaceNetSolution(args.summaryTruthFile,
-                                           args.summaryProposalFile,
-                                           resultsOutputFile=resultsOutputFile,
-                                           processgeoJson=args.geoJson,
-                                           useParallelProcessing=args.useParallelProcessing,
-                                           minPolygonSize=args.polygonMinimumPixels,
-                                           iouThreshold=args.iouThreshold,
-                                           AOIList=AOIList)
+    if args.iouThresholdList:
+        # the sweep scores every image in memory in one process
+        unsupportedOptionList = [option for option, isSet in [('--streaming', args.streaming),
+                                                              ('--useParallelProcessing', args.useParallelProcessing),
+                                                              ('--incrementalCacheFile',
+                                                               args.incrementalCacheFile != '')]
+                                 if isSet]
+        if unsupportedOptionList:
+            parser.error('--iouThresholdList cannot be combined with {}'.format(', '.join(unsupportedOptionList)))
+
+        summaryDict = evaluateSpaceNetSolutionSweep(args.summaryTruthFile,
+                                                    args.summaryProposalFile,
+                                                    resultsOutputFile=resultsOutputFile,
+                                                    processgeoJson=args.geoJson,
+                                                    minPolygonSize=args.polygonMinimumPixels,
+                                                    iouThresholdList=args.iouThresholdList,
+                                                    apIouThreshold=args.apIouThreshold,
+                                                    matching=args.matching,
+                                                    truthCacheDirectory=args.truthCacheDirectory,
+                                                    AOIList=AOIList)
+        # the sweep writes no per image geojson to combine
+        resultsOutputFile = ''
+    else:
+        summaryDict = evaluateSpaceNetSolution(args.summaryTruthFile,
+                                               args.summaryProposalFile,
+                                               resultsOutputFile=resultsOutputFile,
+                                               processgeoJson=args.geoJson,
+                                               useParallelProcessing=args.useParallelProcessing,
+                                               minPolygonSize=args.polygonMinimumPixels,
+                                               iouThreshold=args.iouThreshold,
+                                               matching=args.matching,
+                                               streaming=args.streaming,
+                                               chunksize=args.chunksize,
+                                               truthCacheDirectory=args.truthCacheDirectory,
+                                               incrementalCacheFile=args.incrementalCacheFile,
+                                               AOIList=AOIList)
 
 
 
     if resultsOutputFile != '':
+        # incremental runs keep the per image geojsons, the next run only rewrites those of changed images
         combineGeoJsonAndConvertToWGS84(resultsOutputFile,
-                                        rasterLocationList=args.rasterLocation)
+                                        rasterLocationList=args.rasterLocation,
+                                        removeGeoJsonAfter=(args.incrementalCacheFile == ''))
 
 
 